@@ -0,0 +1,142 @@
+"""Run the Heat Source benchmarks, save the results and compare them to a baseline
+
+    python -m heatsource.Benchmark.Bench [options]
+
+runs the kernel microbenchmarks, then the end-to-end runs of every
+combination of --nodes, --runs and --backends, each in its own process so
+that its peak memory is its own. The results are printed and, with
+--output, saved as JSON. With --baseline, any result that's slower (or
+uses more memory) than the baseline's by more than --tolerance is
+flagged, and the exit status is 1. To make a baseline, save the results
+of a run of the code you're comparing against with --output.
+"""
+from __future__ import division
+import sys
+from optparse import OptionParser
+from subprocess import Popen, PIPE
+from platform import platform
+try:
+    import json
+except ImportError: # Python 2.5
+    import simplejson as json
+
+from ..__version__ import version_string
+
+# Metrics that we compare, and whether more is better
+metrics = (("calls_per_second", True), ("node_steps_per_second", True), ("peak_memory_kb", False))
+
+def Kernels(nodes, repeat):
+    """Return the kernel microbenchmark results of every backend's node kernels that can be loaded here
+
+    A whole reach backend's node kernels are timed if they aren't another
+    backend's (e.g. numpy's are the C module's, but jit has its own)."""
+    from Runs import KernelReach
+    from Kernels import KernelArguments, BenchKernels
+    from ..Stream import Backends
+    backends = []
+    for name in Backends.Names():
+        try: backends.append(Backends.Load(name, False))
+        except ImportError: continue
+    # The node backends first, so that kernels a whole reach backend borrows
+    # (perhaps from a fallback, e.g. numpy's are python's without C) are
+    # timed under the name of the backend they really come from.
+    backends.sort(key=lambda backend: backend.reach is not None)
+    modules = {}
+    for backend in backends:
+        if backend.kernels not in modules.values(): modules[backend.name] = backend.kernels
+    reach, time = KernelReach(nodes)
+    return BenchKernels(modules, KernelArguments(reach, time), repeat)
+
+def Case(case):
+    """Run one end-to-end case, in a new process, and return its results"""
+    module = (__package__ or __name__.rpartition(".")[0]) + ".Bench" # We're __main__ when run with -m
+    child = Popen([sys.executable, "-m", module, "--case", json.dumps(case)], stdout=PIPE)
+    output = child.communicate()[0]
+    if child.returncode: raise Exception("Benchmark run %s failed" % `case`)
+    return json.loads(output.strip().splitlines()[-1]) # The model may have printed something first
+
+def Compare(results, baseline, tolerance):
+    """Return a list of (name, metric, baseline value, value, change) of the results worse than baseline by more than tolerance"""
+    worse = []
+    for section in ("kernels", "runs"):
+        for name, old in sorted(baseline.get(section, {}).items()):
+            new = results.get(section, {}).get(name)
+            if new is None: continue # Not run this time
+            for metric, more in metrics:
+                if not old.get(metric) or new.get(metric) is None: continue
+                change = new[metric] / old[metric] - 1
+                if (more and change < -tolerance) or (not more and change > tolerance):
+                    worse.append((name, metric, old[metric], new[metric], change))
+    return worse
+
+def Report(results, worse):
+    """Print the results, with regressions flagged"""
+    flagged = dict([((name, metric), change) for name, metric, a, b, change in worse])
+    for name, values in sorted(results["kernels"].items()):
+        flag = "  REGRESSION %+0.1f%%" % (flagged[name, "calls_per_second"] * 100) if (name, "calls_per_second") in flagged else ""
+        print "%-36s %14.0f calls/s%s" % (name, values["calls_per_second"], flag)
+    for name, values in sorted(results["runs"].items()):
+        flag = ""
+        for metric, more in metrics:
+            if (name, metric) in flagged: flag += "  REGRESSION %s %+0.1f%%" % (metric, flagged[name, metric] * 100)
+        memory = "%10i kB" % values["peak_memory_kb"] if values["peak_memory_kb"] is not None else ""
+        print "%-36s %14.0f node-steps/s %8.2f s%s%s" % (name, values["node_steps_per_second"], values["seconds"], memory, flag)
+
+def main(args=None):
+    parser = OptionParser(usage="python -m heatsource.Benchmark.Bench [options]")
+    parser.add_option("--nodes", default="1000,10000,100000", help="Reach sizes of the end-to-end runs [%default]")
+    parser.add_option("--hours", type="float", default=2, help="Hours of model time in each run [%default]")
+    parser.add_option("--dt", type="float", default=1, help="Timestep in minutes [%default]")
+    parser.add_option("--runs", default="hs,sh,hy", help="Run types: heat source, shade and hydraulics [%default]")
+    parser.add_option("--backends", default="C,numpy", help="Kernel backends (see Stream/Backends.py) [%default]")
+    parser.add_option("--tributaries", type="int", default=2, help="Tributaries in each reach [%default]")
+    parser.add_option("--sites", type="int", default=1, help="Continuous data sites in each reach [%default]")
+    parser.add_option("--lidar", action="store_true", help="Build the zones as for LiDAR data")
+    parser.add_option("--kernel-nodes", type="int", default=500, help="Nodes to time each kernel over, 0 for none [%default]")
+    parser.add_option("--repeat", type="int", default=3, help="Kernel timings to take the best of [%default]")
+    parser.add_option("--output", help="Save the results to this JSON file")
+    parser.add_option("--baseline", help="Compare the results to this JSON file")
+    parser.add_option("--tolerance", type="float", default=0.1, help="Fraction worse than the baseline that's a regression [%default]")
+    parser.add_option("--case", help="(Used internally) run one end-to-end case and print its JSON results")
+    options, rest = parser.parse_args(args)
+    if options.case:
+        from Runs import RunReach
+        case = json.loads(options.case)
+        print json.dumps(RunReach(**dict([(str(k), v) for k, v in case.items()])))
+        return 0
+
+    results = {"version": version_string, "python": sys.version.split()[0], "platform": platform(),
+               "kernels": {}, "runs": {}}
+    if options.kernel_nodes: results["kernels"] = Kernels(options.kernel_nodes, options.repeat)
+    for nodes in [int(x) for x in options.nodes.split(",") if x]:
+        for run_type in [x for x in options.runs.split(",") if x]:
+            for backend in [x for x in options.backends.split(",") if x]:
+                case = {"nodes": nodes, "hours": options.hours, "dt": options.dt, "run_type": run_type,
+                        "backend": backend, "tributaries": options.tributaries,
+                        "sites": options.sites, "lidar": bool(options.lidar)}
+                result = Case(case)
+                # Named for the backend that ran, which falls back (e.g. from
+                # C to python) if the one asked for isn't available.
+                name = "%s-%s-%i" % (run_type, result["backend"], nodes)
+                if result["backend"] != backend:
+                    print "The %s backend isn't available here, so %s ran in its place" % (backend, result["backend"])
+                if name in results["runs"]: continue # Already run, as itself or another's fallback
+                results["runs"][name] = result
+    worse = []
+    if options.baseline:
+        f = open(options.baseline)
+        try: baseline = json.load(f)
+        finally: f.close()
+        worse = Compare(results, baseline, options.tolerance)
+    Report(results, worse)
+    if options.output:
+        f = open(options.output, "w")
+        try: json.dump(results, f, indent=1, sort_keys=True)
+        finally: f.close()
+    if worse:
+        print "%i regression(s) against %s" % (len(worse), options.baseline)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""Microbenchmarks of the Heat Source kernels
+
+The kernels are the routines of PyHeatsource, and of the other backends'
+node kernels (see Stream/Backends.py), such as the C module, HSmodule,
+which has the same calculations for those of them that the model calls,
+and JitHeatsource, which has all of them, compiled.
+Each is timed calling it with every node's arguments, as
+StreamNode calls it, from a synthetic reach that has been run up to a
+time of day, so that the arguments are the values the model would
+really pass.
+"""
+from __future__ import division
+from time import gmtime
+from timeit import default_timer as clock
+
+from ..Dieties.IniParamsDiety import IniParams
+from ..Dieties.ChronosDiety import JulianCentury
+from ..Stream import PyHeatsource
+
+def KernelArguments(nodes, time):
+    """Return a dictionary of the argument tuples of each kernel, one per node, by kernel name
+
+    nodes is a list of initialized (and, for realistic values, run)
+    StreamNodes in model order, and time is the model time to use for
+    the solar position and forcing data."""
+    head = nodes[0]
+    year, month, day, hour, minute, second, weekday, JD, dst = gmtime(time)
+    JDC = JulianCentury(time)
+    position = head.Latitude, head.Longitude, hour, minute, second, head.UTC_offset, JDC
+    Altitude, Zenith, Daytime, dir = PyHeatsource.CalcSolarPosition(*position)
+    args = dict([(name, []) for name in ("CalcSolarPosition", "GetStreamGeometry", "CalcMuskingum", "CalcFlows",
+                                          "GetSolarFlux", "GetGroundFluxes", "CalcMacCormick", "CalcHeatFluxes")])
+    for node in nodes[1:]:
+        up, down = node.prev_km, node.next_km
+        cloud, wind, humidity, T_air = node.ContData[time]
+        Q_tribs, T_tribs = node.Q_tribs[time], node.T_tribs[time]
+        inputs = node.Q_in + sum(Q_tribs) - node.Q_out - node.E
+        F_Solar = list(node.F_Solar)
+        args["CalcSolarPosition"].append((node.Latitude, node.Longitude, hour, minute, second, node.UTC_offset, JDC))
+        args["GetStreamGeometry"].append((node.Q, node.W_b, node.z, node.n, node.S, node.d_w, node.dx, node.dt))
+        args["CalcMuskingum"].append((node.Q, node.U, node.W_w, node.S, node.dx, node.dt))
+        args["CalcFlows"].append((node.U, node.W_w, node.W_b, node.S, node.dx, node.dt, node.z, node.n, node.d_cont,
+                                  node.Q, up.Q, up.Q_prev, inputs, -1))
+        args["GetSolarFlux"].append((hour, JD, Altitude, Zenith, cloud, node.d_w, node.W_b, node.Elevation,
+                                     node.TopoFactor, node.ViewToSky, IniParams["transsample"], node.phi,
+                                     IniParams["emergent"], node.VDensity, node.VHeight, node.ShaderList[dir]))
+        args["GetGroundFluxes"].append((cloud, wind, humidity, T_air, node.Elevation, node.phi, node.VHeight,
+                                        node.ViewToSky, node.SedDepth, node.dx, node.dt, node.SedThermCond,
+                                        node.SedThermDiff, IniParams["calcalluvium"], IniParams["alluviumtemp"],
+                                        node.P_w, node.W_w, IniParams["emergent"], IniParams["penman"],
+                                        IniParams["wind_a"], IniParams["wind_b"], IniParams["calcevap"],
+                                        node.T_prev, node.T_sed, node.Q_hyp, F_Solar[5], F_Solar[7]))
+        args["CalcMacCormick"].append((node.dt, node.dx, node.U, node.T_sed, node.T_prev, node.Q_hyp, Q_tribs, T_tribs,
+                                       up.Q, node.Delta_T, node.Disp, True, node.S1, up.T, node.T, down.T,
+                                       node.Q_in, node.T_in, down.Mix_T_Delta))
+        args["CalcHeatFluxes"].append(((cloud, wind, humidity, T_air), node.C_args, node.d_w, node.A, node.P_w, node.W_w,
+                                       node.U, Q_tribs, T_tribs, node.T_prev, node.T_sed, node.Q_hyp, down.T_prev,
+                                       node.ShaderList[dir], node.Disp, hour, JD, Daytime, Altitude, Zenith,
+                                       up.Q_prev, up.T_prev, False, down.Mix_T_Delta))
+    return args
+
+def TimeKernel(function, arguments, repeat=3):
+    """Return the fastest of repeat times, in seconds per call, of calling function with each argument tuple"""
+    best = None
+    for i in xrange(repeat):
+        start = clock()
+        for args in arguments: function(*args)
+        seconds = (clock() - start) / len(arguments)
+        if best is None or seconds < best: best = seconds
+    return best
+
+def BenchKernels(modules, arguments, repeat=3):
+    """Time every kernel of each module that has it
+
+    modules is a dictionary of kernel modules by name (e.g. {"python":
+    PyHeatsource}) and arguments is from KernelArguments(). Returns a
+    dictionary of {"calls_per_second", "calls"} by "module.kernel"."""
+    results = {}
+    for name, module in sorted(modules.items()):
+        for kernel, args in sorted(arguments.items()):
+            function = getattr(module, kernel, None)
+            if function is None or not args: continue
+            seconds = TimeKernel(function, args, repeat)
+            results["%s.%s" % (name, kernel)] = {"calls_per_second": 1 / seconds if seconds else 0.0,
+                                                 "calls": len(args)}
+    return results
@@ -0,0 +1,261 @@
+"""Replay a kernel trace through each kernel backend
+
+    python -m heatsource.Benchmark.Replay Kernels.trace [options]
+
+reads a trace recorded from a model run (see Utils/KernelTrace.py), calls
+each recorded kernel with the recorded arguments in each backend, and
+prints how fast it was and the largest difference between its results
+and the recorded ones. The backends are those of Stream/Backends.py that
+can be loaded here. The node by node ones (e.g. python and C) are called
+one call at a time, as the nodes call them, and the whole reach ones
+(numpy and jit) with every call of a kernel at once, as arrays.
+
+A whole reach backend does the work of each kernel with the array
+routines that the ReachEngine uses (e.g. NpHeatsource's). Its arguments
+are put into arrays before it's timed, as the ReachEngine keeps them, so
+its time is only that of the calculation. If its node kernels aren't
+those of another backend, they're replayed too, as e.g. "jit-nodes".
+"""
+from __future__ import division
+import sys
+from optparse import OptionParser
+from timeit import default_timer as clock
+from numpy import asarray, zeros, float64, nan, isnan
+
+from ..Utils.KernelTrace import ReadTrace, Flatten, kernels
+from ..Stream import Backends
+
+def Columns(calls, indices, positions):
+    """Return an array of the argument at each position, over the calls at indices"""
+    return [asarray([calls[i][p] for i in indices], dtype=float64) for p in positions]
+
+def Tributaries(calls, indices, Q, T):
+    """Return the (index, Q, T) arrays of MixTributaries() from the tributary tuples at positions Q and T"""
+    index, Q_trib, T_trib = [], [], []
+    for k in xrange(len(indices)):
+        args = calls[indices[k]]
+        for j in xrange(len(args[Q])):
+            index.append(k)
+            Q_trib.append(args[Q][j] if args[Q][j] is not None else nan)
+            T_trib.append(args[T][j] if args[T][j] is not None else nan)
+    return asarray(index, dtype=int), asarray(Q_trib, dtype=float64), asarray(T_trib, dtype=float64)
+
+def Groups(calls, key):
+    """Return a sorted list of (key, indices) of the calls, grouped by key(arguments)"""
+    groups = {}
+    for i in xrange(len(calls)): groups.setdefault(key(calls[i]), []).append(i)
+    return sorted(groups.items())
+
+class ScalarBackend(object):
+    """Call a kernel module one call at a time, as the nodes do"""
+    def __init__(self, module):
+        self.module = module
+
+    def Has(self, kernel):
+        return hasattr(self.module, kernel)
+
+    def Prepare(self, kernel, calls):
+        return getattr(self.module, kernel), calls
+
+    def Call(self, kernel, prepared):
+        function, calls = prepared
+        return [function(*args) for args in calls]
+
+    def Unpack(self, kernel, prepared, output):
+        return output
+
+class VectorBackend(object):
+    """Do every call of a kernel at once, with the whole reach routines of a backend
+
+    Calls are grouped by the arguments that are flags (e.g. whether it's
+    daytime) or constants of the model run, and each group is calculated
+    as arrays. Prepare() returns the groups' arrays, Call() does the
+    calculation and Unpack() turns it into a result for each call, in the
+    form that PyHeatsource returns."""
+    def __init__(self, reach):
+        self.reach = reach # The module of routines, e.g. NpHeatsource
+
+    def Has(self, kernel):
+        return hasattr(self, "Prepare" + kernel)
+
+    def Prepare(self, kernel, calls):
+        return getattr(self, "Prepare" + kernel)(calls)
+
+    def Call(self, kernel, prepared):
+        return getattr(self, "Call" + kernel)(prepared)
+
+    def Unpack(self, kernel, prepared, output):
+        results = [None] * sum([len(indices) for key, indices, arrays in prepared])
+        for (key, indices, arrays), values in zip(prepared, output):
+            for k in xrange(len(indices)): results[indices[k]] = values(k)
+        return results
+
+    def PrepareCalcFlows(self, calls):
+        # U, W_w, W_b, S, dx, dt, z, n, D_est, Q, Q_up, Q_up_prev, inputs, Q_bc
+        indices = range(len(calls))
+        return [(None, indices, Columns(calls, indices, range(14)))]
+
+    def CallCalcFlows(self, prepared):
+        np_HS = self.reach
+        output = []
+        for key, indices, (U, W_w, W_b, S, dx, dt, z, n, D_est, Q, Q_up, Q_up_prev, inputs, Q_bc) in prepared:
+            Q_new = Q_bc.copy()
+            routed = Q_bc < 0 # Otherwise it's a boundary condition
+            if routed.any():
+                Q1 = Q_up[routed] + inputs[routed]
+                Q2 = Q_up_prev[routed] + inputs[routed]
+                C1, C2, C3 = np_HS.CalcMuskingum(Q2, U[routed], W_w[routed], S[routed], dx[routed], dt[routed])
+                Q_new[routed] = C1*Q1 + C2*Q2 + C3*Q[routed]
+            geometry = np_HS.GetStreamGeometry(Q_new, W_b, z, n, S, D_est, dx, dt)
+            output.append(lambda k, Q_new=Q_new, geometry=geometry: (Q_new[k], tuple([g[k] for g in geometry])))
+        return output
+
+    def PrepareCalcMacCormick(self, calls):
+        # dt, dx, U, T_sed, T_prev, Q_hyp, (Q_tup, T_tup), Q_up, Delta_T, Disp, (S1), S1_value,
+        # T0, T1, T2, Q_accr, T_accr, MixTDelta_dn
+        prepared = []
+        for S1, indices in Groups(calls, lambda args: bool(args[11])):
+            arrays = Columns(calls, indices, (0, 1, 2, 3, 4, 5, 8, 9, 10, 12, 13, 14, 15, 16, 17, 18))
+            prepared.append((S1, indices, (arrays, Tributaries(calls, indices, 6, 7))))
+        return prepared
+
+    def CallCalcMacCormick(self, prepared):
+        np_HS = self.reach
+        output = []
+        for S1, indices, (arrays, tribs) in prepared:
+            dt, dx, U, T_sed, T_prev, Q_hyp, Q_up, Delta_T, Disp, S1_value, T0, T1, T2, Q_accr, T_accr, Mix = arrays
+            Q_in, T_in = np_HS.MixTributaries(*tribs + (len(indices),))
+            Temp, S, T_mix = np_HS.CalcMacCormick(dt, dx, U, T_sed, T_prev, Q_hyp, Q_in, T_in, Q_up, Delta_T, Disp,
+                                                  S1, S1_value, T0, T1, T2, Q_accr, T_accr, Mix)
+            output.append(lambda k, Temp=Temp, S=S, T_mix=T_mix: (Temp[k], S[k], T_mix[k]))
+        return output
+
+    def PrepareCalcHeatFluxes(self, calls):
+        # The flags and run constants: daytime, solar_only and, from C_args, has_prev, emergent,
+        # calcevap, penman, calcalluv, T_alluv, wind_a, wind_b and SampleDist
+        key = lambda args: (bool(args[17]), bool(args[22])) + tuple([args[1][i] for i in (14, 16, 19, 20, 21, 22, 17, 18, 15)])
+        prepared = []
+        for flags, indices in Groups(calls, key):
+            cont = asarray([calls[i][0] for i in indices], dtype=float64).T
+            C_args = asarray([calls[i][1] for i in indices], dtype=float64).T
+            # d_w, area, P_w, W_w, U, T_prev, T_sed, Q_hyp, T_dn_prev, Disp, hour, JD,
+            # Altitude, Zenith, Q_up_prev, T_up_prev, MixTDelta_dn_prev
+            arrays = Columns(calls, indices, (2, 3, 4, 5, 6, 9, 10, 11, 12, 14, 15, 16, 18, 19, 20, 21, 23))
+            # Rip extinction and vegetation angle are by zone, as in NpHeatsource.ShaderArrays()
+            shade = [asarray([calls[i][13][j] for i in indices], dtype=float64) for j in xrange(5)]
+            prepared.append((flags, indices, (cont, C_args, arrays, shade, Tributaries(calls, indices, 7, 8))))
+        return prepared
+
+    def CallCalcHeatFluxes(self, prepared):
+        np_HS = self.reach
+        output = []
+        for flags, indices, (cont, C_args, arrays, shade, tribs) in prepared:
+            daytime, solar_only, has_prev, emergent, calcevap, penman, calcalluv, T_alluv, wind_a, wind_b, SampleDist = flags
+            cloud, wind, humidity, T_air = cont
+            W_b, Elevation, TopoFactor, ViewToSky, phi, VDensity, VHeight, SedDepth, dx, dt, SedThermCond, \
+                SedThermDiff, Q_accr, T_accr = C_args[:14]
+            d_w, area, P_w, W_w, U, T_prev, T_sed, Q_hyp, T_dn_prev, Disp, hour, JD, Altitude, Zenith, \
+                Q_up_prev, T_up_prev, Mix = arrays
+            solar = zeros((len(indices), 8), dtype=float64)
+            if daytime:
+                solar = np_HS.GetSolarFlux(hour, JD, Altitude, Zenith, cloud, d_w, W_b, Elevation, TopoFactor,
+                                           ViewToSky, SampleDist, phi, emergent, VDensity, VHeight, shade)
+            if solar_only:
+                empty = ([0] * 3,) if has_prev else ()
+                output.append(lambda k, solar=solar, empty=empty: (solar[k], [0] * 9, 0.0, 0.0) + empty)
+                continue
+            ground = np_HS.GetGroundFluxes(cloud, wind, humidity, T_air, Elevation, phi, VHeight, ViewToSky, SedDepth,
+                                           dx, dt, SedThermCond, SedThermDiff, calcalluv, T_alluv, P_w, W_w,
+                                           emergent, penman, wind_a, wind_b, calcevap, T_prev, T_sed, Q_hyp,
+                                           solar[:,5], solar[:,7])
+            F_Total = solar[:,6] + ground[0] + ground[2] + ground[6] + ground[7]
+            Delta_T = F_Total * dt / ((area / W_w) * 4182 * 998.2)
+            Mac = ()
+            if has_prev:
+                Q_in, T_in = np_HS.MixTributaries(*tribs + (len(indices),))
+                Mac = np_HS.CalcMacCormick(dt, dx, U, ground[1], T_prev, Q_hyp, Q_in, T_in, Q_up_prev, Delta_T, Disp,
+                                           False, 0.0, T_up_prev, T_prev, T_dn_prev, Q_accr, T_accr, Mix),
+            output.append(lambda k, solar=solar, ground=ground, F_Total=F_Total, Delta_T=Delta_T, Mac=Mac:
+                          (solar[k], tuple([g[k] for g in ground]), F_Total[k], Delta_T[k]) +
+                          tuple([tuple([x[k] for x in m]) for m in Mac]))
+        return output
+
+def Available():
+    """Return a dictionary of the replay backends of the kernel backends that can be loaded here, by name"""
+    loaded = []
+    for name in Backends.Names():
+        try: loaded.append(Backends.Load(name, False))
+        except ImportError: continue # e.g. the C module isn't built for this platform
+    backends = {}
+    nodes = [x.kernels for x in loaded if x.reach is None]
+    for backend in loaded:
+        if backend.reach is None:
+            backends[backend.name] = ScalarBackend(backend.kernels)
+            continue
+        backends[backend.name] = VectorBackend(backend.reach)
+        if backend.kernels not in nodes: backends[backend.name + "-nodes"] = ScalarBackend(backend.kernels)
+    return backends
+
+def Difference(a, b):
+    """Return the largest absolute difference between the numbers of two results of the same shape"""
+    x, y = [], []
+    Flatten(a, [], x)
+    Flatten(b, [], y)
+    if len(x) != len(y): return float("inf")
+    x, y = asarray(x, dtype=float64), asarray(y, dtype=float64)
+    if not len(x): return 0.0
+    difference = abs(x - y)
+    # Both NaN is the same result, and one of them is as different as can be
+    difference[isnan(x) & isnan(y)] = 0.0
+    difference[isnan(x) != isnan(y)] = float("inf")
+    return float(difference.max())
+
+def Replay(calls, backend, kernel, repeat=3):
+    """Return (seconds per call, largest difference from the recorded results, error) of a kernel in a backend
+
+    calls is the list from ReadTrace(), and the time is the fastest of
+    repeat replays of every call to kernel. If the backend raises an
+    exception, the seconds and difference are None and error is its message."""
+    recorded = [c for c in calls if c[0] == kernel]
+    args = [c[3] for c in recorded]
+    try:
+        prepared = backend.Prepare(kernel, args)
+        best = None
+        for i in xrange(repeat):
+            start = clock()
+            output = backend.Call(kernel, prepared)
+            seconds = clock() - start
+            if best is None or seconds < best: best = seconds
+        results = backend.Unpack(kernel, prepared, output)
+    except Exception, (e):
+        return None, None, "%s: %s" % (e.__class__.__name__, e)
+    difference = max([Difference(results[i], recorded[i][4]) for i in xrange(len(recorded))])
+    return best / len(recorded), difference, None
+
+def main(args=None):
+    parser = OptionParser(usage="python -m heatsource.Benchmark.Replay tracefile [options]")
+    parser.add_option("--backends", default=",".join(Backends.Names()),
+                      help="Backends to replay the trace in (see Stream/Backends.py) [%default]")
+    parser.add_option("--repeat", type="int", default=3, help="Replays to take the fastest of [%default]")
+    options, rest = parser.parse_args(args)
+    if len(rest) != 1: parser.error("Give one trace file")
+    module, calls = ReadTrace(rest[0])
+    print "%i calls recorded from %s" % (len(calls), module)
+    available = Available()
+    for name in [x for x in options.backends.split(",") if x]:
+        if name not in available:
+            print "%-10s not available" % name
+            continue
+        for label in [x for x in (name, name + "-nodes") if x in available]:
+            backend = available[label]
+            for kernel in kernels:
+                count = len([c for c in calls if c[0] == kernel])
+                if not count or not backend.Has(kernel): continue
+                seconds, difference, error = Replay(calls, backend, kernel, options.repeat)
+                if error is not None: print "%-10s %-16s %8i calls  failed: %s" % (label, kernel, count, error)
+                else: print "%-10s %-16s %8i calls %14.0f calls/s  max difference %0.3g" % (label, kernel, count,
+                                                                                             1 / seconds if seconds else 0.0, difference)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""End-to-end benchmark runs of ModelControl on synthetic reaches"""
+from __future__ import division
+from sys import platform
+from os import sep
+from tempfile import mkdtemp
+from shutil import rmtree
+from timeit import default_timer as clock
+try:
+    from resource import getrusage, RUSAGE_SELF
+except ImportError: # Windows
+    getrusage = None
+
+from ..Dieties.ChronosDiety import Chronos
+from ..Dieties.IniParamsDiety import IniParams
+from ..Utils.Logger import Logger
+from ..Utils.Timer import Timer
+from ..BigRedButton import ModelControl
+from Synthetic import SyntheticReach
+
+run_types = {"hs": 0, "sh": 1, "hy": 2} # Heat Source, shade (solar) only and hydraulics only
+
+def PeakMemory():
+    """Return the peak resident memory of this process so far, in kilobytes, or None if we can't tell"""
+    if getrusage is None: return None
+    peak = getrusage(RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if platform == "darwin" else peak # Bytes on a Mac
+
+def RunReach(nodes, hours=2, dt=1, run_type="hs", **options):
+    """Build a synthetic reach and run the model on it, returning a dictionary of results
+
+    nodes, dt (in minutes) and anything else are passed to SyntheticReach,
+    whose IniParams options include the model's own (e.g. backend="numpy").
+    The run is hours long, and its output goes to a temporary directory
+    that's removed afterwards. The results are the run's wall time (without
+    building the reach), node-steps per second, peak memory of the process,
+    the seconds of each timed phase (see Utils/Timer.py) and the name of
+    the backend that ran, which is a fallback if the one asked for can't
+    be loaded here."""
+    outputdir = mkdtemp(prefix="heatsource_benchmark_")
+    try:
+        built = clock()
+        reach = SyntheticReach(nodes, hours / 24, dt, outputdir=outputdir + sep, log=Logger,
+                               run_type=run_types[run_type], **options)
+        model = ModelControl(None, run_types[run_type], interface=reach)
+        began = clock()
+        model.Run()
+        seconds = clock() - began
+        steps = int((Chronos.stop - Chronos.spin_start) // Chronos.dt) + 1 # Timesteps of the run
+        steps *= len(model.reachlist)
+        return {"backend": model.Backend.name, "nodes": len(model.reachlist), "node_steps": steps, "seconds": seconds,
+                "setup_seconds": began - built, "node_steps_per_second": steps / seconds if seconds else 0.0,
+                "peak_memory_kb": PeakMemory(),
+                "phases": dict([(name, secs) for name, calls, secs, fraction in Timer.Rows()])}
+    finally: rmtree(outputdir, True)
+
+def KernelReach(nodes=500, hour=13, dt=1, **options):
+    """Run a synthetic reach up to hour (of its first day), for its nodes' kernel arguments
+
+    Returns the list of nodes, in model order, and the time of the last
+    timestep, for Kernels.KernelArguments()."""
+    outputdir = mkdtemp(prefix="heatsource_benchmark_")
+    try:
+        reach = SyntheticReach(nodes, (hour * 3600 + dt * 60) / 86400, dt, outputdir=outputdir + sep,
+                               log=Logger, **options)
+        model = ModelControl(None, 0, interface=reach)
+        model.Run()
+        return model.reachlist, int(IniParams["modelend"]) + 1 - IniParams["dt"]
+    finally: rmtree(outputdir, True)
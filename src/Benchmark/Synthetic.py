@@ -0,0 +1,204 @@
+"""Synthetic reaches, built without a workbook
+
+SyntheticReach stands in for the ExcelInterface: it sets up the
+IniParams and builds a dictionary of StreamNodes, by kilometer, the same
+way that the ExcelInterface does from a workbook, but from random (but
+repeatable) values. Pass it to ModelControl as the interface to run the
+model on it.
+"""
+from __future__ import division
+from math import log, degrees, atan, sin, pi
+from random import Random
+from os.path import join, normpath
+
+from ..Dieties.IniParamsDiety import IniParams
+from ..Stream.StreamNode import StreamNode
+from ..Utils.Dictionaries import Interpolator
+
+def Zones(node, heights, densities, overhangs, elevations, topo):
+    """Set a node's TopoFactor, ShaderList and ViewToSky from its land cover
+
+    heights, densities and overhangs are the 29 values of the TTools Data
+    columns (emergent vegetation first, then 4 zones in each of 7
+    directions), elevations the 28 zone elevations, and topo the
+    (west, south, east) topographic angles. This is the calculation of
+    ExcelInterface.BuildZonesNormal()."""
+    node.VHeight, node.VDensity, node.Overhang = heights[0], densities[0], overhangs[0]
+    topo_w, topo_s, topo_e = topo
+    node.TopoFactor = (topo_w + topo_s + topo_e)/(90*3)
+    ElevationList = (topo_e, topo_e, 0.5*(topo_e+topo_s), topo_s, 0.5*(topo_s+topo_w), topo_w, topo_w)
+    VTS_Total = 0
+    node.ShaderList = ()
+    for i in xrange(7): # Directions
+        T_Full, T_None, rip = (), (), ()
+        for j in xrange(4): # Zones
+            Vheight, Vdens = heights[i*4+j+1], densities[i*4+j+1]
+            Overhang = overhangs[i*4+j+1] if not j else 0 # No overhang away from the stream
+            if not j: LC_Angle_Max = 0
+            SH = elevations[i*4+j] - node.Elevation
+            VH = Vheight + SH
+            RE = -log(1-Vdens)/10 if Vdens < 1 else 1
+            LC_Distance = IniParams["transsample"] * (j + 0.5)
+            if not j: LC_Distance -= Overhang
+            if LC_Distance <= 0: LC_Distance = 0.00001
+            T_Full += degrees(atan(VH/LC_Distance)),
+            T_None += degrees(atan(SH/LC_Distance)),
+            LC_Angle = degrees(atan(VH / LC_Distance) * Vdens)
+            if not j or LC_Angle_Max < LC_Angle: LC_Angle_Max = LC_Angle
+            if j == 3: VTS_Total += LC_Angle_Max
+            rip += RE,
+        node.ShaderList += (max(T_Full), ElevationList[i], max(T_None), rip, T_Full),
+    node.ViewToSky = 1 - VTS_Total / (7 * 90)
+
+class SyntheticReach(object):
+    """A reach of StreamNodes made up from random values, in place of a workbook"""
+    # Land cover codes: (height, density, overhang), from bare ground to forest
+    landcover = ((0.0, 0.0, 0.0), (0.5, 0.3, 0.0), (2.0, 0.5, 0.5), (10.0, 0.6, 1.0), (25.0, 0.75, 2.0), (40.0, 0.85, 3.0))
+    def __init__(self, nodes=1000, days=1, dt=1, tributaries=2, sites=1, lidar=False, flushdays=0,
+                 outputdir=".", log=None, run_type=0, seed=1, start=1057017600, **params):
+        """SyntheticReach([nodes, days, dt, tributaries, sites, lidar, ...]) -> Class instance
+
+        nodes is the number of StreamNodes below the headwater, days the
+        model days, dt the timestep in minutes, tributaries the number of
+        inflow sites and sites the number of continuous (meteorological)
+        data sites, spread evenly along the reach. If lidar is True, the
+        zones are built as for LiDAR vegetation heights, with the density
+        and overhang of every zone the same. flushdays are spun up before
+        the start, which is in seconds since the epoch (July 1, 2003 by
+        default). log is set to write to outputdir, as by the
+        ExcelInterface, and anything else is put in the IniParams, so
+        e.g. penman=True uses the Penman evaporation method. The values
+        are drawn from a Random(seed), so the same arguments give the
+        same reach."""
+        self.run_type = run_type
+        self.random = Random(seed)
+        IniParams.update({"name": "Synthetic reach", "length": nodes * 0.3, "outputdir": outputdir,
+                          "date": start, "modelstart": start, "modelend": start + days * 86400 - 1,
+                          "end": start + days * 86400 - 1, "flushdays": flushdays, "offset": 7,
+                          "dt": dt * 60, "dx": 300.0, "longsample": 50.0, "transsample": 8.0,
+                          "inflowsites": tributaries, "contsites": sites, "calcevap": True,
+                          "evapmethod": "Mass Transfer", "penman": False, "wind_a": 1.505e-9, "wind_b": 1.6e-9,
+                          "calcalluvium": False, "alluviumtemp": 0.0, "emergent": True, "lidar": lidar,
+                          "lcdensity": 0.7, "lcoverhang": 1.0})
+        IniParams.update(params)
+        IniParams["flushtimestart"] = IniParams["modelstart"] - IniParams["flushdays"] * 86400
+        if log is not None: log.SetFile(normpath(join(outputdir, "outfile.log")))
+        # Hourly data, with an hour to spare on either side of the run
+        self.times = range(int(IniParams["modelstart"]) - 3600, int(IniParams["modelend"]) + 7200, 3600)
+        self.Reach = {}
+        self.BuildNodes(nodes)
+        keys = sorted(self.Reach.keys(), reverse=True) # Headwater to mouth
+        self.BuildZones(keys, lidar)
+        self.SetForcing(keys, tributaries, sites)
+        self.OrientNodes(keys)
+
+    def PB(self, message, num=None, divisor=None):
+        """Nowhere to show progress"""
+        pass
+
+    def Diurnal(self, time, mean, amplitude, peak=15):
+        """A daily sine wave, at its highest at the peak hour"""
+        return mean + amplitude * sin((((time % 86400) / 3600 - peak) / 24 + 0.25) * 2 * pi)
+
+    def Series(self, function):
+        """Return an hourly Interpolator of function(time), cut to the model's times as the ExcelInterface does"""
+        series = Interpolator()
+        for time in self.times: series[time] = function(time)
+        return series.View(IniParams["flushtimestart"], IniParams["modelend"], aft=1)
+
+    def BuildNodes(self, nodes):
+        """Build the headwater and nodes, with channel morphology, as ExcelInterface.BuildNodes() does"""
+        rnd = self.random
+        Q_bc = self.Series(lambda t: self.Diurnal(t, 2.0, 0.2, 6))
+        T_bc = self.Series(lambda t: self.Diurnal(t, 14.0, 3.0))
+        elevation = 300.0
+        for i in xrange(nodes + 1):
+            node = StreamNode(run_type=self.run_type, Q_mb=0.0)
+            node.km = (nodes - i) * IniParams["dx"] / 1000
+            node.Longitude, node.Latitude = -122.5 + i * 0.0002, 45.0 + i * 0.0005
+            node.S = rnd.uniform(0.0005, 0.005)
+            elevation -= node.S * IniParams["dx"]
+            node.Elevation = elevation
+            node.W_b, node.z, node.n = rnd.uniform(3, 10), rnd.uniform(0.5, 2), rnd.uniform(0.03, 0.06)
+            node.SedThermCond, node.SedThermDiff, node.SedDepth = 1.57, 0.0064, rnd.uniform(0.1, 0.5)
+            node.hyp_percent, node.phi = rnd.uniform(0, 0.05), rnd.uniform(0.2, 0.4)
+            node.FLIR_Time = node.FLIR_Temp = None
+            node.Q_cont = node.d_cont = 0.0
+            # Accretion at a few nodes and withdrawals at fewer
+            node.Q_in = rnd.uniform(0.001, 0.01) if rnd.random() < 0.1 else 0.0
+            node.T_in = rnd.uniform(8, 14)
+            node.Q_out = rnd.uniform(0.001, 0.005) if rnd.random() < 0.02 else 0.0
+            if not i: node.Q_bc, node.T_bc = Q_bc, T_bc
+            self.InitializeNode(node, T_bc)
+            self.Reach[node.km] = node
+        self.Reach[max(self.Reach)].dx = IniParams["longsample"] # As for the boundary node of a workbook
+
+    def InitializeNode(self, node, T_bc):
+        """As ExcelInterface.InitializeNode()"""
+        for time in self.times:
+            node.Q_tribs[time] = ()
+            node.T_tribs[time] = ()
+        node.dx, node.dt = IniParams["dx"], IniParams["dt"]
+        if self.run_type == 2: node.T = node.T_prev = node.T_sed = 0.0
+        else: node.T = node.T_prev = node.T_sed = T_bc[min(T_bc.keys())]
+        if self.run_type == 1:
+            for attr in ["d_w", "A", "P_w", "W_w", "U", "Disp", "Q_prev", "Q"]:
+                if not getattr(node, attr): setattr(node, attr, 0.01)
+        node.Q_hyp = 0.0
+        node.E = 0
+
+    def BuildZones(self, keys, lidar):
+        """Set each node's land cover zones, from random land cover (or LiDAR heights) and topography"""
+        rnd = self.random
+        for km in keys:
+            node = self.Reach[km]
+            # The first value is the emergent vegetation, in the stream,
+            # which is low (the wind profile needs it under 2/0.7 m)
+            if lidar:
+                heights = [rnd.uniform(0, 2)] + [rnd.uniform(0, 50) for i in xrange(28)]
+                densities = [IniParams["lcdensity"]] * 29
+                overhangs = [IniParams["lcoverhang"]] * 29
+            else:
+                # Mostly the same cover in each direction, as along real streams
+                cover = rnd.choice(self.landcover)
+                codes = [rnd.choice(self.landcover[:3])]
+                codes += [cover if rnd.random() < 0.7 else rnd.choice(self.landcover) for i in xrange(28)]
+                heights, densities, overhangs = zip(*codes)
+            # Land rising away from the stream, with some steep topography
+            elevations = [node.Elevation + rnd.uniform(0, 3) * (j % 4 + 1) for j in xrange(28)]
+            steep = rnd.random() < 0.2
+            topo = [rnd.uniform(0, 40 if steep else 10) for i in xrange(3)]
+            Zones(node, heights, densities, overhangs, elevations, topo)
+
+    def SetForcing(self, keys, tributaries, sites):
+        """Give evenly spaced nodes tributaries and continuous data, and every other node the closest site's data"""
+        rnd = self.random
+        for k in xrange(tributaries):
+            node = self.Reach[keys[(k + 1) * len(keys) // (tributaries + 1)]]
+            Q, T = rnd.uniform(0.05, 0.5), rnd.uniform(8, 16)
+            for time in self.times:
+                node.Q_tribs[time] += self.Diurnal(time, Q, Q * 0.1, 6),
+                node.T_tribs[time] += self.Diurnal(time, T, 2.0),
+        for node in self.Reach.itervalues():
+            if len([v for v in node.Q_tribs.itervalues() if len(v)]):
+                node.Q_tribs = node.Q_tribs.View(IniParams["flushtimestart"], IniParams["modelend"], aft=1)
+                node.T_tribs = node.T_tribs.View(IniParams["flushtimestart"], IniParams["modelend"], aft=1)
+        sites = max(sites, 1)
+        data = []
+        for k in xrange(sites):
+            cloud, wind, humidity, air = rnd.uniform(0, 0.5), rnd.uniform(0.5, 3), rnd.uniform(0.3, 0.7), rnd.uniform(15, 25)
+            data.append(self.Series(lambda t: (cloud, self.Diurnal(t, wind, wind / 2), self.Diurnal(t, humidity, 0.2, 5),
+                                               self.Diurnal(t, air, 6))))
+        for i in xrange(len(keys)):
+            # Each site is in the middle of the nodes that use its data
+            self.Reach[keys[i]].ContData = data[i * sites // len(keys)]
+
+    def OrientNodes(self, keys):
+        """Link the nodes, as ExcelInterface.OrientNodes() does"""
+        head = self.Reach[keys[0]]
+        for i in xrange(len(keys)):
+            node = self.Reach[keys[i]]
+            if i: node.prev_km = self.Reach[keys[i-1]]
+            node.next_km = self.Reach[keys[i+1]] if i + 1 < len(keys) else node
+            node.head = head
+            node.Initialize()
@@ -0,0 +1,19 @@
+"""Headless benchmarks of the Heat Source model
+
+These run without Excel (or Windows), on synthetic reaches built by
+Synthetic.SyntheticReach in place of a workbook, so the model can be
+timed anywhere it can be imported (the C module, HSmodule, must be
+built for the platform). Kernels.py times each kernel, Runs.py times
+whole runs of ModelControl, and Bench.py runs both from the command
+line, saving the results to JSON and flagging regressions against a
+saved baseline:
+
+    python -m heatsource.Benchmark.Bench --output baseline.json
+    ... change something ...
+    python -m heatsource.Benchmark.Bench --baseline baseline.json
+
+Replay.py replays a trace of the kernels' arguments, recorded from a
+real model run (see Utils/KernelTrace.py), through each kernel backend:
+
+    python -m heatsource.Benchmark.Replay Kernels.trace
+"""
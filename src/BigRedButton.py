@@ -13,24 +13,41 @@ from itertools import count
 from traceback import print_exc, format_tb
 from sys import exc_info
 from os.path import join, exists
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
 from os import unlink
-from win32com.client import Dispatch
-from win32gui import PumpWaitingMessages
+try:
+    from win32gui import PumpWaitingMessages
+except ImportError: # No Windows, so no status bar to update
+    PumpWaitingMessages = lambda: None
 from Utils.easygui import msgbox, buttonbox
 from time import time as Time
 from time import ctime, gmtime
 
 # Heat Source modules
 from Dieties.IniParamsDiety import IniParams
-from Excel.ExcelInterface import ExcelInterface
+try:
+    from Excel.ExcelInterface import ExcelInterface
+except ImportError: # No Excel, so ModelControl needs an interface (e.g. Benchmark.Synthetic)
+    ExcelInterface = None
 from Dieties.ChronosDiety import Chronos
+from Stream.ReachState import ReachState
+from Stream.ReachEngine import ReachEngine
+from Stream.ForcingFrame import ForcingFrame
+from Stream.SolarEphemeris import SolarEphemeris, SpinupReplay
+from Stream import Backends
+import Stream.StreamNode
 from Utils.Logger import Logger
+from Utils.Timer import Timer
+from Utils.Profiler import ProfileWindow
+from Utils.KernelTrace import KernelRecorder
 from Utils.Output import Output as O
-from HSmodule import HeatSourceError
+from Utils.Dictionaries import ResampleSeries
+from Utils import Checkpoint
 from __version__ import version_info
 
-from . import opt
-
 class ModelControl(object):
     """Main model control class for Heat Source.
 
@@ -47,44 +64,243 @@ class ModelControl(object):
     Reach class. Since this was essentially an interim
     solution to the problem, don't hesitate to improve it.
     """
-    def __init__(self, spreadsheet, run_type=0):
-        """ModelControl(spreadsheet, run_type) -> Class instance
+    def __init__(self, spreadsheet, run_type=0, resume=False, interface=None):
+        """ModelControl(spreadsheet, run_type, resume, interface) -> Class instance
 
         Spreadsheet is the path to an excel sheet containing the data.
         run_type is one of 0,1,2 for Heat Source, Solar only, or
-        hydraulics only, respectively.
+        hydraulics only, respectively. If resume is True, the run
+        carries on from the latest checkpoint of the same run. interface
+        is used in place of the ExcelInterface if it's given, and must
+        have the same Reach dictionary and PB() method, having set up the
+        IniParams (see Benchmark/Synthetic.py), in which case spreadsheet
+        is ignored.
         """
         # TODO: Fix the logger so it actually works
         self.ErrLog = Logger
+        # Time spent in each phase of the run, reported in Timing.csv
+        Timer.Reset()
+        # The kernels to run with (see Stream/Backends.py), which the nodes
+        # also take when they're initialized
+        self.Backend = Backends.Current()
 
         # Create an ExcelInterface instance. Here, we could just grab
         # the Reach and PB (progress bar) attributes and then release it,
         # but internal use has suggested that it's nice to keep ownership
         # of the sheet throughout the model run.
-        self.HS = ExcelInterface(spreadsheet, self.ErrLog, run_type)
+        if interface is not None: self.HS = interface
+        else:
+            with Timer("input"): self.HS = ExcelInterface(spreadsheet, self.ErrLog, run_type)
+        setup = Time() # Everything from here on is the model's own setup
+        for name, reason in self.Backend.skipped:
+            self.ErrLog.write("The %s kernel backend can't be used here (%s)" % (name, reason))
+        self.ErrLog.write("Running with the %s kernel backend" % self.Backend.name)
+        # Backends with whole reach routines run the reach at once
+        vectorize = self.Backend.reach is not None
 
         # This is the list of StreamNode instances- we sort it in reverse
         # order because we number stream kilometer from the mouth to the
         # headwater, but we want to run the model from headwater to mouth.
         self.reachlist = sorted(self.HS.Reach.itervalues(), reverse=True)
+        # Resample the boundary conditions, tributary and continuous data onto
+        # the model timestep once, so looking them up doesn't interpolate.
+        # The spin-up repeats the first model day, so it's never looked up.
+        with Timer("setup.ResampleSeries"):
+            ResampleSeries(self.reachlist, IniParams["modelstart"], IniParams["modelend"], IniParams["dt"])
+        # The numeric attributes of every node, as a set of NumPy arrays with
+        # one element per node in model order. For a whole reach backend, the
+        # nodes are moved into the arrays, and they are now views onto their
+        # row of this state. Otherwise the nodes keep their own values, which
+        # are faster for them to use, and the arrays are a copy of them for
+        # checkpoints (see ReachState.Gather()).
+        with Timer("setup.ReachState"): self.state = ReachState(self.reachlist, vectorize)
+        # Each distinct forcing series is looked up once per timestep, by this
+        # frame, rather than once (or more) by every node that shares it.
+        with Timer("setup.ForcingFrame"): self.Forcing = ForcingFrame(self.reachlist)
+        # Solar position for the whole run, if we calculate it up front. The
+        # headwater node looks it up in CalcHeat_BoundaryNode() (as does the
+        # ReachEngine), which is where it's otherwise calculated each timestep.
+        if IniParams["ephemeris"]:
+            head = self.reachlist[0]
+            if IniParams["ephemerispernode"] and vectorize:
+                lat, lon = self.state.Latitude.copy(), self.state.Longitude.copy()
+            else: lat, lon = head.Latitude, head.Longitude
+            with Timer("setup.SolarEphemeris"):
+                head.Ephemeris = SolarEphemeris(lat, lon, head.UTC_offset,
+                                                IniParams["modelstart"] - IniParams["flushdays"] * 86400,
+                                                IniParams["modelend"], IniParams["dt"],
+                                                IniParams["ephemeriscache"] or None)
+        # Repeat the solar positions of the first spin-up day, rather than
+        # find them again, on the days after it.
+        if IniParams["flushreplay"] and IniParams["flushdays"]:
+            head = self.reachlist[0]
+            head.Ephemeris = SpinupReplay(head.Latitude, head.Longitude, head.UTC_offset,
+                                          self.Backend.kernels,
+                                          head.Ephemeris)
+        # The whole reach engine works directly on those arrays.
+        self.Engine = ReachEngine(self.state, self.Forcing) if vectorize else None
+        # Record the arguments of the kernels that the nodes call, for a
+        # sample of the timesteps and nodes, to replay them later (see
+        # Utils/KernelTrace.py). The recorder takes the place of the kernel
+        # module until the end of the run.
+        self.Trace = None
+        if IniParams["kerneltrace"]:
+            if self.Engine is not None:
+                raise Exception("The kernel trace is recorded from the nodes, so it can't be taken with the %s backend" % self.Backend.name)
+            steps, nodes = IniParams["kerneltrace"]
+            self.Trace = KernelRecorder(self.Backend.kernels, join(IniParams["outputdir"], "Kernels.trace"), steps, nodes)
+            Stream.StreamNode._HS = self.Trace
 
         # This if statement prevents us from having to test every timestep
         # We just call self.run_all(), which is a classmethod pointing to
         # the correct method.
-        if run_type == 0: self.run_all = self.run_hs
-        elif run_type == 1: self.run_all = self.run_sh
-        elif run_type == 2: self.run_all = self.run_hy
-        else: raise Exception("Bad run_type: %i. Must be 0, 1 or 2" %`self.run_type`)
+        if self.Engine is not None:
+            runs = (self.run_hs_reach, self.run_sh_reach, self.run_hy_reach)
+        else:
+            runs = (self.run_hs, self.run_sh, self.run_hy)
+        if run_type in (0, 1, 2): self.run_all = runs[run_type]
+        else: raise Exception("Bad run_type: %i. Must be 0, 1 or 2" %`run_type`)
+        self.run_type = run_type
         # Create a Chronos iterator that controls all model time.
         Chronos.Start(start = IniParams["modelstart"],
                       stop = IniParams["modelend"],
                       dt = IniParams["dt"],
                       spin = IniParams["flushdays"],
                       offset = IniParams["offset"])
+        # Checkpoints of the model state are written here, every checkpointdays
+        # days of model time, and a resumed run starts from the latest of them.
+        self.checkpointdir = IniParams["checkpointdir"] or IniParams["outputdir"]
+        self.hours, self.out, self.elapsed = 0, 0, 0 # Running totals of Run()
+        values = None
+        if resume:
+            filename = Checkpoint.Latest(self.checkpointdir)
+            if filename is None: raise Exception("There is no checkpoint to resume in %s" % self.checkpointdir)
+            with Timer("setup.resume"):
+                values = Checkpoint.Load(filename)
+                self.Restore(values)
+        # The state at the end of the spin-up is saved in the spinupcache
+        # directory, named for the inputs it depends on, and a later run with
+        # the same inputs loads it and starts at the model start time.
+        self.spinupfile = None
+        if IniParams["spinupcache"] and IniParams["flushdays"] and not resume:
+            with Timer("setup.spinupcache"):
+                self.spinupfile = join(IniParams["spinupcache"], "spinup_%s.npz" % self.SpinupKey())
+                if exists(self.spinupfile):
+                    self.Restore(Checkpoint.Load(self.spinupfile), False)
+                    self.ErrLog.write("Loaded the spin-up state from %s" % self.spinupfile)
+                    self.spinupfile = None # Nothing to save
         # This is the output class, which is essentially just a list
         # of file objects and an append method which writes to them
         # every so often.
-        self.Output = O(self.HS.Reach, IniParams["modelstart"], run_type)
+        with Timer("setup.Output"):
+            self.Output = O(self.HS.Reach, IniParams["modelstart"], run_type, self.state if vectorize else None, values)
+        Timer.Add("setup", Time() - setup)
+
+    def SpinupDay(self, yesterday, tolerance, days):
+        """Compare the end of a spin-up day with the day before, and end the spin-up if it's converged
+
+        yesterday is the (T, T_sed, Q) arrays returned for the day before (or
+        None for the first day), and days is the number of days spun up so
+        far. Returns None if the spin-up is over, and today's arrays otherwise."""
+        today = self.state.Snapshot(("T", "T_sed", "Q"))
+        today = today["T"], today["T_sed"], today["Q"]
+        last = Chronos.TheTime >= Chronos.start # The last day of the spin-up
+        if yesterday is None:
+            if last: self.ErrLog.write("Spin-up used all %i days" % days)
+            return None if last else today
+        change_T = abs(today[0] - yesterday[0]).max()
+        # The sediment warms and cools more slowly than the water, so it
+        # takes longer to converge, and it's checked separately.
+        change_sed = abs(today[1] - yesterday[1]).max()
+        # Discharge is compared as a fraction, because it varies so much
+        change_Q = (abs(today[2] - yesterday[2]) / abs(today[2]).clip(0.003, None)).max()
+        changes = (days, IniParams["flushdays"], change_T, change_sed, change_Q * 100)
+        if change_T < tolerance and change_sed < tolerance and change_Q < tolerance:
+            Chronos.EndSpinup()
+            self.ErrLog.write("Spin-up converged after %i of %i days (largest daily change %0.3g *C, %0.3g *C sediment, %0.3g%% discharge)" % changes)
+        elif last:
+            self.ErrLog.write("Spin-up did not converge in %i of %i days (largest daily change %0.3g *C, %0.3g *C sediment, %0.3g%% discharge)" % changes)
+        else: return today
+        return None
+
+    def RunKey(self):
+        """Return a dictionary of the values that identify this model run"""
+        return {"run.type": self.run_type, "run.nodes": len(self.reachlist), "run.start": IniParams["modelstart"],
+                "run.stop": IniParams["modelend"], "run.dt": IniParams["dt"], "run.flushdays": IniParams["flushdays"]}
+
+    # IniParams values that change the model's results
+    spinup_params = ("dt", "dx", "flushdays", "modelstart", "offset", "emergent", "wind_a", "wind_b",
+                     "calcevap", "penman", "calcalluvium", "alluviumtemp", "ratingtables",
+                     "ephemeris", "ephemerispernode", "flushtolerance", "flushreplay")
+    def SpinupKey(self):
+        """Return a hash of everything that the state at the end of the spin-up depends on
+
+        That's the version, run_type, kernel backend and model parameters,
+        the initial values of every node, and the forcing data of every node
+        for the spin-up."""
+        key = sha1(repr((version_info, self.run_type, self.Backend.name, [IniParams.get(k) for k in self.spinup_params])))
+        self.state.Gather()
+        for name in self.state.fields:
+            key.update(getattr(self.state, name).tostring())
+        # The spin-up repeats its first day, so that's all of the forcing
+        # it reads, which the nodes' ForcingViews give as the spin-up sees it.
+        dt = IniParams["dt"]
+        times = [Chronos.spin_start + i * dt for i in xrange(int(min(Chronos.day, Chronos.start - Chronos.spin_start) // dt))]
+        digests = {} # Of each distinct series, which many nodes share
+        for node in self.reachlist:
+            key.update(repr(node.ShaderList))
+            for attr in ("ContData", "Q_tribs", "T_tribs", "Q_bc", "T_bc"):
+                view = getattr(node, attr, None)
+                series = getattr(view, "series", view) # The series behind a ForcingView
+                ident = id(series), getattr(view, "held", False)
+                if ident not in digests:
+                    digests[ident] = "None" if view is None else sha1(repr([view[t] for t in times])).hexdigest()
+                key.update(attr + digests[ident])
+        return key.hexdigest()
+
+    def SaveSpinup(self, hours, out):
+        """Write the state at the end of the spin-up to the spin-up cache"""
+        values = self.RunKey()
+        values.update({"run.hours": hours, "run.out": out, "run.elapsed": 0})
+        for name, value in self.state.Snapshot(self.state.fields).iteritems():
+            values["state." + name] = value
+        values.update(Chronos.Checkpoint())
+        Checkpoint.Write(self.spinupfile, values)
+        self.ErrLog.write("Saved the spin-up state to %s" % self.spinupfile)
+
+    def Checkpoint(self, hours, out, elapsed):
+        """Write everything needed to carry on from the current time to a checkpoint file
+
+        hours, out and elapsed are Run()'s hour count, mass balance outflow
+        and computer time so far, in seconds."""
+        values = self.RunKey()
+        values.update({"run.hours": hours, "run.out": out, "run.elapsed": elapsed})
+        for name, value in self.state.Snapshot(self.state.fields).iteritems():
+            values["state." + name] = value
+        values.update(Chronos.Checkpoint())
+        values.update(self.Output.Checkpoint())
+        return Checkpoint.Save(self.checkpointdir, Chronos.TheTime, values)
+
+    def Restore(self, values, check=True):
+        """Restore the model from the dictionary of a checkpoint file (but not the Output)
+
+        If check is True, the checkpoint must be from a run with the same
+        times, timestep, run_type and number of nodes."""
+        for key, value in self.RunKey().iteritems():
+            if not check: break
+            if key not in values or values[key] != value:
+                raise Exception("The checkpoint is from a different model run (%s is %s, not %s)" %
+                                (key, values.get(key), value))
+        self.state.Restore(dict([(key[6:], value) for key, value in values.iteritems() if key.startswith("state.")]))
+        Chronos.Restore(values)
+        self.hours, self.out = int(values["run.hours"]), float(values["run.out"])
+        self.elapsed += float(values["run.elapsed"])
+        # Past the first timestep, discharge is routed from the previous
+        # one, which the nodes (and engine) switch to after calculating it.
+        if Chronos.TheTime > IniParams["modelstart"] - IniParams["flushdays"] * 86400:
+            for node in self.reachlist:
+                node.CalcDischarge = node.CalcDischarge_Opt if node.prev_km else node.CalcDischarge_BoundaryNode
+            if self.Engine is not None: self.Engine._routing = True
 
     def Run(self):
         """Run the model one time
@@ -93,6 +309,7 @@ class ModelControl(object):
         through each timestep and spacestep, calling the appropriate
         StreamNode functions to calculate heat and hydraulics."""
         time = Chronos.TheTime # Current time of the Chronos clock (i.e. this timestep)
+        HeatSourceError = self.Backend.kernels.HeatSourceError # Raised by the kernels
         stop = Chronos.stop # Stop time for Chronos
         start = Chronos.start # Start time for Chronos, model start, not flush/spin start.
         flush = start-(IniParams["flushdays"]*86400) # in seconds
@@ -100,9 +317,31 @@ class ModelControl(object):
         # 1 day with a 1 minute dt is 1440 timesteps, while a 3 minute dt is only 480 timesteps. Thus,
         # We define the timesteps by dividing dt (now in seconds) by 3600
         timesteps = (stop-flush)/IniParams["dt"]
-        cnt = count() # Counter iterator for counting current timesteps passed
-        out = 0 # Volume of water flowing out of mouth (for simple mass balance)
-        time1 = Time() # Current computer time- for estimating total model runtime
+        cnt = count(self.hours) # Counter iterator for counting current timesteps passed
+        ts = self.hours - 1 # Last value of cnt
+        out = self.out # Volume of water flowing out of mouth (for simple mass balance)
+        time1 = Time() - self.elapsed # Current computer time- for estimating total model runtime
+        started = Time() # For the timing report, which is of this session alone
+        # The phases of a timestep that are timed here, rather than in the run methods
+        forcing, progress, checkpoint = Timer("run.forcing"), Timer("run.progress"), Timer("run.checkpoint")
+        # Model time of the next checkpoint, if we're writing them
+        period = IniParams["checkpointdays"] * 86400
+        if period: next_checkpoint = flush + period * ((time - flush) // period + 1)
+        quit = False
+        spinup = self.spinupfile is not None and time < start # Still to save the spin-up state
+        # With a flush tolerance, the spin-up ends at the first day that
+        # leaves every node's temperature and discharge within tolerance
+        # of the day before, rather than after all of the flush days.
+        tolerance = IniParams["flushtolerance"]
+        yesterday = None # Temperature and discharge at the end of the last spin-up day
+        # Profile a window of the run, if we've been asked to
+        profile = None
+        if IniParams["profilewindow"]:
+            day, first, last = IniParams["profilewindow"]
+            if day < 1 or not 0 <= first < last <= 24:
+                raise Exception("Bad profile window: %s. Must be (day, first hour, last hour), with day 1 the first day of the run" % `IniParams["profilewindow"]`)
+            begin = flush + (day - 1) * 86400
+            profile = ProfileWindow(begin + first * 3600, begin + last * 3600, IniParams["outputdir"], self.ErrLog)
         # Localize run_type for a bit more speed
         ################################################################
         # So, it's simple and stupid. We basically just cycle through the time
@@ -111,57 +350,84 @@ class ModelControl(object):
         # A smarter way would be to thread this so we can start calculating
         # the second timestep (using another CPU or core) while the first one
         # is still unfinished.
-        while time <= stop:
-            year, month, day, hour, minute, second, JD, offset, JDC = Chronos.TimeTuple()
-            # zero hour+minute+second means first timestep of new day
-            # We want to zero out the daily flux sum at this point.
-            if not (hour + minute + second):
-                for nd in self.reachlist: nd.F_DailySum = [0]*5
-
-            # Back to every timestep level of the loop. Here we wrap the call to
-            # run_all() in a try block to catch the exceptions thrown.
-            try:
-                # Note that all of the run methods have to have the same signature
-                self.run_all(time, hour, minute, second, JD, JDC)
-            # Shit, there's a problem, throw an exception up using a graphical window.
-            except HeatSourceError, (stderr):
-                msg = "At %s and time %s\n"%(self, Chronos.PrettyTime())
+        trace = self.Trace
+        # The trace is finished even if the run fails, which is when it is most wanted
+        try:
+            while time <= stop:
+                if profile is not None: profile(time)
+                if trace is not None: trace.Step(time, int((time - flush) // IniParams["dt"]))
+                year, month, day, hour, minute, second, JD, offset, JDC = Chronos.TimeTuple()
+                with forcing: self.Forcing.Update(time)
+                # zero hour+minute+second means first timestep of new day
+                # We want to zero out the daily flux sum at this point.
+                if not (hour + minute + second):
+                    if self.Engine is not None: self.state.F_DailySum.fill(0)
+                    else:
+                        for nd in self.reachlist: nd.F_DailySum = [0]*5
+
+                # Back to every timestep level of the loop. Here we wrap the call to
+                # run_all() in a try block to catch the exceptions thrown.
                 try:
-                    msg += stderr+"\nThe model run has been halted. You may ignore any further error messages."
-                except TypeError:
-                    msg += `stderr`+"\nThe model run has been halted. You may ignore any further error messages."
-                msgbox(msg)
-                # Then just die
-                raise SystemExit
-                        # If minute and second are both zero, we are at the top of the hour. Performing
-
-            # The following house keeping tasks each hours saves us enormous amounts of
-            # runtime overhead over doing it every timestep.
-            if not (minute + second):
-                ts = cnt.next() # Number of actual timesteps per tick
-                hr = 60/(IniParams["dt"]/60) # Number of timesteps in one hour
-                # This writes a line to the status bar of Excel.
-                self.HS.PB("%i of %i timesteps"% (ts*hr, timesteps))
-                # Update the Excel status bar when the queue is free
-                PumpWaitingMessages()
-                # Call the Output class to update the textfiles. We call this every
-                # hour and store the data, then we write to file every day. Limiting
-                # disk access saves us considerable time.
-                self.Output(time, hour)
-                # Check to see if the user pressed the stop button. Pretty crappy kludge here- VB code writing an
-                # empty file- but I basically got to lazy to figure out how to interact with the underlying
-                # COM API without using a threading interface.
-                if exists("c:\\quit_heatsource"):
-                    unlink("c:\\quit_heatsource")
-                    if QuitMessage():
-                        break
-
-            # We've made it through the entire stream without an error, so we update our mass balance
-            # by adding the discharge of the mouth...
-            out += self.reachlist[-1].Q
-            # and tell Chronos that we're moving time forward.
-            time = Chronos(True)
+                    # Note that all of the run methods have to have the same signature
+                    self.run_all(time, hour, minute, second, JD, JDC)
+                # Shit, there's a problem, throw an exception up using a graphical window.
+                except HeatSourceError, (stderr):
+                    msg = "At %s and time %s\n"%(self, Chronos.PrettyTime())
+                    try:
+                        msg += stderr+"\nThe model run has been halted. You may ignore any further error messages."
+                    except TypeError:
+                        msg += `stderr`+"\nThe model run has been halted. You may ignore any further error messages."
+                    msgbox(msg)
+                    # Then just die
+                    raise SystemExit
+                            # If minute and second are both zero, we are at the top of the hour. Performing
 
+                # The following house keeping tasks each hours saves us enormous amounts of
+                # runtime overhead over doing it every timestep.
+                if not (minute + second):
+                    ts = cnt.next() # Number of actual timesteps per tick
+                    hr = 60/(IniParams["dt"]/60) # Number of timesteps in one hour
+                    with progress:
+                        # This writes a line to the status bar of Excel.
+                        self.HS.PB("%i of %i timesteps"% (ts*hr, timesteps))
+                        # Update the Excel status bar when the queue is free
+                        PumpWaitingMessages()
+                    # Call the Output class to update the textfiles. We call this every
+                    # hour and store the data, then we write to file every day. Limiting
+                    # disk access saves us considerable time.
+                    self.Output(time, hour)
+                    # Check to see if the user pressed the stop button. Pretty crappy kludge here- VB code writing an
+                    # empty file- but I basically got to lazy to figure out how to interact with the underlying
+                    # COM API without using a threading interface.
+                    if exists("c:\\quit_heatsource"):
+                        unlink("c:\\quit_heatsource")
+                        if QuitMessage():
+                            quit = True
+
+                # We've made it through the entire stream without an error, so we update our mass balance
+                # by adding the discharge of the mouth...
+                out += self.reachlist[-1].Q
+                # and tell Chronos that we're moving time forward.
+                time = Chronos(True)
+                if tolerance and time <= start and not (time - flush) % 86400:
+                    yesterday = self.SpinupDay(yesterday, tolerance, (time - flush) // 86400)
+                    if yesterday is None: time = Chronos.TheTime # Converged, and now at the start
+                # Save the state every so often (and when we quit) so that the
+                # run can be resumed from here if it's stopped.
+                if period and (quit or time >= next_checkpoint):
+                    if time <= stop:
+                        with checkpoint: self.Checkpoint(ts + 1, out, Time() - time1)
+                    next_checkpoint += period
+                if quit: break
+                if spinup and time >= start:
+                    with Timer("run.spinupcache"): self.SaveSpinup(ts + 1, out)
+                    spinup = False
+        finally:
+            if trace is not None:
+                Stream.StreamNode._HS = trace.module
+                self.ErrLog.write("Kernel trace of %i calls written to %s" % (trace.Close(), trace.filename))
+
+        if profile is not None: profile.Stop() # The run ended inside the window
         # So, here we are at the end of a model run. First we calculate how long all of this took
         total_time = (Time() - time1) / 60
         # Calculate the mass balance inflow
@@ -178,6 +444,9 @@ class ModelControl(object):
         # so we do this before the final message so people don't accidentally
         # access the file and screw up the buffer)
         self.Output.close()
+        Timer.Add("run", Time() - started)
+        # Where the time went, next to the output
+        if IniParams["timingreport"]: Timer.Report(join(IniParams["outputdir"], "Timing.csv"))
         # write that final message to the Excel status bar
         self.HS.PB(message)
         # Hopefully, Python's cyclic garbage collection takes care of the rest :)
@@ -186,19 +455,35 @@ class ModelControl(object):
     # three different versions of the run() routine, depending on the run_type
     # We use list comprehension because it's slightly faster than a for loop,
     # and we want to eek out all the speed we can.
+    # Each step is timed for the timing report (see Utils/Timer.py).
     def run_hs(self, time, H, M, S, JD, JDC):
         """Call both hydraulic and solar routines for each StreamNode"""
-        [x.CalcDischarge(time) for x in self.reachlist]
-        [x.CalcHeat(time, H, M, S, JD, JDC) for x in self.reachlist]
-        [x.MacCormick2(time) for x in self.reachlist]
+        with Timer("run.hydraulics"): [x.CalcDischarge(time) for x in self.reachlist]
+        with Timer("run.heat"): [x.CalcHeat(time, H, M, S, JD, JDC) for x in self.reachlist]
+        with Timer("run.maccormick"): [x.MacCormick2(time) for x in self.reachlist]
 
     def run_hy(self, time, H, M, S, JD, JDC):
         """Call hydraulic routines for each StreamNode"""
-        [x.CalcDischarge(time) for x in self.reachlist]
+        with Timer("run.hydraulics"): [x.CalcDischarge(time) for x in self.reachlist]
 
     def run_sh(self, time, H, M, S, JD, JDC):
         """Call solar routines for each StreamNode"""
-        [x.CalcHeat(time, H, M, S, JD, JDC, True) for x in self.reachlist]
+        with Timer("run.heat"): [x.CalcHeat(time, H, M, S, JD, JDC, True) for x in self.reachlist]
+
+    # The same three routines, using the whole reach engine
+    def run_hs_reach(self, time, H, M, S, JD, JDC):
+        """Call both hydraulic and solar routines for the whole reach"""
+        with Timer("run.hydraulics"): self.Engine.CalcDischarge(time)
+        with Timer("run.heat"): self.Engine.CalcHeat(time, H, M, S, JD, JDC)
+        with Timer("run.maccormick"): self.Engine.MacCormick2(time)
+
+    def run_hy_reach(self, time, H, M, S, JD, JDC):
+        """Call hydraulic routines for the whole reach"""
+        with Timer("run.hydraulics"): self.Engine.CalcDischarge(time)
+
+    def run_sh_reach(self, time, H, M, S, JD, JDC):
+        """Call solar routines for the whole reach"""
+        with Timer("run.heat"): self.Engine.CalcHeat(time, H, M, S, JD, JDC, True)
 
 
 def QuitMessage():
@@ -219,6 +504,16 @@ def RunHS(sheet):
         print_exc(file=f)
         f.close()
         msgbox("".join(format_tb(exc_info()[2]))+"\nSynopsis: %s"%stderr, "HeatSource Error", err=True)
+def ResumeHS(sheet, run_type=0):
+    """Resume a model run from its latest checkpoint"""
+    try:
+        HSP = ModelControl(sheet, run_type, True)
+        HSP.Run()
+    except Exception, stderr:
+        f = open("c:\\HSError.txt", "w")
+        print_exc(file=f)
+        f.close()
+        msgbox("".join(format_tb(exc_info()[2]))+"\nSynopsis: %s"%stderr, "HeatSource Error", err=True)
 def RunSH(sheet):
     """Run solar routines only"""
     try:
@@ -239,12 +534,3 @@ def RunHY(sheet):
         print_exc(file=f)
         f.close()
         msgbox("".join(format_tb(exc_info()[2]))+"\nSynopsis: %s"%stderr, "HeatSource Error", err=True)
-
-try:
-    if opt(__name__):
-        import psyco
-        psyco.bind(ModelControl.Run)
-        psyco.bind(ModelControl.run_sh)
-        psyco.bind(ModelControl.run_hy)
-        psyco.bind(ModelControl.run_hs)
-except ImportError: pass
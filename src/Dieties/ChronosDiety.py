@@ -1,13 +1,31 @@
 from time import strptime, ctime, gmtime
-from pywintypes import Time as pyTime
+try:
+    from pywintypes import Time as pyTime
+except ImportError:
+    # No Windows (e.g. the Benchmark package on Linux), so no Excel either.
+    # This is the Excel date of a time, as in the hourly output files.
+    pyTime = lambda seconds: seconds / 86400.0 + 25569
 from IniParamsDiety import IniParams
 
-from .. import opt
-try:
-    if opt(__name__):
-        import psyco.classes
-        object = psyco.classes.psyobj
-except ImportError: pass
+def JulianCentury(seconds):
+    """Return the julian century of the day containing seconds since the epoch"""
+    # Then break out the time into a tuple
+    y,m,d,H,M,S,day,wk,tz = gmtime(seconds)
+    dec_day = d + (H + (M + S/60)/60)/24
+
+    if m < 3:
+        m += 12;
+        y -= 1;
+
+    julian_day = int(365.25*(y+4716.0)) + int(30.6001*(m+1)) + d - 1524.5;
+
+    # This value should only be added if we fall after a certain date
+    if julian_day > 2299160.0:
+        a = int(y/100)
+        b = (2 - a + int(a/4))
+        julian_day += b
+    #This is the julian century
+    return round((julian_day-2451545.0)/36525.0,10) # Eqn. 2-5 in HS Manual
 
 class ChronosDiety(object):
     """This class provides a clock to be used in the model timestepping.
@@ -108,27 +126,40 @@ class ChronosDiety(object):
         self.CalcJulianCentury()
 
     def CalcJulianCentury(self):
-        # Then break out the time into a tuple
-        y,m,d,H,M,S,day,wk,tz = gmtime(self.__current)
-        dec_day = d + (H + (M + S/60)/60)/24
-
-        if m < 3:
-            m += 12;
-            y -= 1;
+        self.__jdc = JulianCentury(self.__current)
+
+    def Periodic(self, time):
+        """Return the time of day of a spin-up time, or None if time is after the spin-up
+
+        The spin-up (flush) period repeats the first day of model data, so
+        it's periodic, with a period of one day. The time of day is in
+        seconds from the start of the spin-up day, which is the model
+        start's time of day."""
+        if time >= self.__start: return None
+        return (time - self.__spin_start) % self.day
+
+    def EndSpinup(self):
+        """End the spin-up period now, moving the clock to the model start time"""
+        self.__current = self.__spin_current = self.__start
+        self.__thisday = self.__current
+        self.CalcJulianCentury()
 
-        julian_day = int(365.25*(y+4716.0)) + int(30.6001*(m+1)) + d - 1524.5;
+    def Checkpoint(self):
+        """Return a dictionary of the clock's position, for Restore()"""
+        return {"Chronos.current": self.__current, "Chronos.spin_current": self.__spin_current,
+                "Chronos.thisday": self.__thisday, "Chronos.jdc": self.__jdc}
 
-        # This value should only be added if we fall after a certain date
-        if julian_day > 2299160.0:
-            a = int(y/100)
-            b = (2 - a + int(a/4))
-            julian_day += b
-        #This is the julian century
-        self.__jdc = round((julian_day-2451545.0)/36525.0,10) # Eqn. 2-5 in HS Manual
+    def Restore(self, values):
+        """Move the clock to a position from Checkpoint(), after calling Start()"""
+        self.__current = float(values["Chronos.current"])
+        self.__spin_current = float(values["Chronos.spin_current"])
+        self.__thisday = float(values["Chronos.thisday"])
+        self.__jdc = float(values["Chronos.jdc"])
 
     #####################################################
     # Properties to allow reading but no changes
     start = property(lambda self: self.__start)
+    spin_start = property(lambda self: self.__spin_start)
     stop = property(lambda self: self.__stop)
     dt = property(lambda self: self.__dt)
     offset = property(lambda self: self.__offset)
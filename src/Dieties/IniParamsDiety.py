@@ -12,27 +12,85 @@ Of course, you can't program against stupidity, but there you are.
 
 Anyway, this is just a convenient place to hold them, where
 they can be found at a later time. Of course, one important thing
-to remember is that since many classes are built with the psyco
-optimize switch, this module should be imported before any other
-modules. Including the import in the Dieties.__init__.py module.
-
-Good thing that very important caveat is buried deeply in these
-notes where no-one will ever read it.
-
-To turn of psyco alltogether, edit heatsource.__init__.py
+to remember is that the options are read as the model is set up, so
+they should be set before a ModelControl (or a reach) is made.
 """
 
 
-IniParams = {"psyco": ('Dictionaries',
-                        'BigRedButton',
-                        'StreamNode',
-                        'PyHeatsource',
-                        'ExcelDocument',
-                        'ExcelInterface',
-                        'IniParamsDiety',
-                        'ChronosDiety',
-                        'Output'),
-             # Run the routines in PyHeatsource.py instead of
-             # the C module.
-             "run_in_python": False,
+IniParams = {# The kernel backend to run with (see Stream/Backends.py):
+             # "C" for the C module, "python" for the routines in
+             # PyHeatsource.py, "numpy" to calculate the whole reach
+             # at once with the NumPy routines in ReachEngine.py instead
+             # of node by node, or "jit" for both, compiled with Numba (see
+             # Stream/JitHeatsource.py). If it can't be loaded, its fallback is used.
+             "backend": "C",
+             # Directory to keep the jit backend's compiled code in, rather
+             # than __pycache__ beside its source. "" for the default.
+             "jitcache": "",
+             # With the numpy or jit backend, look wetted depth up in per-node rating
+             # tables (RatingTable.py) rather than solving for it.
+             "ratingtables": False,
+             # Calculate the solar position for the whole run at startup
+             # (SolarEphemeris.py), and with the numpy or jit backend, optionally for
+             # every node rather than just the headwater. If ephemeriscache
+             # is a directory, the tables are saved there and reused.
+             "ephemeris": False,
+             "ephemerispernode": False,
+             "ephemeriscache": "",
+             # Output file format: "text" for the original fixed width
+             # files, or "binary" for .npy arrays (see Utils/Writers.py)
+             "outputformat": "text",
+             # Write output in the background: "" (don't), "thread" or
+             # "process", with at most outputqueue blocks waiting.
+             "outputasync": "",
+             "outputqueue": 64,
+             # Write the hourly output files. Turn this off to write only
+             # the daily summaries of the outputsummary variables: daily
+             # minimum, mean and maximum, and the seven day average of
+             # the daily maximum (7DADM), e.g. Temp_H20_Max.txt.
+             "outputhourly": True,
+             "outputsummary": ("Temp_H20",),
+             # What to record: the names of the output variables (e.g.
+             # ("Temp_H20", "Hyd_Flow"), or () for all of them), every
+             # outputnodes'th node from the headwater or the nodes nearest
+             # the kilometers in outputsites, and every outputinterval'th hour.
+             "outputvariables": (),
+             "outputnodes": 1,
+             "outputsites": (),
+             "outputinterval": 1,
+             # Write a checkpoint of the model state every checkpointdays
+             # days of model time (0 for never) to checkpointdir (or the
+             # output directory), from which a stopped run can be resumed
+             # with ModelControl(..., resume=True) or ResumeHS().
+             "checkpointdays": 0,
+             "checkpointdir": "",
+             # Directory to save the state at the end of the spin-up (flush)
+             # period in, named by a hash of everything it depends on. Runs
+             # with the same inputs load it and skip the spin-up. "" for off.
+             "spinupcache": "",
+             # End the spin-up early, once a day changes every node's water
+             # and sediment temperatures by less than flushtolerance (*C) and
+             # discharge by less than flushtolerance as a fraction, compared
+             # with the day before. flushdays is then the most days that are
+             # spun up. 0 to always spin up for flushdays.
+             "flushtolerance": 0,
+             # Use the first spin-up day's solar positions for every spin-up
+             # day, rather than finding them for each day's date.
+             "flushreplay": False,
+             # Write the time spent in each phase of the run (reading the
+             # workbook, hydraulics, heat, output, etc.) to Timing.csv in
+             # the output directory (see Utils/Timer.py).
+             "timingreport": True,
+             # Profile a window of the run with cProfile (and tracemalloc,
+             # where Python has it), writing Profile.txt, Profile.prof and
+             # Allocations.txt to the output directory: (day, first hour,
+             # last hour), with day 1 the first day of the run (including
+             # the spin-up), e.g. (3, 10, 14). () for off.
+             "profilewindow": (),
+             # Record the arguments and results of the kernels (CalcFlows,
+             # CalcHeatFluxes and CalcMacCormick) to Kernels.trace in the
+             # output directory, for Benchmark/Replay.py: (every nth timestep,
+             # every nth node), e.g. (60, 10). Only node by node backends
+             # call them. () for off.
+             "kerneltrace": (),
              }
@@ -22,15 +22,7 @@ directionDown = -4121
 directionLeft = -4131
 directionRight = -4152
 
-from .. import opt
-try:
-    if opt(__name__):
-        import psyco.classes
-        Tobject = psyco.classes.psyobj
-    else: Tobject = object
-except ImportError: Tobject = object
-
-class TextPB(Tobject):
+class TextPB(object):
     def __init__(self):
         self.bar = "---->"
         self.text = list(self.bar) + [" "]*60
@@ -43,8 +35,6 @@ class TextPB(Tobject):
             msg = "%s %i%%" %(msg, num)
         return "%s  | %s" %("".join(self.text), msg)
 
-# psyco fills memory if this class is optimized, so we just use
-# the normal Python object
 class ExcelDocument(object):
     """
     This is a recipe class culled from ASPN (ActiveState). It implements
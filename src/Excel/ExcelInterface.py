@@ -5,7 +5,7 @@ in the Excel spreadsheet into a list of StreamNode classes for use
 by the HeatSource model.
 """
 # Builtin methods
-from __future__ import division
+from __future__ import with_statement, division
 from itertools import ifilter, izip, chain, repeat, count
 from math import ceil, log, degrees, atan
 from datetime import datetime, timedelta
@@ -25,13 +25,7 @@ from ..Dieties.ChronosDiety import Chronos
 from ExcelDocument import ExcelDocument
 from ..Utils.Dictionaries import Interpolator
 from ..Utils.easygui import buttonbox
-
-from .. import opt
-try:
-    if opt(__name__):
-        import psyco.classes
-        object = psyco.classes.psyobj
-except ImportError: pass
+from ..Utils.Timer import Timer
 
 class ExcelInterface(ExcelDocument):
     """Defines an interface specific to the Current (version 8.x) HeatSource Excel interface.
@@ -39,7 +33,7 @@ class ExcelInterface(ExcelDocument):
     This class provides methods which seek knowingly through a correctly formatted Excel
     spreadsheet. It creates a list of StreamNode instances, and populates those in"""
     def __init__(self, filename=None, log=None, run_type=0):
-        ExcelDocument.__init__(self, filename)
+        with Timer("input.open"): ExcelDocument.__init__(self, filename)
         self.run_type = run_type
         self.log = log
         self.Reach = {}
@@ -128,20 +122,23 @@ class ExcelInterface(ExcelDocument):
 
         # Get the list of times in the flow and continuous data sheets- we make no assumptions
         # that they equal each other.
-        self.flowtimelist = self.GetTimelist("Flow Data")
-        self.continuoustimelist = self.GetTimelist("Continuous Data")
-        self.flushtimelist = self.GetFlushTimelist()
+        with Timer("input.GetTimelist"):
+            self.flowtimelist = self.GetTimelist("Flow Data")
+            self.continuoustimelist = self.GetTimelist("Continuous Data")
 
         #####################
-        # Now we start through the steps of building a reach full of StreamNodes
-        self.GetBoundaryConditions()
-        self.BuildNodes()
-        if IniParams["lidar"]: self.BuildZonesLidar()
-        else: self.BuildZonesNormal()
-        self.GetTributaryData()
-        self.GetContinuousData()
-        self.SetAtmosphericData()
-        self.OrientNodes()
+        # Now we start through the steps of building a reach full of StreamNodes,
+        # timing each of them (see Utils/Timer.py)
+        with Timer("input.GetBoundaryConditions"): self.GetBoundaryConditions()
+        with Timer("input.BuildNodes"): self.BuildNodes()
+        if IniParams["lidar"]:
+            with Timer("input.BuildZonesLidar"): self.BuildZonesLidar()
+        else:
+            with Timer("input.BuildZonesNormal"): self.BuildZonesNormal()
+        with Timer("input.GetTributaryData"): self.GetTributaryData()
+        with Timer("input.GetContinuousData"): self.GetContinuousData()
+        with Timer("input.SetAtmosphericData"): self.SetAtmosphericData()
+        with Timer("input.OrientNodes"): self.OrientNodes()
 
     def OrientNodes(self):
         self.PB("Initializing StreamNodes")
@@ -239,22 +236,8 @@ class ExcelInterface(ExcelDocument):
             self.T_bc[time] = t_val
             self.PB("Reading boundary conditions",c.next(),length)
 
-        # Next we expand or revise the dictionary to account for the flush period
-        # Flush flow: model start value over entire flush period
-        for i in xrange(len(self.flushtimelist)):
-            time = self.flushtimelist[i]
-            self.Q_bc[time] = self.Q_bc[IniParams["modelstart"]]
-        # Flush temperature: first 24 hours repeated over flush period
-        first_day_time = IniParams["modelstart"]
-        second_day = IniParams["modelstart"] + 86400
-        for i in xrange(len(self.flushtimelist)):
-            time = self.flushtimelist[i]
-            self.T_bc[time] = self.T_bc[first_day_time]
-            first_day_time += 3600
-            if first_day_time >= second_day:
-                first_day_time = IniParams["modelstart"]
-
-
+        # The flush period repeats the first model day, which the ForcingFrame
+        # takes care of (see Chronos.Periodic()), so it needs no data of its own.
         self.Q_bc = self.Q_bc.View(IniParams["flushtimestart"], IniParams["modelend"], aft=1)
         self.T_bc = self.T_bc.View(IniParams["flushtimestart"], IniParams["modelend"], aft=1)
 
@@ -275,16 +258,6 @@ class ExcelInterface(ExcelDocument):
             timelist2.append(timegm(tm))
         return tuple(timelist2)
 
-    def GetFlushTimelist(self):
-        #Build a timelist that represents the flushing period
-        #This assumes that data is hourly, not tested with variable input timesteps
-        flushtimelist = []
-        flushtime = IniParams["flushtimestart"]
-        while flushtime < IniParams["modelstart"]:
-            flushtimelist += flushtime,
-            flushtime += 3600
-        return tuple(flushtimelist)
-
     def GetLocations(self,sheetname):
         """Return a list of kilometers corresponding to the inflow or continuous data sites"""
         #                        Number of sites, row, column
@@ -352,22 +325,7 @@ class ExcelInterface(ExcelDocument):
                 node.T_tribs[time] += temp,
             self.PB("Reading inflow data",tm.next(), length)
 
-        # Next we expand or revise the dictionary to account for the flush period
-        # Flush flow: model start value over entire flush period
-        for i in xrange(len(self.flushtimelist)):
-            time = self.flushtimelist[i]
-            for node in nodelist:
-                node.Q_tribs[time] = node.Q_tribs[IniParams["modelstart"]]
-        # Flush temperature: first 24 hours repeated over flush period
-        first_day_time = IniParams["modelstart"]
-        second_day = IniParams["modelstart"] + 86400
-        for i in xrange(len(self.flushtimelist)):
-            time = self.flushtimelist[i]
-            for node in nodelist:
-                node.T_tribs[time] = node.T_tribs[first_day_time]
-            first_day_time += 3600
-            if first_day_time >= second_day:
-                first_day_time = IniParams["modelstart"]
+        # The flush period repeats the first model day (see GetBoundaryConditions())
 
         # Now we strip out the unnecessary values from the dictionaries. This is placed here
         # at the end so we can dispose of it easily if necessary
@@ -420,17 +378,7 @@ class ExcelInterface(ExcelDocument):
                 node.ContData[time] = cloud, wind, humid, air
             self.PB("Reading continuous data", tm.next(), length)
 
-        # Flush meteorology: first 24 hours repeated over flush period
-        first_day_time = IniParams["modelstart"]
-        second_day = IniParams["modelstart"] + 86400
-        for i in xrange(len(self.flushtimelist)):
-            time = self.flushtimelist[i]
-            for km in self.ContDataSites:
-                node = self.Reach[km]
-                node.ContData[time] = node.ContData[first_day_time]
-            first_day_time += 3600
-            if first_day_time >= second_day:
-                first_day_time = IniParams["modelstart"]
+        # The flush period repeats the first model day (see GetBoundaryConditions())
 
         # Now we strip out the unnecessary values from the dictionaries. This is placed here
         # at the end so we can dispose of it easily if necessary
@@ -0,0 +1,104 @@
+"""Kernel backends: the implementations of the Heat Source kernels to run with
+
+A backend supplies the kernels that the StreamNodes call (CalcFlows,
+CalcHeatFluxes, CalcMacCormick and CalcSolarPosition, and the
+HeatSourceError they raise), as a module or anything with the same
+attributes. A backend that calculates the whole reach at once also
+has a module of array routines, and the model is then run by the
+ReachEngine rather than node by node.
+
+Backends are registered by name, with a function that loads them (and
+raises ImportError if they can't be used here) and the name of the
+backend to fall back on when that happens. The model runs with the
+backend named by IniParams["backend"], or its first fallback that
+loads, and to add a backend, register it here.
+
+python  PyHeatsource, node by node
+C       HSmodule, the C module, node by node (the default)
+numpy   NpHeatsource, the whole reach at once (with C's, or python's,
+        kernels for the few calculations that are still by node)
+jit     JitHeatsource's kernels, compiled with Numba, and the whole reach
+        at once with its compiled loops in JitReach (falling back on C
+        where Numba isn't installed)
+"""
+from ..Dieties.IniParamsDiety import IniParams
+
+class Backend(object):
+    """A loaded backend"""
+    def __init__(self, name, kernels, reach=None):
+        """Backend(name, kernels[, reach]) -> Class instance
+
+        kernels is the module of kernels for the nodes, and reach the
+        module of whole reach routines, if the backend has them."""
+        self.name = name
+        self.kernels = kernels
+        self.reach = reach
+        self.skipped = [] # (name, reason) of the backends we fell back from
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, self.name)
+
+_registry = {} # (loader, fallback) by name
+_loaded = {} # Backend by name
+_current = None # (IniParams["backend"], Backend) of the last Current()
+
+def Register(name, loader, fallback=None):
+    """Register loader, a function returning a Backend, as name
+
+    fallback is the name of the backend to use if loader raises ImportError."""
+    _registry[name] = loader, fallback
+    if name in _loaded: del _loaded[name]
+
+def Names():
+    """Return the names of the registered backends"""
+    return sorted(_registry.keys())
+
+def Load(name, fallback=True):
+    """Return the backend called name, or if it can't be loaded here, its first fallback that can
+
+    With fallback False, ImportError is raised instead."""
+    skipped = []
+    while name is not None:
+        if name not in _registry:
+            raise Exception("There is no kernel backend called %s (there are %s)" % (`name`, ", ".join(Names())))
+        if name not in _loaded:
+            loader, after = _registry[name]
+            try: _loaded[name] = loader()
+            except ImportError, (e):
+                if not fallback: raise
+                skipped.append((name, str(e)))
+                if after in [x[0] for x in skipped]: break # A circle of fallbacks
+                name = after
+                continue
+        backend = _loaded[name]
+        backend.skipped = skipped
+        return backend
+    raise Exception("No kernel backend could be loaded: %s" % "; ".join(["%s (%s)" % x for x in skipped]))
+
+def Current():
+    """Return the backend the model runs with: the one IniParams["backend"] names, or its fallback"""
+    global _current
+    if _current is None or _current[0] != IniParams["backend"]:
+        _current = IniParams["backend"], Load(IniParams["backend"])
+    return _current[1]
+
+def _Python():
+    import PyHeatsource
+    return Backend("python", PyHeatsource)
+
+def _C():
+    from .. import HSmodule
+    return Backend("C", HSmodule)
+
+def _NumPy():
+    import NpHeatsource
+    return Backend("numpy", Load("C").kernels, NpHeatsource)
+
+def _Jit():
+    import JitHeatsource, JitReach
+    return Backend("jit", JitHeatsource, JitReach)
+
+Register("python", _Python)
+Register("C", _C, "python")
+Register("numpy", _NumPy, "C")
+Register("jit", _Jit, "C")
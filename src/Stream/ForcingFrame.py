@@ -0,0 +1,178 @@
+"""Forcing data for the current timestep, looked up once for the whole reach
+
+Every StreamNode asks its ContData, Q_tribs and T_tribs series for the
+current time, and asks the tribs twice more in the same timestep, even
+though most nodes share their ContData series with a neighboring
+continuous data site. ForcingFrame finds the distinct series of a reach
+when it's created, and its Update() method looks each one up exactly once
+at the top of a timestep. The nodes' series are replaced by ForcingView
+stand-ins, which return the frame's value by index during that timestep.
+
+Series that hold a single value for the whole run (the empty tribs tuples
+of nodes without tributaries, most often) are never looked up at all.
+The ReachEngine reads the frame's arrays directly.
+
+The spin-up (flush) period repeats the first model day (see
+Chronos.Periodic()), so the series have no data of their own for it.
+Spin-up times are looked up at the same time of day on the first model
+day, except for discharges, which are held at their model start value.
+The last hour of a spin-up day ramps from the first model day's 23rd
+hour back to its first value, as the hourly flush copies of the data
+once did, rather than on towards the second model day. The values for
+each time of day are looked up on the first day of the spin-up, and
+replayed from memory on the others.
+"""
+from __future__ import division
+from numpy import asarray, float64, zeros
+
+from ..Dieties.ChronosDiety import Chronos
+
+def Blend(a, b, fraction):
+    """Return the value fraction of the way from a to b
+
+    a and b are numbers, or equal length tuples of them, as a series
+    holds, and a None in either gives None, as in TimeSeries."""
+    if isinstance(a, tuple):
+        return tuple([Blend(a[i], b[i], fraction) for i in xrange(len(a))])
+    if a is None or b is None: return None
+    return a + (b - a) * fraction
+
+class ForcingView(object):
+    """Stand-in for a node's forcing series that reads from a ForcingFrame"""
+    __slots__ = ("frame", "values", "index", "series", "held")
+    def __init__(self, frame, values, index, series, held=False):
+        """ForcingView(frame, values, index, series[, held]) -> Class instance
+
+        values is the frame's list of current values that this series'
+        value is kept in, at index. series is the original series, which
+        is used for times other than the frame's current time. held is
+        True for a discharge, which is held during the spin-up."""
+        self.frame, self.values, self.index, self.series, self.held = frame, values, index, series, held
+
+    def __getitem__(self, time):
+        if time == self.frame.time: return self.values[self.index]
+        return self.frame.Lookup(self.series, time, self.held)
+
+    def __len__(self): return len(self.series)
+    def __repr__(self): return '%s of %r' % (self.__class__.__name__, self.series)
+    def __getattr__(self, name):
+        # Anything else (keys(), itervalues(), etc.) goes to the series
+        if name in ForcingView.__slots__: raise AttributeError(name)
+        return getattr(self.series, name)
+
+class ForcingFrame(object):
+    """Values of the distinct forcing series of a reach at the current timestep"""
+    def __init__(self, nodes):
+        """ForcingFrame(nodes) -> Class instance
+
+        nodes is a list of StreamNodes in model order. Their ContData,
+        Q_tribs, T_tribs, Q_bc and T_bc series are replaced by ForcingViews."""
+        self.nodes = list(nodes)
+        self.time = None # Time of the current values
+        self.constants = [] # Values of series that never change
+        self.cont, self.cont_series = [], [] # Continuous data sites
+        self.Q_tribs, self.T_tribs, self.Q_series, self.T_series = [], [], [], []
+        self.tribs = [] # (node index, Q_tribs, T_tribs) of each node with tributaries
+        self.bc, self.bc_series, self.bc_held = [], [], [] # Boundary conditions
+        self.replay = {} # Values of each spin-up time of day, by its time of day
+        sites = {} # Site index of each distinct ContData series, by id
+        self.site = zeros(len(self.nodes), dtype=int) # Site of each node
+        for i in xrange(len(self.nodes)):
+            node = self.nodes[i]
+            if node.ContData is not None:
+                if id(node.ContData) not in sites:
+                    sites[id(node.ContData)] = len(self.cont_series)
+                    self.cont_series.append(node.ContData)
+                self.site[i] = sites[id(node.ContData)]
+                node.ContData = ForcingView(self, self.cont, int(self.site[i]), node.ContData)
+            # Tribs come in pairs, and a node with no tributaries has an
+            # empty tuple in each for the entire run.
+            if node.Q_tribs is not None and node.T_tribs is not None:
+                if self.Constant(node.Q_tribs) and self.Constant(node.T_tribs):
+                    node.Q_tribs = self.View(node.Q_tribs, True)
+                    node.T_tribs = self.View(node.T_tribs)
+                else:
+                    self.Q_series.append(node.Q_tribs)
+                    self.T_series.append(node.T_tribs)
+                    node.Q_tribs = ForcingView(self, self.Q_tribs, len(self.Q_series) - 1, node.Q_tribs, True)
+                    node.T_tribs = ForcingView(self, self.T_tribs, len(self.T_series) - 1, node.T_tribs)
+                if node.Q_tribs.values is self.Q_tribs or len(node.Q_tribs.values[node.Q_tribs.index]):
+                    self.tribs.append((i, node.Q_tribs, node.T_tribs))
+            for attr in ("Q_bc", "T_bc"):
+                series = getattr(node, attr, None)
+                if series is None: continue
+                held = attr == "Q_bc"
+                if self.Constant(series): setattr(node, attr, self.View(series, held))
+                else:
+                    self.bc_series.append(series)
+                    self.bc_held.append(held)
+                    setattr(node, attr, ForcingView(self, self.bc, len(self.bc_series) - 1, series, held))
+        self.sites = len(self.cont_series)
+
+    def __repr__(self):
+        return '%s (%i sites, %i tributary nodes, %i boundary series)' % (self.__class__.__name__, self.sites,
+                                                                          len(self.tribs), len(self.bc_series))
+
+    def Constant(self, series):
+        """Return True if series has the same value at every time"""
+        values = set(series.itervalues())
+        # An empty Interpolator gives the same (default) value for every key
+        return len(values) <= 1
+
+    def View(self, series, held=False):
+        """Return a ForcingView of a constant series, which needs no lookups"""
+        self.constants.append(series[0] if not len(series) else series.itervalues().next())
+        return ForcingView(self, self.constants, len(self.constants) - 1, series, held)
+
+    def Lookup(self, series, time, held=False):
+        """Return the value of series at time
+
+        That's series[time], except during the spin-up, which repeats the
+        first model day (or, if held is True, its first value)."""
+        if Chronos.start is None: return series[time]
+        day = Chronos.Periodic(time)
+        if day is None: return series[time]
+        if held: return series[Chronos.start]
+        last = Chronos.day - Chronos.hour # Start of the last hour of the day
+        if day <= last: return series[Chronos.start + day]
+        # Wrap around to the start of the day, not on to the second day
+        return Blend(series[Chronos.start + last], series[Chronos.start], (day - last) / Chronos.hour)
+
+    def Update(self, time):
+        """Look every distinct series up at time"""
+        if time == self.time: return
+        self.time = None # The values aren't valid while we're changing them
+        day = Chronos.Periodic(time) if Chronos.start is not None else None
+        if day is None:
+            self.cont[:] = [s[time] for s in self.cont_series]
+            self.Q_tribs[:] = [s[time] for s in self.Q_series]
+            self.T_tribs[:] = [s[time] for s in self.T_series]
+            self.bc[:] = [s[time] for s in self.bc_series]
+            if self.replay: self.replay = {} # The spin-up is over
+        elif day in self.replay:
+            self.cont[:], self.Q_tribs[:], self.T_tribs[:], self.bc[:] = self.replay[day]
+        else:
+            self.cont[:] = [self.Lookup(s, time) for s in self.cont_series]
+            self.Q_tribs[:] = [self.Lookup(s, time, True) for s in self.Q_series]
+            self.T_tribs[:] = [self.Lookup(s, time) for s in self.T_series]
+            self.bc[:] = [self.Lookup(s, time, self.bc_held[i]) for i, s in enumerate(self.bc_series)]
+            self.replay[day] = list(self.cont), list(self.Q_tribs), list(self.T_tribs), list(self.bc)
+        self._tribarrays = None
+        self.time = time
+
+    def ContData(self):
+        """Return an (N, 4) array of each node's continuous data at the current time"""
+        return asarray(self.cont, dtype=float64)[self.site]
+
+    def TributaryArrays(self):
+        """Return flat arrays of (node index, discharge, temperature) for every tributary"""
+        if self._tribarrays is None:
+            index, Q, T = [], [], []
+            for i, Q_view, T_view in self.tribs:
+                Q_tribs, T_tribs = Q_view.values[Q_view.index], T_view.values[T_view.index]
+                for k in xrange(len(Q_tribs)):
+                    index.append(i)
+                    Q.append(Q_tribs[k] if Q_tribs[k] is not None else float("nan"))
+                    T.append(T_tribs[k] if T_tribs[k] is not None else float("nan"))
+            self._tribarrays = asarray(index, dtype=int), asarray(Q, dtype=float64), asarray(T, dtype=float64)
+        return self._tribarrays
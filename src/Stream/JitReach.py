@@ -0,0 +1,209 @@
+"""Whole-reach routines of the jit backend, compiled loops over the nodes
+
+These have the same arguments and results as the NpHeatsource routines of
+the same names, so the ReachEngine can run with them in its place, but
+rather than a dozen or so NumPy operations on whole arrays, each is a
+compiled loop that calls the JitHeatsource kernel for every node. This
+takes one pass over the reach, without the temporary arrays, and the
+routing and the MacCormick corrector are solved node by node, in model
+order, as StreamNode does, rather than with LinearRecurrence().
+
+The routines that aren't here (e.g. ShaderArrays() and MixTributaries())
+are NpHeatsource's, and so is CalcFlows() with a RatingTable. As in
+JitHeatsource, the compiled loops return a flag rather than raising, and
+where one fails, the NumPy routine is called to raise the HeatSourceError,
+with the failing nodes, that the ReachEngine expects.
+"""
+from __future__ import division
+from math import sqrt
+from numpy import asarray, empty, zeros, float64
+
+import NpHeatsource
+from NpHeatsource import HeatSourceError, SedimentBounds
+from JitHeatsource import Compile, _Muskingum, _SolarFlux, _GroundFluxes, _MacCormick
+
+# The ReachEngine takes all of its routines from this module, so the ones
+# that aren't compiled here are NpHeatsource's, under the same names.
+CalcSolarPosition, ShaderArrays, Downstream = NpHeatsource.CalcSolarPosition, NpHeatsource.ShaderArrays, NpHeatsource.Downstream
+LinearRecurrence, MixTributaries = NpHeatsource.LinearRecurrence, NpHeatsource.MixTributaries
+CalcMacCormick, ManningDepth = NpHeatsource.CalcMacCormick, NpHeatsource.ManningDepth
+GetStreamGeometry, CalcMuskingum = NpHeatsource.GetStreamGeometry, NpHeatsource.CalcMuskingum
+
+def _Each(x, n):
+    """Return x as an array of n floats, repeating it if it's a number"""
+    x = asarray(x, dtype=float64)
+    if x.ndim: return x
+    out = empty(n, dtype=float64)
+    out.fill(x)
+    return out
+
+@Compile
+def _SolarFluxes(hour, JD, Altitude, Zenith, cloud, d_w, W_b, Elevation, TopoFactor, ViewToSky, SampleDist, phi,
+                 emergent, VDensity, VHeight, FullSunAngle, TopoShadeAngle, BankShadeAngle, RipExtinction,
+                 VegetationAngle, F_Solar):
+    for i in range(F_Solar.shape[0]):
+        _SolarFlux(hour[i], JD[i], Altitude[i], Zenith[i], cloud[i], d_w[i], W_b[i], Elevation[i], TopoFactor[i],
+                   ViewToSky[i], SampleDist, phi[i], emergent, VDensity[i], VHeight[i], FullSunAngle[i],
+                   TopoShadeAngle[i], BankShadeAngle[i], RipExtinction[i], VegetationAngle[i], F_Solar[i])
+
+def GetSolarFlux(hour, JD, Altitude, Zenith, cloud, d_w, W_b, Elevation, TopoFactor,
+                 ViewToSky, SampleDist, phi, emergent, VDensity, VHeight, ShaderList):
+    """Return an (N, 8) array of solar fluxes for every node in the reach (see NpHeatsource.GetSolarFlux)"""
+    FullSunAngle, TopoShadeAngle, BankShadeAngle, RipExtinction, VegetationAngle = ShaderList
+    n = asarray(d_w).shape[0]
+    F_Solar = zeros((n, 8), dtype=float64)
+    _SolarFluxes(_Each(hour, n), _Each(JD, n), _Each(Altitude, n), _Each(Zenith, n), _Each(cloud, n), _Each(d_w, n),
+                 _Each(W_b, n), _Each(Elevation, n), _Each(TopoFactor, n), _Each(ViewToSky, n), float(SampleDist),
+                 _Each(phi, n), bool(emergent), _Each(VDensity, n), _Each(VHeight, n), _Each(FullSunAngle, n),
+                 _Each(TopoShadeAngle, n), _Each(BankShadeAngle, n), asarray(RipExtinction, dtype=float64),
+                 asarray(VegetationAngle, dtype=float64), F_Solar)
+    return F_Solar
+
+@Compile
+def _AllGroundFluxes(Cloud, Wind, Humidity, T_Air, Elevation, phi, VHeight, ViewToSky, SedDepth, dx, dt,
+                     SedThermCond, SedThermDiff, calcalluv, T_alluv, P_w, W_w, emergent, penman, wind_a, wind_b,
+                     calcevap, T_prev, T_sed, Q_hyp, F_Solar5, F_Solar7, ground):
+    for i in range(ground.shape[1]):
+        values = _GroundFluxes(Cloud[i], Wind[i], Humidity[i], T_Air[i], Elevation[i], phi[i], VHeight[i],
+                               ViewToSky[i], SedDepth[i], dx[i], dt[i], SedThermCond[i], SedThermDiff[i], calcalluv,
+                               T_alluv, P_w[i], W_w[i], emergent, penman, wind_a, wind_b, calcevap, T_prev[i],
+                               T_sed[i], Q_hyp[i], F_Solar5[i], F_Solar7[i])
+        for j in range(9):
+            ground[j, i] = values[j]
+
+def GetGroundFluxes(Cloud, Wind, Humidity, T_Air, Elevation, phi, VHeight, ViewToSky, SedDepth, dx,
+                    dt, SedThermCond, SedThermDiff, calcalluv, T_alluv, P_w, W_w, emergent, penman, wind_a,
+                    wind_b, calcevap, T_prev, T_sed, Q_hyp, F_Solar5, F_Solar7):
+    """Return the 9-tuple of ground flux arrays over the reach (see NpHeatsource.GetGroundFluxes)"""
+    n = asarray(T_prev).shape[0]
+    ground = empty((9, n), dtype=float64)
+    _AllGroundFluxes(_Each(Cloud, n), _Each(Wind, n), _Each(Humidity, n), _Each(T_Air, n), _Each(Elevation, n),
+                     _Each(phi, n), _Each(VHeight, n), _Each(ViewToSky, n), _Each(SedDepth, n), _Each(dx, n),
+                     _Each(dt, n), _Each(SedThermCond, n), _Each(SedThermDiff, n), bool(calcalluv), float(T_alluv),
+                     _Each(P_w, n), _Each(W_w, n), bool(emergent), bool(penman), float(wind_a), float(wind_b),
+                     bool(calcevap), _Each(T_prev, n), _Each(T_sed, n), _Each(Q_hyp, n), _Each(F_Solar5, n),
+                     _Each(F_Solar7, n), ground)
+    if SedimentBounds(ground[1]).any():
+        # Raises the error, with the nodes that are out of bounds
+        NpHeatsource.GetGroundFluxes(Cloud, Wind, Humidity, T_Air, Elevation, phi, VHeight, ViewToSky, SedDepth,
+                                     dx, dt, SedThermCond, SedThermDiff, calcalluv, T_alluv, P_w, W_w, emergent,
+                                     penman, wind_a, wind_b, calcevap, T_prev, T_sed, Q_hyp, F_Solar5, F_Solar7)
+    return tuple(ground)
+
+@Compile
+def _Predictor(dt, dx, U, T_sed, T_prev, Q_hyp, Q_in, T_in, Q_up_prev, Delta_T, Disp, T_dn_prev, Q_accr,
+               T_accr, MixTDelta_dn, Temp, S, T_mix):
+    for i in range(1, T_prev.shape[0]):
+        Temp[i-1], S[i-1], T_mix[i-1] = _MacCormick(dt[i], dx[i], U[i], T_sed[i], T_prev[i], Q_hyp[i], Q_in[i],
+                                                    T_in[i], Q_up_prev[i-1], Delta_T[i], Disp[i], False, 0.0,
+                                                    T_prev[i-1], T_prev[i], T_dn_prev[i], Q_accr[i], T_accr[i],
+                                                    MixTDelta_dn[i])
+
+def MacCormickPredictor(dt, dx, U, T_sed, T_prev, Q_hyp, Q_in, T_in, Q_up_prev, Delta_T, Disp,
+                        T_dn_prev, Q_accr, T_accr, MixTDelta_dn):
+    """First (predictor) MacCormick step for every node below the headwater (see NpHeatsource.MacCormickPredictor)"""
+    n = asarray(T_prev).shape[0]
+    Temp, S, T_mix = [empty(n - 1, dtype=float64) for i in xrange(3)]
+    _Predictor(_Each(dt, n), _Each(dx, n), _Each(U, n), _Each(T_sed, n), _Each(T_prev, n), _Each(Q_hyp, n),
+               _Each(Q_in, n), _Each(T_in, n), _Each(Q_up_prev, n), _Each(Delta_T, n), _Each(Disp, n),
+               _Each(T_dn_prev, n), _Each(Q_accr, n), _Each(T_accr, n), _Each(MixTDelta_dn, n), Temp, S, T_mix)
+    return Temp, S, T_mix
+
+@Compile
+def _Corrector(dt, dx, U, T_sed, T_prev, Q_hyp, Q_in, T_in, Q, Delta_T, Disp, S1_value, T, Q_accr, T_accr,
+               MixTDelta, Temp):
+    n = T.shape[0]
+    T0 = T[0]
+    for i in range(1, n):
+        # The node below hasn't been corrected yet, and the mouth is its own downstream node
+        dn = i + 1 if i < n - 1 else i
+        T0 = _MacCormick(dt[i], dx[i], U[i], T_sed[i], T_prev[i], Q_hyp[i], Q_in[i], T_in[i], Q[i-1], Delta_T[i],
+                         Disp[i], True, S1_value[i], T0, T[i], T[dn], Q_accr[i], T_accr[i], MixTDelta[dn])[0]
+        Temp[i-1] = T0
+
+def MacCormickCorrector(dt, dx, U, T_sed, T_prev, Q_hyp, Q_in, T_in, Q, Delta_T, Disp, S1_value,
+                        T, Q_accr, T_accr, MixTDelta):
+    """Second (corrector) MacCormick step for every node below the headwater (see NpHeatsource.MacCormickCorrector)
+
+    Each node uses the corrected temperature of the node above it, so this
+    goes down the reach one node at a time."""
+    n = asarray(T).shape[0]
+    Temp = empty(n - 1, dtype=float64)
+    _Corrector(_Each(dt, n), _Each(dx, n), _Each(U, n), _Each(T_sed, n), _Each(T_prev, n), _Each(Q_hyp, n),
+               _Each(Q_in, n), _Each(T_in, n), _Each(Q, n), _Each(Delta_T, n), _Each(Disp, n), _Each(S1_value, n),
+               _Each(T, n), _Each(Q_accr, n), _Each(T_accr, n), _Each(MixTDelta, n), Temp)
+    return Temp
+
+@Compile
+def _Depth(Q, W_b, z, n, S, D0, tol, maxiter):
+    """Return the wetted depth of a node, or -1 if it doesn't converge (see NpHeatsource.ManningDepth)"""
+    target = n * Q / sqrt(S)
+    sz = 2 * sqrt(1 + z**2) # Change in wetted perimeter with depth
+    D = D0 if D0 > 0 else (target / W_b) ** (3 / 5)
+    lo, hi = 0.0, -1.0 # No upper bound yet
+    for count in range(maxiter):
+        A = D * (W_b + z * D)
+        P = W_b + sz * D
+        R = A / P
+        F = A * R**(2 / 3) - target
+        dF = R**(2 / 3) * ((5 / 3) * (W_b + 2 * z * D) - (2 / 3) * R * sz)
+        # Tighten the bracket around the root
+        if F < 0: lo = max(lo, D)
+        if F > 0: hi = D if hi < 0 else min(hi, D)
+        new = D - F / dF
+        if new <= lo or (hi >= 0 and new >= hi):
+            new = 2 * max(D, lo) if hi < 0 else (lo + hi) / 2
+        done = abs(new - D) < tol or F == 0
+        D = new
+        if done: return D
+    return -1.0
+
+@Compile
+def _Route(U, W_w, W_b, S, dx, dt, z, n, D_est, Q, inputs, Q_bc, D_prev, Q_new, geometry):
+    """Route the reach and find its geometry, returning -1, or the index of a node that failed
+
+    Stability is checked first, as a node that fails it stops the run."""
+    nodes = Q.shape[0]
+    Q_new[0] = Q_bc
+    for i in range(1, nodes):
+        Q1 = Q_new[i-1] + inputs[i]
+        Q2 = Q[i-1] + inputs[i]
+        C1, C2, C3, stable = _Muskingum(Q2, U[i], W_w[i], S[i], dx[i], dt[i])
+        if not stable: return i
+        Q_new[i] = C1*Q1 + C2*Q2 + C3*Q[i]
+    for i in range(nodes):
+        # A dry channel has no geometry
+        if Q_new[i] <= 0.003: continue
+        width = W_b[i] if W_b[i] != 0 else 0.01 #ASSUMPTION: Make bottom width 1 cm to prevent undefined numbers in the math.
+        D = D_est[i]
+        if D == 0:
+            D = _Depth(Q_new[i], width, z[i], n[i], S[i], D_prev[i], 1e-7, 200)
+            if D < 0: return i
+        A = (D * (width + z[i] * D))
+        Pw = (width + 2 * D * sqrt(1 + z[i]**2))
+        Ww = width + 2 * z[i] * D
+        U_new = Q_new[i] / A
+        # THis is a sheer velocity estimate, followed by an estimate of numerical dispersion
+        Shear_Velocity = U_new if S[i] == 0.0 else sqrt(9.8 * D * S[i])
+        Dispersion = (0.011 * U_new**2 * Ww**2) / (D * Shear_Velocity)
+        if (Dispersion * dt[i] / dx[i]**2) > 0.5:
+            Dispersion = (0.45 * dx[i]**2) / dt[i]
+        geometry[0, i], geometry[1, i], geometry[2, i], geometry[3, i] = D, A, Pw, A/Pw
+        geometry[4, i], geometry[5, i], geometry[6, i] = Ww, U_new, Dispersion
+    return -1
+
+def CalcFlows(U, W_w, W_b, S, dx, dt, z, n, D_est, Q, inputs, Q_bc, D_prev=None, rating=None):
+    """Route discharge down the whole reach and return (Q, geometry) (see NpHeatsource.CalcFlows)"""
+    if rating is not None:
+        return NpHeatsource.CalcFlows(U, W_w, W_b, S, dx, dt, z, n, D_est, Q, inputs, Q_bc, D_prev, rating)
+    N = asarray(Q).shape[0]
+    Q_new = empty(N, dtype=float64)
+    geometry = zeros((7, N), dtype=float64)
+    failed = _Route(_Each(U, N), _Each(W_w, N), _Each(W_b, N), _Each(S, N), _Each(dx, N), _Each(dt, N),
+                    _Each(z, N), _Each(n, N), _Each(D_est, N), _Each(Q, N), _Each(inputs, N), float(Q_bc),
+                    _Each(0.0 if D_prev is None else D_prev, N), Q_new, geometry)
+    if failed >= 0:
+        # Raises the error, with the nodes that failed
+        NpHeatsource.CalcFlows(U, W_w, W_b, S, dx, dt, z, n, D_est, Q, inputs, Q_bc, D_prev)
+        raise HeatSourceError("Wetted depth did not converge at node %i" % failed)
+    return Q_new, tuple(geometry)
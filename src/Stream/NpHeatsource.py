@@ -0,0 +1,618 @@
+"""Whole-reach versions of the PyHeatsource routines
+
+Each function in this module does the same math as the routine of the
+same name in PyHeatsource, but takes NumPy arrays with one element per
+StreamNode (in ReachState order) and computes every node in one call.
+Values that are the same for every node (the time, the solar position
+when it comes from the headwater node, the model options) may be
+passed as plain scalars and are broadcast.
+"""
+from __future__ import with_statement, division
+from numpy import asarray, zeros, empty, where, errstate, float64, isnan, isinf, bincount, \
+    pi, exp, log, log10, sqrt, sin, cos, arctan as atan, radians, flatnonzero, arange, \
+    minimum, maximum, broadcast_arrays, inf, ones, tan, arccos as acos, searchsorted, \
+    ceil, array
+
+from PyHeatsource import HeatSourceError
+
+def CalcSolarPosition(lat, lon, hour, min, sec, offset, JDC):
+    """Return arrays of (Altitude, Zenith, Daytime, dir) for any number of positions
+
+    The arguments are those of PyHeatsource.CalcSolarPosition, as arrays
+    that broadcast together, so this can give the sun's position for every
+    timestep of a run (hour, min, sec and JDC over time), for every node
+    (lat and lon over the reach), or both at once."""
+    lat, lon, hour, min, sec, offset, JDC = [asarray(x, dtype=float64) for x in
+                                             (lat, lon, hour, min, sec, offset, JDC)]
+    toRadians = pi/180.0
+    toDegrees = 180.0/pi
+    MeanObliquity = 23.0 + (26.0 + ((21.448 - JDC * (46.815 + JDC * (0.00059 - JDC * 0.001813))) / 60.0)) / 60.0
+    Obliquity = MeanObliquity + 0.00256 * cos(toRadians*(125.04 - 1934.136 * JDC))
+    Eccentricity = 0.016708634 - JDC * (0.000042037 + 0.0000001267 * JDC)
+    GeoMeanLongSun = 280.46646 + JDC * (36000.76983 + 0.0003032 * JDC)
+    # These are the while loops of the single position version, all at once
+    GeoMeanLongSun = GeoMeanLongSun + 360 * ceil(-GeoMeanLongSun / 360) * (GeoMeanLongSun < 0)
+    GeoMeanLongSun = GeoMeanLongSun - 360 * ceil((GeoMeanLongSun - 360) / 360) * (GeoMeanLongSun > 360)
+    GeoMeanAnomalySun = 357.52911 + JDC * (35999.05029 - 0.0001537 * JDC)
+
+    Dummy1 = toRadians*GeoMeanAnomalySun
+    Dummy2 = sin(Dummy1)
+    Dummy3 = sin(Dummy2 * 2)
+    Dummy4 = sin(Dummy3 * 3)
+    SunEqofCenter = Dummy2 * (1.914602 - JDC * (0.004817 + 0.000014 * JDC)) + Dummy3 * (0.019993 - 0.000101 * JDC) + Dummy4 * 0.000289
+    SunApparentLong = (GeoMeanLongSun + SunEqofCenter) - 0.00569 - 0.00478 * sin(toRadians*((125.04 - 1934.136 * JDC)))
+
+    Dummy1 = sin(toRadians*Obliquity) * sin(toRadians*SunApparentLong)
+    Declination = toDegrees*(atan(Dummy1 / sqrt(-Dummy1 * Dummy1 + 1)))
+
+    #======================================================
+    #Equation of time (minutes)
+    Dummy = (tan(Obliquity * pi / 360))**2
+    Dummy1 = sin(toRadians*(2 * GeoMeanLongSun))
+    Dummy2 = sin(toRadians*(GeoMeanAnomalySun))
+    Dummy3 = cos(toRadians*(2 * GeoMeanLongSun))
+    Dummy4 = sin(toRadians*(4 * GeoMeanLongSun))
+    Dummy5 = sin(toRadians*(2 * GeoMeanAnomalySun))
+    Et = toDegrees*(4 * (Dummy * Dummy1 - 2 * Eccentricity * Dummy2 + 4 * Eccentricity * Dummy * Dummy2 * Dummy3 - 0.5 * Dummy**2 * Dummy4 - 1.25 * Eccentricity**2 * Dummy5))
+
+    SolarTime = (hour*60.0) + min + (sec/60.0) + (Et - 4.0 * -lon + (offset*60.0))
+    SolarTime = SolarTime - 1440.0 * ceil((SolarTime - 1440.0) / 1440.0) * (SolarTime > 1440.0)
+    HourAngle = SolarTime / 4.0 - 180.0
+    HourAngle = where(HourAngle < -180.0, HourAngle + 360.0, HourAngle)
+
+    Dummy = sin(toRadians*lat) * sin(toRadians*Declination) + cos(toRadians*lat) * cos(toRadians*Declination) * cos(toRadians*HourAngle)
+    Dummy = Dummy.clip(-1.0, 1.0)
+
+    Zenith = toDegrees*(acos(Dummy))
+    Dummy = cos(toRadians*lat) * sin(toRadians*Zenith)
+    with errstate(divide="ignore", invalid="ignore"):
+        Azimuth = (sin(toRadians*lat) * cos(toRadians*Zenith) - sin(toRadians*Declination)) / Dummy
+    Azimuth = 180 - toDegrees*(acos(where(abs(Dummy) >= 0.000999, Azimuth, 0.0).clip(-1.0, 1.0)))
+    Azimuth = where(HourAngle > 0, -Azimuth, Azimuth)
+    Azimuth = where(abs(Dummy) >= 0.000999, Azimuth, where(lat > 0, 180.0, 0.0))
+    Azimuth = where(Azimuth < 0, Azimuth + 360.0, Azimuth)
+
+    AtmElevation = 90 - Zenith
+    with errstate(divide="ignore", invalid="ignore"):
+        Dummy = tan(toRadians*(AtmElevation))
+        RefractionCorrection = where(AtmElevation > 5, 58.1 / Dummy - 0.07 / Dummy**3 + 0.000086 / Dummy**5,
+                               where(AtmElevation > -0.575,
+                                     1735 + AtmElevation * (-518.2 + AtmElevation * (103.4 + AtmElevation * (-12.79 + AtmElevation * 0.711))),
+                                     -20.774 / Dummy)) / 3600
+    RefractionCorrection = where(AtmElevation > 85, 0.0, RefractionCorrection)
+
+    Zenith = Zenith - RefractionCorrection
+    Altitude = 90 - Zenith
+    Daytime = (Altitude > 0.0).astype(int)
+    dir = searchsorted(array((0.0,67.5,112.5,157.5,202.5,247.5,292.5)), Azimuth, side="right") - 1
+
+    return Altitude, Zenith, Daytime, dir
+
+def ShaderArrays(shaderlists):
+    """Return the ShaderLists of a reach as arrays indexed by direction
+
+    shaderlists is a sequence, in model order, of each node's ShaderList,
+    which is a 7-tuple (one per direction) of (FullSunAngle, TopoShadeAngle,
+    BankShadeAngle, RipExtinction, VegetationAngle). The return value is the
+    tuple of arrays (FullSunAngle, TopoShadeAngle, BankShadeAngle,
+    RipExtinction, VegetationAngle), the first three of shape (7, N) and
+    the last two of shape (7, N, zones), so that the arguments for the
+    current sun direction are simply [a[dir] for a in ShaderArrays(...)]"""
+    full = asarray([[d[0] for d in s] for s in shaderlists], dtype=float64).T.copy()
+    topo = asarray([[d[1] for d in s] for s in shaderlists], dtype=float64).T.copy()
+    bank = asarray([[d[2] for d in s] for s in shaderlists], dtype=float64).T.copy()
+    rip = asarray([[d[3] for d in s] for s in shaderlists], dtype=float64).transpose(1, 0, 2).copy()
+    veg = asarray([[d[4] for d in s] for s in shaderlists], dtype=float64).transpose(1, 0, 2).copy()
+    return full, topo, bank, rip, veg
+
+def GetSolarFlux(hour, JD, Altitude, Zenith, cloud, d_w, W_b, Elevation, TopoFactor,
+                 ViewToSky, SampleDist, phi, emergent, VDensity, VHeight, ShaderList):
+    """Return an (N, 8) array of solar fluxes for every node in the reach
+
+    Arguments are those of PyHeatsource.GetSolarFlux, as arrays over the
+    nodes, except that ShaderList is the 5-tuple of arrays for the current
+    sun direction (see ShaderArrays()). This should only be called in the
+    daytime, the same as the single node version."""
+    FullSunAngle, TopoShadeAngle, BankShadeAngle, RipExtinction, VegetationAngle = ShaderList
+    d_w = asarray(d_w, dtype=float64)
+    n = d_w.shape[0]
+    F_Direct = zeros((8, n), dtype=float64)
+    F_Diffuse = zeros((8, n), dtype=float64)
+    Altitude = asarray(Altitude, dtype=float64)
+    Zenith = asarray(Zenith, dtype=float64)
+    cloud = asarray(cloud, dtype=float64)
+    #======================================================
+    # 0 - Edge of atmosphere
+    Rad_Vec = 1 + 0.017 * cos((2 * pi / 365) * (186 - JD + hour / 24))
+    Solar_Constant = 1367 #W/m2
+    F_Direct[0] = (Solar_Constant / (Rad_Vec ** 2)) * sin(radians(Altitude)) #Global Direct Solar Radiation
+    ########################################################
+    #======================================================
+    # 1 - Above Topography
+    Air_Mass = (35 / sqrt(1224 * sin(radians(Altitude)) + 1)) * \
+        exp(-0.0001184 * asarray(Elevation, dtype=float64))
+    Trans_Air = 0.0685 * cos((2 * pi / 365) * (JD + 10)) + 0.8
+    #Calculate Diffuse Fraction
+    F_Direct[1] = F_Direct[0] * (Trans_Air ** Air_Mass) * (1 - 0.65 * cloud ** 2)
+    with errstate(divide="ignore", invalid="ignore"):
+        Clearness_Index = where(F_Direct[0] == 0, 1.0, F_Direct[1] / F_Direct[0])
+
+    Dummy = F_Direct[1].copy()
+    Diffuse_Fraction = (0.938 + 1.071 * Clearness_Index) - \
+        (5.14 * (Clearness_Index ** 2)) + \
+        (2.98 * (Clearness_Index ** 3)) - \
+        (sin(2 * pi * (JD - 40) / 365)) * \
+        (0.009 - 0.078 * Clearness_Index)
+    F_Direct[1] = Dummy * (1 - Diffuse_Fraction)
+    F_Diffuse[1] = Dummy * (Diffuse_Fraction) * (1 - 0.65 * cloud ** 2)
+
+    ########################################################
+    #======================================================
+    #3 - Above Stream Surface (Above Bank Shade)
+    # Each node falls in exactly one of three cases: topographic shade,
+    # partial shade from vegetation or full sun.
+    topo = Altitude <= TopoShadeAngle
+    partial = ~topo & (Altitude < FullSunAngle)
+    F_Direct[2] = where(topo, 0.0, F_Direct[1])
+    F_Diffuse[2] = where(topo, F_Diffuse[1] * TopoFactor, F_Diffuse[1] * (1 - TopoFactor))
+    # Veg shading: each zone whose vegetation angle is above the sun
+    # attenuates the direct beam. Zones that don't shade multiply by one.
+    Dummy1 = F_Direct[2].copy()
+    path = SampleDist / cos(radians(Altitude))
+    for zone in xrange(VegetationAngle.shape[-1]):
+        shading = Altitude < VegetationAngle[..., zone]
+        Dummy1 *= where(shading, (1-(1-exp(-1* RipExtinction[..., zone] * path))), 1.0)
+    F_Direct[3] = where(topo, 0.0, where(partial, Dummy1, F_Direct[2]))
+    F_Diffuse[3] = F_Diffuse[2] * ViewToSky
+    #4 - Above Stream Surface (What a Solar Pathfinder measures)
+    #Account for bank shade
+    bank = ~topo & (Altitude <= BankShadeAngle)
+    F_Direct[4] = where(bank, 0.0, F_Direct[3])
+    F_Diffuse[4] = F_Diffuse[3]
+
+    #Account for emergent vegetation
+    if emergent:
+        VDensity = asarray(VDensity, dtype=float64)
+        VHeight = asarray(VHeight, dtype=float64)
+        W_b = asarray(W_b, dtype=float64)
+        pathEmergent = VHeight / sin(radians(Altitude))
+        pathEmergent = where(pathEmergent > W_b, W_b, pathEmergent)
+        full_dens = VDensity == 1
+        no_dens = VDensity == 0
+        # Densities of exactly one or zero are nudged off the end, as
+        # they are in the single node version, for the diffuse calculation.
+        VDens = where(full_dens, 0.9999, where(no_dens, 0.00001, VDensity))
+        with errstate(divide="ignore", invalid="ignore"):
+            ripExtinctEmergent = -log(1 - VDens) / 10
+            shadeDensityEmergent = where(full_dens, 1.0, where(no_dens, 0.0,
+                                         1 - exp(-ripExtinctEmergent * pathEmergent)))
+            F_Direct[4] = F_Direct[4] * (1 - shadeDensityEmergent)
+            # if there's no VHeight, there's no diffuse attenuation
+            ripExtinctEmergent = -log(1 - VDens) / VHeight
+            shadeDensityEmergent = 1 - exp(-ripExtinctEmergent * VHeight)
+        F_Diffuse[4] = where(VHeight != 0, F_Diffuse[4] * (1 - shadeDensityEmergent), F_Diffuse[4])
+
+    #:::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    #5 - Entering Stream
+    with errstate(divide="ignore", invalid="ignore"):
+        Stream_Reflect = where(Zenith > 80, 0.0515 * (Zenith) - 3.636,
+                               0.091 * (1 / cos(Zenith * pi / 180)) - 0.0386)
+        Stream_Reflect = where(abs(Stream_Reflect) > 1, 0.0515 * (Zenith * pi / 180) - 3.636, Stream_Reflect)
+        Stream_Reflect = where(abs(Stream_Reflect) > 1, 0.091 * (1 / cos(Zenith * pi / 180)) - 0.0386, Stream_Reflect)
+    F_Diffuse[5] = F_Diffuse[4] * 0.91
+    F_Direct[5] = F_Direct[4] * (1 - Stream_Reflect)
+    #:::::::::::::::::::::::::::::::::::::::::::::::::::::::::
+    #7 - Received by Bed
+    Dummy = sin(radians(Zenith)) / 1.3333
+    Water_Path = d_w / cos(atan(Dummy / sqrt(-Dummy * Dummy + 1)))         #Jerlov (1976)
+    Trans_Stream = 0.415 - (0.194 * log10(Water_Path * 100))
+    Trans_Stream = where(Trans_Stream > 1, 1.0, Trans_Stream)
+    Dummy1 = F_Direct[5] * (1 - Trans_Stream)       #Direct Solar Radiation attenuated on way down
+    Dummy2 = F_Direct[5] - Dummy1                   #Direct Solar Radiation Hitting Stream bed
+    Bed_Reflect = exp(0.0214 * (Zenith * pi / 180) - 1.941)   #Reflection Coef. for Direct Solar
+    BedRock = 1 - asarray(phi, dtype=float64)
+    Dummy3 = Dummy2 * (1 - Bed_Reflect)                #Direct Solar Radiation Absorbed in Bed
+    Dummy4 = 0.53 * BedRock * Dummy3                   #Direct Solar Radiation Immediately Returned to Water Column as Heat
+    Dummy5 = Dummy2 * Bed_Reflect                      #Direct Solar Radiation Reflected off Bed
+    Dummy6 = Dummy5 * (1 - Trans_Stream)               #Direct Solar Radiation attenuated on way up
+    F_Direct[6] = Dummy1 + Dummy4 + Dummy6
+    F_Direct[7] = Dummy3 - Dummy4
+    Trans_Stream = 0.415 - (0.194 * log10(100 * d_w))
+    Trans_Stream = where(Trans_Stream > 1, 1.0, Trans_Stream)
+    Dummy1 = F_Diffuse[5] * (1 - Trans_Stream)      #Diffuse Solar Radiation attenuated on way down
+    Dummy2 = F_Diffuse[5] - Dummy1                  #Diffuse Solar Radiation Hitting Stream bed
+    Bed_Reflect = exp(-1.941)                       #Reflection Coef. for Diffuse Solar
+    Dummy3 = Dummy2 * (1 - Bed_Reflect)                #Diffuse Solar Radiation Absorbed in Bed
+    Dummy4 = 0.53 * BedRock * Dummy3                   #Diffuse Solar Radiation Immediately Returned to Water Column as Heat
+    Dummy5 = Dummy2 * Bed_Reflect                      #Diffuse Solar Radiation Reflected off Bed
+    Dummy6 = Dummy5 * (1 - Trans_Stream)               #Diffuse Solar Radiation attenuated on way up
+    F_Diffuse[6] = Dummy1 + Dummy4 + Dummy6
+    F_Diffuse[7] = Dummy3 - Dummy4
+    #=========================================================
+    # Flux positions are the same as in PyHeatsource.GetSolarFlux, but
+    # transposed so that each row is a node.
+    return (F_Diffuse + F_Direct).T.copy()
+
+def SedimentBounds(T_sed):
+    """Return a boolean mask of nodes whose sediment temperature is outside 0<=temp<=50"""
+    return (T_sed > 50) | (T_sed < 0)
+
+def GetGroundFluxes(Cloud, Wind, Humidity, T_Air, Elevation, phi, VHeight, ViewToSky, SedDepth, dx,
+                    dt, SedThermCond, SedThermDiff, calcalluv, T_alluv, P_w, W_w, emergent, penman, wind_a,
+                    wind_b, calcevap, T_prev, T_sed, Q_hyp, F_Solar5, F_Solar7):
+    """Return the 9-tuple of PyHeatsource.GetGroundFluxes as arrays over the reach
+
+    The sediment temperature check is done for all nodes at once. If any
+    node is out of bounds, HeatSourceError is raised with the indices of
+    the failing nodes in its 'nodes' attribute."""
+    T_Air = asarray(T_Air, dtype=float64)
+    T_prev = asarray(T_prev, dtype=float64)
+    T_sed = asarray(T_sed, dtype=float64)
+    Wind = asarray(Wind, dtype=float64)
+    #SedThermCond units of W/(m *C)
+    #SedThermDiff units of cm^2/sec
+
+    SedRhoCp = SedThermCond / (SedThermDiff / 10000)
+    #Water Variable
+    rhow = 1000                             #density of water kg / m3
+    H2O_HeatCapacity = 4187                 #J/(kg *C)
+
+    #Conduction flux (positive is heat into stream)
+    F_Cond = SedThermCond * (T_sed - T_prev) / (SedDepth / 2)             #units of (W / m2)
+    #Calculate the conduction flux between deeper alluvium & substrate conditionally
+    Flux_Conduction_Alluvium = SedThermCond * (T_sed - T_alluv) / (SedDepth / 2) if calcalluv else 0.0
+
+    #Hyporheic flux (negative is heat into sediment)
+    F_hyp = Q_hyp * rhow * H2O_HeatCapacity * (T_sed - T_prev) / (W_w * dx)
+
+    NetFlux_Sed = F_Solar7 - F_Cond - Flux_Conduction_Alluvium - F_hyp
+    DT_Sed = NetFlux_Sed * dt / (SedDepth * SedRhoCp)
+    T_sed_new = T_sed + DT_Sed
+    bad = SedimentBounds(T_sed_new)
+    if bad.any():
+        nodes = flatnonzero(bad)
+        err = HeatSourceError("Sediment temperature not bounded in 0<=temp<=50 at %i node(s), indices: %s" %
+                              (len(nodes), ", ".join(["%i" % i for i in nodes[:20]])))
+        err.nodes = nodes
+        raise err
+
+    #=====================================================
+    #Calculate Longwave FLUX
+    #=====================================================
+    #Atmospheric variables
+    Sat_Vapor = 6.1275 * exp(17.27 * T_Air / (237.3 + T_Air)) #mbar (Chapra p. 567)
+    Air_Vapor = Humidity * Sat_Vapor
+    Sigma = 5.67e-8 #Stefan-Boltzmann constant (W/m2 K4)
+    Emissivity = 1.72 * (((Air_Vapor * 0.1) / (273.2 + T_Air)) ** (1 / 7)) * (1 + 0.22 * Cloud ** 2) #Dingman p 282
+    #======================================================
+    #Calcualte the atmospheric longwave flux
+    F_LW_Atm = 0.96 * ViewToSky * Emissivity * Sigma * (T_Air + 273.2) ** 4
+    #Calcualte the backradiation longwave flux
+    F_LW_Stream = -0.96 * Sigma * (T_prev + 273.2) ** 4
+    #Calcualte the vegetation longwave flux
+    F_LW_Veg = 0.96 * (1 - ViewToSky) * 0.96 * Sigma * (T_Air + 273.2) ** 4
+    #Calcualte the net longwave flux
+    F_Longwave = F_LW_Atm + F_LW_Stream + F_LW_Veg
+
+    #===================================================
+    #Calculate Evaporation FLUX
+    #===================================================
+    #Atmospheric Variables
+    Pressure = 1013 - 0.1055 * Elevation #mbar
+    Sat_Vapor = 6.1275 * exp(17.27 * T_prev / (237.3 + T_prev)) #mbar (Chapra p. 567)
+    Air_Vapor = Humidity * Sat_Vapor
+    #===================================================
+    #Calculate the frictional reduction in wind velocity
+    # Nodes with emergent vegetation get the vertical wind decay rate
+    # (Dingman p. 594), others use the open water Brustsaert (1982) values.
+    if emergent:
+        VHeight = asarray(VHeight, dtype=float64)
+        veg = VHeight > 0
+        with errstate(divide="ignore", invalid="ignore"):
+            Zd = 0.7 * VHeight
+            Zo = 0.1 * VHeight
+            Zm = 2
+            Friction_Velocity = where(veg, Wind * 0.4 / log((Zm - Zd) / Zo), Wind)
+    else:
+        Friction_Velocity = Wind
+    #===================================================
+    #Wind Function f(w)
+    Wind_Function = float(wind_a) + float(wind_b) * Friction_Velocity #m/mbar/s
+
+    #===================================================
+    #Latent Heat of Vaporization
+    LHV = 1000 * (2501.4 + (1.83 * T_prev)) #J/kg
+    P = 998.2 # kg/m3
+    #===================================================
+    #Use Jobson Wind Function
+    if penman:
+        #Calculate Evaporation FLUX
+        Gamma = 1003.5 * Pressure / (LHV * 0.62198) #mb/*C  Cuenca p 141
+        Delta = 6.1275 * exp(17.27 * T_Air / (237.3 + T_Air)) - 6.1275 * exp(17.27 * (T_Air - 1) / (237.3 + T_Air - 1))
+        NetRadiation = F_Solar5 + F_Longwave  #J/m2/s
+        NetRadiation = where(NetRadiation < 0, 0.0, NetRadiation) #J/m2/s
+        Ea = Wind_Function * (Sat_Vapor - Air_Vapor)  #m/s
+        Evap_Rate = ((NetRadiation * Delta / (P * LHV)) + Ea * Gamma) / (Delta + Gamma)
+        F_Evap = -Evap_Rate * LHV * P #W/m2
+        #Calculate Convection FLUX
+        with errstate(divide="ignore", invalid="ignore"):
+            Bowen = Gamma * (T_prev - T_Air) / (Sat_Vapor - Air_Vapor)
+    else:
+        #===================================================
+        #Calculate Evaporation FLUX
+        Evap_Rate = Wind_Function * (Sat_Vapor - Air_Vapor)  #m/s
+        F_Evap = -Evap_Rate * LHV * P #W/m2
+        #Calculate Convection FLUX
+        with errstate(divide="ignore", invalid="ignore"):
+            Bowen = where((Sat_Vapor - Air_Vapor) != 0,
+                          0.61 * (Pressure / 1000) * (T_prev - T_Air) / (Sat_Vapor - Air_Vapor), 1.0)
+    F_Conv = F_Evap * Bowen
+    E = Evap_Rate*W_w if calcevap else zeros(T_prev.shape, dtype=float64)
+    return F_Cond, T_sed_new, F_Longwave, F_LW_Atm, F_LW_Stream, F_LW_Veg, F_Evap, F_Conv, E
+
+def Downstream(x, mouth=None):
+    """Return a copy of x shifted one node, so that element i holds x[i+1]
+
+    The mouth node has no downstream neighbor. Like StreamNode, which
+    points the mouth's next_km at itself, the last element keeps its own
+    value unless another value is given in mouth."""
+    x = asarray(x, dtype=float64)
+    out = empty(x.shape, dtype=float64)
+    out[:-1] = x[1:]
+    out[-1] = x[-1] if mouth is None else mouth
+    return out
+
+def LinearRecurrence(alpha, beta, x0):
+    """Solve x[i] = alpha[i] + beta[i]*x[i-1] for all i, where x[-1] is x0
+
+    This is the upstream-to-downstream dependency of the routing and the
+    MacCormick corrector, where each node uses the value just calculated
+    for the node above it. Rather than loop over the nodes, we compose the
+    affine maps with a doubling scan, which takes log2(N) array operations."""
+    a = asarray(alpha, dtype=float64).copy()
+    b = asarray(beta, dtype=float64).copy()
+    n = a.shape[0]
+    shift = 1
+    while shift < n:
+        # The right hand sides are evaluated before assignment, so these
+        # use the values from the previous pass.
+        a[shift:] = a[shift:] + b[shift:] * a[:-shift]
+        b[shift:] = b[shift:] * b[:-shift]
+        shift *= 2
+    return a + b * x0
+
+def MixTributaries(index, Q_trib, T_trib, n):
+    """Return arrays of the total tributary inflow and its mixed temperature for each node
+
+    index, Q_trib and T_trib are flat sequences with one element per
+    tributary: the node index it enters, and its discharge and temperature.
+    Withdrawls (zero or negative discharge) don't mix, and a tributary with
+    a discharge but no temperature (NaN) is an error, as in CalcMacCormick."""
+    index = asarray(index, dtype=int)
+    Q_trib = asarray(Q_trib, dtype=float64)
+    T_trib = asarray(T_trib, dtype=float64)
+    if isnan(Q_trib).any() or (isnan(T_trib) & (Q_trib > 0)).any():
+        raise HeatSourceError("Problem with null value in tributary discharge or temperature")
+    inflow = Q_trib > 0
+    Q_in = bincount(index[inflow], weights=Q_trib[inflow], minlength=n)
+    numerator = bincount(index[inflow], weights=Q_trib[inflow]*T_trib[inflow], minlength=n)
+    with errstate(divide="ignore", invalid="ignore"):
+        T_in = where((numerator > 0) & (Q_in > 0), numerator / Q_in, 0.0)
+    return Q_in, T_in
+
+def CalcMacCormick(dt, dx, U, T_sed, T_prev, Q_hyp, Q_in, T_in, Q_up, Delta_T, Disp, S1,
+                   S1_value, T0, T1, T2, Q_accr, T_accr, MixTDelta_dn):
+    """Elementwise version of PyHeatsource.CalcMacCormick
+
+    The tributary tuples are replaced by the precomputed total inflow
+    (Q_in) and mixed temperature (T_in) from MixTributaries(). Every other
+    argument is an array over the nodes being calculated, or a scalar.
+    Returns the arrays Temp, S and T_mix."""
+    T_up = T0
+    # This is basically MixItUp from the VB code
+    T_mix = ((Q_in * T_in) + (T_up * Q_up)) / (Q_up + Q_in)
+    #Calculate temperature change from mass transfer from hyporheic zone
+    T_mix = ((T_sed * Q_hyp) + (T_mix * (Q_up + Q_in))) / (Q_hyp + Q_up + Q_in)
+    #Calculate temperature change from accretion inflows
+    T_mix = ((Q_accr * T_accr) + (T_mix * (Q_up + Q_in + Q_hyp))) / (Q_accr + Q_up + Q_in + Q_hyp)
+    T_mix = T_mix - T_up
+    # Adjust the upstream temperature by the tributary mixing and the downstream
+    # temperature by the mixing in that reach (see PyHeatsource.CalcMacCormick)
+    T0 = T0 + T_mix
+    T2 = T2 - MixTDelta_dn
+
+    Dummy1 = -U * (T1 - T0) / dx
+    Dummy2 = Disp * (T2 - 2 * T1 + T0) / (dx**2)
+    S = Dummy1 + Dummy2 + Delta_T / dt
+    if S1:
+        Temp = T_prev + ((S1_value + S) / 2) * dt
+    else:
+        Temp = T1 + S * dt
+
+    return Temp, S, T_mix
+
+def _below(x):
+    """Return the elements of x for nodes 1 through N-1 (scalars pass through)"""
+    return x[1:] if getattr(x, "ndim", 0) else x
+
+def MacCormickPredictor(dt, dx, U, T_sed, T_prev, Q_hyp, Q_in, T_in, Q_up_prev, Delta_T, Disp,
+                        T_dn_prev, Q_accr, T_accr, MixTDelta_dn):
+    """First (predictor) MacCormick step for every node below the headwater
+
+    All arrays are over the whole reach, in model order. The upstream
+    values are taken by shifting: T0 is T_prev[i-1] and Q_up is
+    Q_up_prev[i-1]. T_dn_prev and MixTDelta_dn are the downstream
+    neighbor's values for each node, as returned by Downstream(). Returns
+    Temp, S and T_mix for nodes 1 through N-1 (the headwater node is a
+    boundary condition)."""
+    T_prev = asarray(T_prev, dtype=float64)
+    return CalcMacCormick(_below(dt), _below(dx), _below(U), _below(T_sed), T_prev[1:], _below(Q_hyp),
+                          _below(Q_in), _below(T_in), asarray(Q_up_prev)[:-1], _below(Delta_T), _below(Disp),
+                          False, 0.0, T_prev[:-1], T_prev[1:], _below(T_dn_prev), _below(Q_accr),
+                          _below(T_accr), _below(MixTDelta_dn))
+
+def MacCormickCorrector(dt, dx, U, T_sed, T_prev, Q_hyp, Q_in, T_in, Q, Delta_T, Disp, S1_value,
+                        T, Q_accr, T_accr, MixTDelta):
+    """Second (corrector) MacCormick step for every node below the headwater
+
+    T is the predicted temperature of the whole reach, with T[0] holding the
+    headwater's boundary temperature, and MixTDelta the mixing from the
+    predictor. Node by node, the corrector uses the already corrected
+    temperature of the node above it, so the upstream term is solved as a
+    linear recurrence: the mixed upstream temperature is linear in the
+    upstream temperature, and the corrected temperature is linear in that.
+    Returns the corrected Temp for nodes 1 through N-1."""
+    T = asarray(T, dtype=float64)
+    Q = asarray(Q, dtype=float64)
+    T_prev = asarray(T_prev, dtype=float64)
+    dt, dx, U, T_sed = _below(dt), _below(dx), _below(U), _below(T_sed)
+    Q_hyp, Q_in, T_in, Delta_T = _below(Q_hyp), _below(Q_in), _below(T_in), _below(Delta_T)
+    Disp, S1_value, Q_accr, T_accr = _below(Disp), _below(S1_value), _below(Q_accr), _below(T_accr)
+    T1 = T[1:]
+    T2 = Downstream(T)[1:] - Downstream(MixTDelta)[1:]
+    Q_up = Q[:-1]
+    # Mixed upstream temperature T0 = a + b*T_up
+    Q_total = Q_accr + Q_up + Q_in + Q_hyp
+    a = ((Q_accr * T_accr) + (T_sed * Q_hyp) + (Q_in * T_in)) / Q_total
+    b = Q_up / Q_total
+    # Corrected temperature = c + d*T0
+    c = T_prev[1:] + (dt / 2) * (S1_value - U * T1 / dx + Disp * (T2 - 2 * T1) / (dx**2) + Delta_T / dt)
+    d = (dt / 2) * (U / dx + Disp / (dx**2))
+    return LinearRecurrence(c + d * a, d * b, T[0])
+
+def ManningDepth(Q, W_b, z, n, S, D0=None, tol=1e-7, maxiter=200):
+    """Return the wetted depth satisfying Manning's equation for every node
+
+    Solves A * R_h**(2/3) = n * Q / sqrt(S) for the depth of a trapezoidal
+    channel with Newton's method, using the analytic derivative. Each
+    iteration keeps a bracket around the root (the residual is negative
+    at zero depth and increases with depth), and a Newton step that would
+    leave the bracket is replaced by bisection, or by doubling the depth
+    while no upper bound is known. This converges for any positive
+    discharge without the random restarts of the secant method, and only
+    the nodes that haven't converged are iterated.
+
+    D0 is an optional starting depth for each node, typically the depth at
+    the previous timestep. Where it's missing or not positive, we start from
+    the wide-channel estimate (n*Q/(W_b*sqrt(S)))**(3/5)."""
+    Q, W_b, z, n, S = broadcast_arrays(Q, W_b, z, n, S)
+    shape = Q.shape
+    Q, W_b, z, n, S = [asarray(x, dtype=float64).ravel() for x in (Q, W_b, z, n, S)]
+    target = n * Q / sqrt(S)
+    sz = 2 * sqrt(1 + z**2) # Change in wetted perimeter with depth
+    D = (target / W_b) ** (3 / 5)
+    if D0 is not None:
+        D0 = (asarray(D0, dtype=float64) * ones(shape)).ravel()
+        D = where(D0 > 0, D0, D)
+    D = D.copy()
+    lo = zeros(D.shape, dtype=float64)
+    hi = zeros(D.shape, dtype=float64) + inf
+    active = arange(D.shape[0])
+    for count in xrange(maxiter):
+        d, w, zz, s, t = D[active], W_b[active], z[active], sz[active], target[active]
+        A = d * (w + zz * d)
+        P = w + s * d
+        R = A / P
+        F = A * R**(2 / 3) - t
+        dF = R**(2 / 3) * ((5 / 3) * (w + 2 * zz * d) - (2 / 3) * R * s)
+        # Tighten the bracket around the root
+        l = where(F < 0, maximum(lo[active], d), lo[active])
+        h = where(F > 0, minimum(hi[active], d), hi[active])
+        new = d - F / dF
+        outside = (new <= l) | (new >= h)
+        new = where(outside, where(isinf(h), 2 * maximum(d, l), (l + h) / 2), new)
+        done = (abs(new - d) < tol) | (F == 0)
+        lo[active], hi[active], D[active] = l, h, new
+        active = active[~done]
+        if not active.shape[0]: break
+    else:
+        raise HeatSourceError("Wetted depth did not converge at %i node(s)" % active.shape[0])
+    return D.reshape(shape)
+
+def GetStreamGeometry(Q_est, W_b, z, n, S, D_est, dx, dt, D_prev=None):
+    """Return arrays of (D_est, A, Pw, Rh, Ww, U, Dispersion) for every node
+
+    As in PyHeatsource.GetStreamGeometry, nodes with a nonzero D_est (a
+    control depth) use it as the depth, and the others solve for it, here
+    with ManningDepth() warm-started from D_prev."""
+    Q_est, W_b, z, n, S, D_est = [asarray(x, dtype=float64).copy() for x in
+                                  broadcast_arrays(Q_est, W_b, z, n, S, D_est)]
+    W_b[W_b == 0] = 0.01 #ASSUMPTION: Make bottom width 1 cm to prevent undefined numbers in the math.
+    solve = D_est == 0
+    if solve.any():
+        D0 = None if D_prev is None else (asarray(D_prev, dtype=float64) * (Q_est * 0 + 1))[solve]
+        D_est[solve] = ManningDepth(Q_est[solve], W_b[solve], z[solve], n[solve], S[solve], D0)
+    # Use the calculated wetted depth to calculate new channel characteristics
+    A = (D_est * (W_b + z * D_est))
+    Pw = (W_b + 2 * D_est * sqrt(1 + z**2))
+    Rh = A/Pw
+    Ww = W_b + 2 * z * D_est
+    U = Q_est / A
+
+    # THis is a sheer velocity estimate, followed by an estimate of numerical dispersion
+    Shear_Velocity = where(S == 0.0, U, sqrt(9.8 * D_est * S))
+    Dispersion = (0.011 * U**2 * Ww**2) / (D_est * Shear_Velocity)
+    Dispersion = where((Dispersion * dt / dx**2) > 0.5, (0.45 * dx**2) / dt, Dispersion)
+    return D_est, A, Pw, Rh, Ww, U, Dispersion
+
+def CalcMuskingum(Q_est, U, W_w, S, dx, dt):
+    """Return arrays of the Muskingum routing coefficients C1, C2 and C3
+
+    If the celerity is unstable at any node, HeatSourceError is raised with
+    the failing node indices (into the given arrays) in its 'nodes' attribute."""
+    c_k = (5/3) * U  # Wave celerity
+    X = 0.5 * (1 - Q_est / (W_w * S * dx * c_k))
+    X = where(X > 0.5, 0.5, where(X < 0.0, 0.0, X))
+    K = dx / c_k
+    # Check the celerity to ensure stability. These tests are from the VB code.
+    unstable = dt >= (2 * K * (1 - X))
+    if unstable.any():
+        nodes = flatnonzero(unstable)
+        i = nodes[0]
+        pick = lambda x: x[i] if getattr(x, "ndim", 0) else x
+        err = HeatSourceError("Unstable celerity. Decrease dt or increase dx\n\tVariables causing this affliction:\n"
+                              "dt: %4.0f\ndx: %4.0f\nK: %4.4f\nX: %3.4f\nc_k: %3.4f" %
+                              (pick(dt), pick(dx), pick(K), pick(X), pick(c_k)))
+        err.nodes = nodes
+        raise err
+    # These calculations are from Chow's "Applied Hydrology"
+    D = K * (1 - X) + 0.5 * dt
+    C1 = (0.5*dt - K * X) / D
+    C2 = (0.5*dt + K * X) / D
+    C3 = (K * (1 - X) - 0.5*dt) / D
+    return C1, C2, C3
+
+def CalcFlows(U, W_w, W_b, S, dx, dt, z, n, D_est, Q, inputs, Q_bc, D_prev=None, rating=None):
+    """Route discharge down the whole reach and return (Q, geometry)
+
+    Arrays are over the whole reach, with the previous timestep's values of
+    U, W_w and Q. The headwater takes the boundary discharge Q_bc, and each
+    node below routes its upstream neighbor's new discharge plus its own
+    inputs with the Muskingum coefficients. Since each node depends on the
+    new discharge of the node above it, the routing is solved with
+    LinearRecurrence(). The geometry is the 7-tuple of GetStreamGeometry(),
+    which is zero where the channel is dry (discharge at or below 0.003).
+
+    rating is an optional RatingTable for the reach. Where given, depths
+    are looked up in it rather than solved for, except at control depths
+    and discharges outside of the table's range."""
+    Q = asarray(Q, dtype=float64)
+    inputs = asarray(inputs, dtype=float64)
+    Q1 = inputs[1:] # Plus the upstream node's new discharge, in the recurrence
+    Q2 = Q[:-1] + inputs[1:]
+    C1, C2, C3 = CalcMuskingum(Q2, _below(U), _below(W_w), _below(S), _below(dx), _below(dt))
+    Q_new = empty(Q.shape, dtype=float64)
+    Q_new[0] = Q_bc
+    Q_new[1:] = LinearRecurrence(C1*Q1 + C2*Q2 + C3*Q[1:], C1, Q_bc)
+    Geom = [zeros(Q.shape, dtype=float64) for i in xrange(7)]
+    wet = Q_new > 0.003
+    if wet.any():
+        pick = lambda x: asarray(x)[wet] if getattr(x, "ndim", 0) else x
+        D0 = None if D_prev is None else pick(D_prev)
+        D_wet = pick(D_est) * ones(Q_new[wet].shape)
+        if rating is not None:
+            D_wet = where(D_wet == 0, rating.Depth(Q_new[wet], flatnonzero(wet)), D_wet)
+        for g, value in zip(Geom, GetStreamGeometry(Q_new[wet], pick(W_b), pick(z), pick(n), pick(S),
+                                                    D_wet, pick(dx), pick(dt), D0)):
+            g[wet] = value
+    return Q_new, tuple(Geom)
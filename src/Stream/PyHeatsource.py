@@ -534,17 +534,3 @@ def CalcHeatFluxes(ContData, C_args, d_w, area, P_w, W_w, U, Q_tribs, T_tribs, T
 
     #Mac includes Temp, S, T_mix
     return solar, ground, F_Total, Delta_T, Mac
-
-try:
-    from .. import opt
-    if opt(__name__):
-        from psyco import bind
-        bind(CalcSolarPosition)
-        bind(GetStreamGeometry)
-        bind(CalcMuskingum)
-        bind(CalcFlows)
-        bind(GetSolarFlux)
-        bind(GetGroundFluxes)
-        bind(CalcMacCormick)
-        bind(CalcHeatFluxes)
-except ImportError: pass
@@ -0,0 +1,144 @@
+"""Tabulated wetted depth against discharge for the nodes of a reach
+
+For a fixed trapezoidal channel (bottom width, side slope, Manning's n
+and slope) the wetted depth, and so the rest of the channel geometry, is
+a function of discharge alone. RatingTable solves Manning's equation once
+at startup over a range of discharges and then answers depth lookups by
+interpolation, so the hydraulics of each timestep need no iteration.
+
+Depth is interpolated with cubic Hermite polynomials in log(Q), log(D)
+space, using the exact slope of the rating curve at each knot. Depth is
+nearly a power of discharge, so this is accurate with few knots, and the
+knots are evenly spaced in log(Q) so finding the interval is arithmetic
+rather than a search. The number of knots is doubled until the relative
+depth error at the midpoints between knots is within the tolerance.
+"""
+from __future__ import division
+from numpy import asarray, float64, log, exp, sqrt, floor, linspace, where, \
+    broadcast_arrays, arange, isnan, empty, zeros
+
+from NpHeatsource import ManningDepth
+
+class RatingTable(object):
+    """Depth against discharge for a set of trapezoidal channels"""
+    def __init__(self, W_b, z, n, S, Q_min=0.003, Q_max=1e4, tol=1e-7, maxknots=4097):
+        """RatingTable(W_b, z, n, S, ...) -> Class instance
+
+        The channel parameters are arrays with one element per node. The
+        table covers discharges from Q_min to Q_max. Lookups outside of that
+        range return zero, which GetStreamGeometry() takes as "unknown" and
+        solves directly. tol is the relative depth error, and the table stops
+        refining at maxknots knots whether or not that's been reached."""
+        self.Q_min, self.Q_max = Q_min, Q_max
+        self.tol, self.maxknots = tol, maxknots
+        self.Build(W_b, z, n, S)
+
+    def __len__(self): return self.D.shape[0]
+    def __repr__(self):
+        return '%s (%i nodes, %i knots, error %0.2g)' % (self.__class__.__name__, self.D.shape[0],
+                                                        self.D.shape[1], self.error)
+
+    def Curve(self, Q, W_b, z, n, S):
+        """Return the log of depth and its slope against log(Q) at each discharge"""
+        D = ManningDepth(Q, W_b, z, n, S)
+        A = D * (W_b + z * D)
+        sz = 2 * sqrt(1 + z**2)
+        R = A / (W_b + sz * D)
+        # dQ/dD from Manning's equation, so dlog(D)/dlog(Q) is Q/(D * dQ/dD)
+        dF = R**(2 / 3) * ((5 / 3) * (W_b + 2 * z * D) - (2 / 3) * R * sz)
+        return log(D), (n * Q / sqrt(S)) / (D * dF)
+
+    # Nodes times discharges that the rating curves are solved at in one
+    # go, which bounds the working memory of Build() for any reach size
+    chunk = 1 << 16
+
+    def Build(self, W_b, z, n, S):
+        """Solve the rating curve of every node, refining until within tolerance
+
+        The nodes are solved a chunk at a time, first to find how many knots
+        they all need, then to fill in the table with that many."""
+        W_b, z, n, S = [asarray(x, dtype=float64).copy() for x in broadcast_arrays(W_b, z, n, S)]
+        self.params = W_b.copy(), z, n, S
+        W_b[W_b == 0] = 0.01 #ASSUMPTION: Make bottom width 1 cm, as in GetStreamGeometry
+        channel = lambda start, stop: [x[start:stop,None] for x in (W_b, z, n, S)]
+        nodes, knots, start = W_b.shape[0], 17, 0
+        needs = zeros(nodes, dtype=int) # Knots each node was checked with
+        self.error = 0.0 # Of the nodes checked with the final number of knots
+        while start < nodes:
+            stop = start + max(self.chunk // (2 * knots), 1)
+            needs[start:stop], error = self.Refine(channel(start, stop), knots)
+            if needs[start] > knots: self.error = 0.0
+            knots = needs[start]
+            self.error = max(self.error, error)
+            start = stop
+        self.lnQ, self.step = log(self.Q_min), (log(self.Q_max) - log(self.Q_min)) / (knots - 1)
+        self.D, self.slope = empty((nodes, knots), dtype=float64), empty((nodes, knots), dtype=float64)
+        rows = max(self.chunk // (2 * knots), 1)
+        for start in xrange(0, nodes, rows):
+            part = channel(start, start + rows)
+            self.D[start:start + rows], self.slope[start:start + rows] = self.Curve(self.Knots(knots)[None,:], *part)
+            # Nodes that needed fewer knots are checked again with all of them
+            if (needs[start:start + rows] < knots).any():
+                mid_D = self.Curve(self.Knots(knots, True)[None,:], *part)[0]
+                error = self.Error(self.D[start:start + rows], self.slope[start:start + rows], mid_D, knots)
+                self.error = max(self.error, error)
+
+    def Knots(self, knots, mid=False):
+        """Return the discharges of knots evenly spaced knots (or the midpoints between them)"""
+        lo, hi = log(self.Q_min), log(self.Q_max)
+        if not mid: return exp(linspace(lo, hi, knots))
+        return exp(lo + (hi - lo) / (knots - 1) * (arange(knots - 1) + 0.5))
+
+    def Error(self, lnD, slope, mid_D, knots):
+        """Return the largest relative depth error of a table at the midpoints between its knots"""
+        h = (log(self.Q_max) - log(self.Q_min)) / (knots - 1)
+        guess = self.Hermite(lnD[:,:-1], slope[:,:-1], lnD[:,1:], slope[:,1:], 0.5, h)
+        return abs(exp(guess - mid_D) - 1).max()
+
+    def Refine(self, channel, knots):
+        """Return the number of knots (at least knots) that channel needs to be within tolerance, and its error"""
+        lnD, slope = self.Curve(self.Knots(knots)[None,:], *channel)
+        while True:
+            mid_D, mid_slope = self.Curve(self.Knots(knots, True)[None,:], *channel)
+            error = self.Error(lnD, slope, mid_D, knots)
+            if error <= self.tol or 2 * knots - 1 > self.maxknots: return knots, error
+            # The midpoints become knots of the finer table
+            knots = 2 * knots - 1
+            lnD = self._Interleave(lnD, mid_D)
+            slope = self._Interleave(slope, mid_slope)
+
+    def _Interleave(self, a, b):
+        """Merge the columns of knots a with the midpoints b between them"""
+        out = empty((a.shape[0], a.shape[1] + b.shape[1]), dtype=float64)
+        out[:,0::2] = a
+        out[:,1::2] = b
+        return out
+
+    def Hermite(self, y0, m0, y1, m1, t, h=None):
+        """Cubic Hermite value of log(D) at fraction t of the way between two knots h (default: the table's step) apart"""
+        t2 = t * t
+        t3 = t2 * t
+        if h is None: h = self.step
+        return (2*t3 - 3*t2 + 1) * y0 + (t3 - 2*t2 + t) * h * m0 + (3*t2 - 2*t3) * y1 + (t3 - t2) * h * m1
+
+    def Changed(self, W_b, z, n, S):
+        """Return True if any node's channel parameters differ from the table's"""
+        for old, new in zip(self.params, (W_b, z, n, S)):
+            if (old != new).any(): return True
+        return False
+
+    def Update(self, W_b, z, n, S):
+        """Rebuild the table if the channel parameters have changed"""
+        if self.Changed(W_b, z, n, S): self.Build(W_b, z, n, S)
+
+    def Depth(self, Q, rows=None):
+        """Return the wetted depth at discharge Q for each node (or the given rows)
+
+        Discharges outside of the table's range get a depth of zero."""
+        Q = asarray(Q, dtype=float64)
+        rows = arange(self.D.shape[0]) if rows is None else asarray(rows)
+        out = (Q < self.Q_min) | (Q > self.Q_max) | isnan(Q)
+        x = (log(where(out, self.Q_min, Q)) - self.lnQ) / self.step
+        i = floor(x).astype(int).clip(0, self.D.shape[1] - 2)
+        lnD = self.Hermite(self.D[rows,i], self.slope[rows,i], self.D[rows,i+1], self.slope[rows,i+1], x - i)
+        return where(out, 0.0, exp(lnD))
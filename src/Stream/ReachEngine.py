@@ -0,0 +1,219 @@
+"""Whole-reach model timestep built on ReachState and NpHeatsource
+
+ReachEngine does the work of the StreamNode CalcDischarge(), CalcHeat()
+and MacCormick2() methods for every node of a reach at once. Instead of
+asking each node to calculate itself, it reads and writes the ReachState
+arrays directly and calls the array routines in NpHeatsource, so a
+timestep costs a handful of NumPy operations rather than three Python
+method calls per node. The results are the same as the node by node
+model, up to floating point rounding. The array routines are those of
+the backend (see Backends.py), so with the jit backend, they're the
+compiled loops in JitReach, which have the same arguments.
+
+The NumPy routines are each timed as part of the phase that ModelControl
+times their method in (e.g. "run.heat.solar" in "run.heat"), so the
+timing report shows which of them a timestep's time goes to.
+"""
+from __future__ import with_statement, division
+from time import ctime
+from numpy import asarray, zeros, float64, bincount, flatnonzero, arange, errstate
+
+from ..Dieties.IniParamsDiety import IniParams
+from ..Dieties.ChronosDiety import Chronos
+from ..Utils.easygui import msgbox
+from ..Utils.Timer import Timer
+from RatingTable import RatingTable
+import Backends
+
+class ReachEngine(object):
+    """Array based replacement for the per-node model methods"""
+    def __init__(self, state, forcing=None):
+        """ReachEngine(state[, forcing]) -> Class instance
+
+        state is the ReachState of an initialized reach (i.e. every node
+        has had its Initialize() method called). forcing is the reach's
+        ForcingFrame, if there is one, which is used for the continuous
+        and tributary data whenever it's been updated to the current time."""
+        self.state = state
+        self.forcing = forcing
+        self.nodes = state.nodes
+        self.head = self.nodes[0]
+        # Use the same kernels as the nodes for the scalar routines,
+        # and the backend's array routines for the reach
+        backend = Backends.Current()
+        self._HS = backend.kernels
+        self.np_HS = np_HS = backend.reach
+        # Shading angles for every node, by direction
+        self.Shade = np_HS.ShaderArrays([x.ShaderList for x in self.nodes])
+        self.columns = arange(len(self.nodes)) # For picking a different direction at each node
+        # Only a handful of nodes have tributaries, so we keep a list
+        # of them rather than ask every node each timestep.
+        self.tribs = [i for i in xrange(len(self.nodes))
+                      if [v for v in self.nodes[i].Q_tribs.itervalues() if len(v)]]
+        self._tribtime = self._tribarrays = None
+        self._routing = False # True once the first timestep's discharge is known
+        # Depth against discharge for each node, if we're using them
+        self.Rating = RatingTable(state.W_b, state.z, state.n, state.S) if IniParams["ratingtables"] else None
+
+    def CatchException(self, stderr, time):
+        """Report a problem in a whole reach routine the way StreamNode does"""
+        nodes = getattr(stderr, "nodes", None)
+        where = self.nodes[nodes[0]] if nodes is not None and len(nodes) else "reach"
+        msg = "At %s and time %s\n" % (where, ctime(time))
+        msg += stderr.message if not isinstance(stderr, str) else stderr
+        msg += "\nThe model run has been halted. You may ignore any further error messages."
+        msgbox(msg)
+        raise Exception(msg)
+
+    def TributaryArrays(self, time):
+        """Return flat arrays of (node index, discharge, temperature) for every tributary"""
+        if self.forcing is not None and self.forcing.time == time:
+            return self.forcing.TributaryArrays()
+        if self._tribtime != time:
+            index, Q, T = [], [], []
+            for i in self.tribs:
+                node = self.nodes[i]
+                Q_tribs, T_tribs = node.Q_tribs[time], node.T_tribs[time]
+                for j in xrange(len(Q_tribs)):
+                    index.append(i)
+                    Q.append(Q_tribs[j] if Q_tribs[j] is not None else float("nan"))
+                    T.append(T_tribs[j] if T_tribs[j] is not None else float("nan"))
+            self._tribtime = time
+            self._tribarrays = asarray(index, dtype=int), asarray(Q, dtype=float64), asarray(T, dtype=float64)
+        return self._tribarrays
+
+    def Tributaries(self, time):
+        """Return arrays of tributary inflow and mixed temperature for all nodes"""
+        return self.np_HS.MixTributaries(*self.TributaryArrays(time) + (len(self.nodes),))
+
+    def CalcDischarge(self, time):
+        """Calculate discharge and channel geometry for the reach
+
+        The first timestep has no previous discharge to route, so it's left
+        to the nodes' CalculateDischarge() methods. After that, the whole
+        reach is routed at once by the backend's CalcFlows(), with the Manning
+        depth warm-started from the previous timestep's depth, or looked up
+        in the reach's RatingTable if IniParams["ratingtables"] is set."""
+        if not self._routing:
+            [x.CalcDischarge(time) for x in self.nodes]
+            self._routing = True
+            return
+        st = self.state
+        np_HS = self.np_HS
+        index, Q_tribs, T_tribs = self.TributaryArrays(time)
+        # Unlike the mixing, this includes withdrawls, as sum(Q_tribs) does in StreamNode
+        inputs = st.Q_in + bincount(index, Q_tribs, len(self.nodes)) - st.Q_out - st.E
+        Q_bc = self.head.Q_bc[time]
+        st.Q_mass[1:] += inputs[1:]
+        st.Q_mass[0] += Q_bc
+        # The table is only rebuilt if someone has changed the channel
+        if self.Rating is not None: self.Rating.Update(st.W_b, st.z, st.n, st.S)
+        try:
+            with Timer("run.hydraulics.flows"):
+                Q, geometry = np_HS.CalcFlows(st.U, st.W_w, st.W_b, st.S, st.dx, st.dt, st.z, st.n, st.d_cont,
+                                              st.Q, inputs, Q_bc, st.d_w, self.Rating)
+        except np_HS.HeatSourceError, (stderr):
+            # CalcMuskingum() indexes from the second node
+            if getattr(stderr, "nodes", None) is not None: stderr.nodes = stderr.nodes + 1
+            self.CatchException(stderr, time)
+        st.d_w[:], st.A[:], st.P_w[:], st.R_h[:], st.W_w[:], st.U[:], st.Disp[:] = geometry
+        # Now we've got a value for Q(t,x), so the current Q becomes Q_prev.
+        st.Q_prev[:] = st.Q
+        st.Q[:] = Q
+        st.Q_hyp[:] = Q * st.hyp_percent # Hyporheic discharge
+        for i in flatnonzero(Q < 0.003): #Channel is going dry
+            print "The channel is going dry at %s, model time: %s." % (self.nodes[i], Chronos.TheTime)
+
+    def CalcHeat(self, time, hour, min, sec, JD, JDC, solar_only=False):
+        """Calculate the heat fluxes and predicted temperature for every node
+
+        This is CalcHeat_BoundaryNode() for the headwater and CalcHeat_Opt()
+        for the others. As in the node by node version, each node's upstream
+        neighbor has already moved T into T_prev, while its downstream
+        neighbor has not."""
+        st = self.state
+        head = self.head
+        np_HS = self.np_HS
+        T_prev_dn = st.T_prev.copy() # Downstream node's T_prev, before it's reset
+        Mix_dn = st.Mix_T_Delta.copy()
+        # Reset temperatures
+        st.T_prev[:] = st.T
+        with Timer("run.heat.position"):
+            if head.Ephemeris is None:
+                Altitude, Zenith, Daytime, dir = self._HS.CalcSolarPosition(head.Latitude, head.Longitude, hour, min, sec,
+                                                                            head.UTC_offset, JDC)
+            else: Altitude, Zenith, Daytime, dir = head.Ephemeris(time)
+        if self.forcing is not None and self.forcing.time == time:
+            cloud, wind, humidity, T_air = self.forcing.ContData().T
+        else:
+            cloud, wind, humidity, T_air = asarray([x.ContData[time] for x in self.nodes], dtype=float64).T
+
+        if not head.Ephemeris or not head.Ephemeris.pernode:
+            head.SolarPos = Altitude, Zenith, Daytime, dir
+            if Daytime:
+                with Timer("run.heat.solar"):
+                    F_Solar = np_HS.GetSolarFlux(hour, JD, Altitude, Zenith, cloud, st.d_w, st.W_b, st.Elevation,
+                                                 st.TopoFactor, st.ViewToSky, IniParams["transsample"], st.phi,
+                                                 IniParams["emergent"], st.VDensity, st.VHeight,
+                                                 [a[dir] for a in self.Shade])
+            else: F_Solar = zeros(st.F_Solar.shape, dtype=float64)
+        else:
+            # Each node has its own sun, so we calculate everywhere and
+            # zero out the nodes where it's below the horizon.
+            head.SolarPos = Altitude[0], Zenith[0], Daytime[0], dir[0]
+            F_Solar = zeros(st.F_Solar.shape, dtype=float64)
+            if Daytime.any():
+                with Timer("run.heat.solar"):
+                    with errstate(all="ignore"):
+                        F_Solar = np_HS.GetSolarFlux(hour, JD, Altitude, Zenith, cloud, st.d_w, st.W_b, st.Elevation,
+                                                     st.TopoFactor, st.ViewToSky, IniParams["transsample"], st.phi,
+                                                     IniParams["emergent"], st.VDensity, st.VHeight,
+                                                     [a[dir, self.columns] for a in self.Shade])
+                F_Solar[Daytime == 0] = 0.0
+        st.F_Solar[:] = F_Solar
+        st.F_DailySum[:,1] += F_Solar[:,1]
+        st.F_DailySum[:,4] += F_Solar[:,4]
+
+        T_bc = head.T_bc[time]
+        # We're only running shade, so everything else is empty calories
+        if solar_only:
+            for attr in ("F_Conduction", "T_sed", "F_Longwave", "F_LW_Atm", "F_LW_Stream", "F_LW_Veg",
+                         "F_Evaporation", "F_Convection", "E", "F_Total", "Delta_T", "T", "S1", "Mix_T_Delta"):
+                getattr(st, attr).fill(0)
+            st.T[0] = st.T_prev[0] = T_bc
+            return
+
+        try:
+            with Timer("run.heat.ground"):
+                ground = np_HS.GetGroundFluxes(cloud, wind, humidity, T_air, st.Elevation, st.phi, st.VHeight,
+                                               st.ViewToSky, st.SedDepth, st.dx, st.dt, st.SedThermCond,
+                                               st.SedThermDiff, IniParams["calcalluvium"], IniParams["alluviumtemp"],
+                                               st.P_w, st.W_w, IniParams["emergent"], IniParams["penman"],
+                                               IniParams["wind_a"], IniParams["wind_b"], IniParams["calcevap"],
+                                               st.T_prev, st.T_sed, st.Q_hyp, F_Solar[:,5], F_Solar[:,7])
+            st.F_Conduction[:], st.T_sed[:], st.F_Longwave[:], st.F_LW_Atm[:], st.F_LW_Stream[:], \
+                st.F_LW_Veg[:], st.F_Evaporation[:], st.F_Convection[:], st.E[:] = ground
+            st.F_Total[:] = F_Solar[:,6] + st.F_Conduction + st.F_Longwave + st.F_Evaporation + st.F_Convection
+            st.Delta_T[:] = st.F_Total * st.dt / ((st.A / st.W_w) * 4182 * 998.2) # Vars are Cp (J/kg *C) and P (kgS/m3)
+
+            # The headwater's temperature is the boundary condition, which
+            # becomes the upstream temperature of the second node.
+            st.T_prev[0] = T_bc
+            self.Q_trib, self.T_trib = self.Tributaries(time)
+            with Timer("run.heat.predictor"):
+                T, S1, Mix = np_HS.MacCormickPredictor(st.dt, st.dx, st.U, st.T_sed, st.T_prev, st.Q_hyp,
+                                                       self.Q_trib, self.T_trib, st.Q_prev, st.Delta_T, st.Disp,
+                                                       np_HS.Downstream(T_prev_dn, st.T_prev[-1]), st.Q_in, st.T_in,
+                                                       np_HS.Downstream(Mix_dn))
+        except np_HS.HeatSourceError, (stderr):
+            self.CatchException(stderr, time)
+        st.T[1:], st.S1[1:], st.Mix_T_Delta[1:] = T, S1, Mix
+        st.T[0] = T_bc
+
+    def MacCormick2(self, time):
+        """Corrector step of the MacCormick scheme for every node below the headwater"""
+        st = self.state
+        np_HS = self.np_HS
+        st.T[1:] = np_HS.MacCormickCorrector(st.dt, st.dx, st.U, st.T_sed, st.T_prev, st.Q_hyp,
+                                             self.Q_trib, self.T_trib, st.Q, st.Delta_T, st.Disp, st.S1,
+                                             st.T, st.Q_in, st.T_in, st.Mix_T_Delta)
@@ -0,0 +1,141 @@
+"""Struct-of-arrays storage for the per-node state of a stream reach
+
+ReachState holds every numeric per-node quantity of a reach as a
+contiguous NumPy array indexed by the node's position in the reach
+(headwater is index zero, mouth is index N-1). StreamNode instances
+that are attached to a ReachState no longer carry these values in
+their own instance dictionary, instead they become a thin view onto
+one row of the arrays, so that node.T is really state.T[node.index].
+
+This gives the vectorized routines a place to work on the whole reach
+at once without walking a list of StreamNodes. Reading a node through
+the arrays is several times slower than reading its dictionary,
+though, so when the nodes calculate themselves one by one they are
+left unattached. The arrays are then a copy of the nodes' values,
+gathered from them for a checkpoint, and scattered back to them when
+one is restored.
+"""
+from __future__ import division
+from numpy import zeros, asarray, float64
+
+class ReachState(object):
+    """Container of NumPy arrays, one element (or row) per StreamNode"""
+    # Attributes that change during the model run
+    dynamic = ("Q", "Q_prev", "Q_hyp", "Q_mass", "V", "E", # Discharge, volume and evaporation
+               "d_w", "A", "P_w", "R_h", "W_w", "U", "Disp", # Channel geometry and velocity
+               "T", "T_prev", "T_sed", "Delta_T", "S1", "Mix_T_Delta", # Temperatures and MacCormick terms
+               "F_Conduction", "F_Convection", "F_Longwave", "F_Evaporation", # Ground fluxes
+               "F_LW_Atm", "F_LW_Stream", "F_LW_Veg", "F_Total") # Longwave fluxes and flux sum
+    # Attributes that are set during model setup and (usually) not changed afterward
+    static = ("km", "dx", "dt", "Latitude", "Longitude", "Elevation", # Geographic params
+              "S", "n", "z", "W_b", "d_cont", "Q_cont", # Channel params
+              "Q_in", "T_in", "Q_out", "hyp_percent", # Accretion, withdrawls and hyporheic percent
+              "TopoFactor", "ViewToSky", "VHeight", "VDensity", "Overhang", # Shade params
+              "phi", "SedDepth", "SedThermCond", "SedThermDiff") # Sediment params
+    # Attributes that are lists of values, with the width of each row
+    vectors = (("F_Solar", 8), ("F_DailySum", 5))
+    scalars = dynamic + static
+    fields = scalars + tuple([name for name, width in vectors])
+
+    def __init__(self, nodes, attach=True):
+        """ReachState(nodes, attach) -> Class instance
+
+        nodes is a sequence of StreamNodes in model order (headwater
+        to mouth). Each node's current values are copied into the
+        arrays and, if attach is True, the node is attached as a view
+        onto its row."""
+        self.nodes = list(nodes)
+        self.attached = attach
+        n = len(self.nodes)
+        for name in self.scalars:
+            setattr(self, name, zeros(n, dtype=float64))
+        for name, width in self.vectors:
+            setattr(self, name, zeros((n, width), dtype=float64))
+        if attach:
+            for i in xrange(n):
+                self.nodes[i].Attach(self, i)
+        else: self.Gather()
+
+    def __len__(self): return len(self.nodes)
+    def __repr__(self):
+        return '%s (%i nodes%s)' % (self.__class__.__name__, len(self.nodes), "" if self.attached else ", unattached")
+
+    def Detach(self):
+        """Copy values back into the nodes and release them from the arrays"""
+        for node in self.nodes:
+            node.Detach()
+        self.attached = False
+
+    def Gather(self, names=None):
+        """Copy the named (default: all) values of unattached nodes into the arrays"""
+        if self.attached: return
+        for name in names or self.fields:
+            arr = getattr(self, name)
+            for i in xrange(len(self.nodes)):
+                # As for an attached node, None is stored as zero
+                value = getattr(self.nodes[i], name)
+                arr[i] = value if value is not None else 0.0
+
+    def Scatter(self, names=None):
+        """Copy the named (default: all) arrays back into unattached nodes"""
+        if self.attached: return
+        for name in names or self.fields:
+            arr = getattr(self, name)
+            values = arr.tolist() # Plain floats (or lists of them, for the vectors)
+            for i in xrange(len(self.nodes)):
+                setattr(self.nodes[i], name, values[i])
+
+    def Snapshot(self, names=None):
+        """Return a dictionary of copies of the named (default: dynamic) arrays"""
+        names = names or self.dynamic + tuple([name for name, width in self.vectors])
+        self.Gather(names)
+        return dict([(name, getattr(self, name).copy()) for name in names])
+
+    def Restore(self, snapshot):
+        """Copy the arrays in a dictionary from Snapshot() back into the state"""
+        for name, value in snapshot.iteritems():
+            getattr(self, name)[:] = asarray(value, dtype=float64)
+        self.Scatter(snapshot.keys())
+
+
+class StateField(object):
+    """Descriptor that redirects a StreamNode attribute to a ReachState array
+
+    These are only on the class of attached nodes (see StreamNode.Attach()),
+    so plain StreamNodes keep their values in the instance dictionary, as
+    they always have. For an attached node, reading or writing the
+    attribute reads or writes the node's element of the array. Reads
+    return a plain Python float, because NumPy scalar arithmetic is several
+    times slower than float arithmetic in the per-node routines."""
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, node, cls):
+        # The attached case is by far the most common, so it is tried first.
+        # An unattached node has a _state of None, which has no __dict__.
+        try: return node._state.__dict__[self.name].item(node._index)
+        except AttributeError:
+            if node is None: return self
+            try: return node.__dict__[self.name]
+            except KeyError: raise AttributeError(self.name)
+
+    def __set__(self, node, value):
+        try: arr = node._state.__dict__[self.name]
+        except AttributeError:
+            node.__dict__[self.name] = value
+            return
+        # None has no place in a float array, and the model uses None
+        # and zero interchangeably as "not yet calculated."
+        arr[node._index] = value if value is not None else 0.0
+
+class VectorField(StateField):
+    """StateField for list attributes, such as F_Solar, which map to an array row
+
+    Reads return a view of the row, so in-place changes such as
+    node.F_DailySum[1] += x are written straight into the array."""
+    def __get__(self, node, cls):
+        try: return node._state.__dict__[self.name][node._index]
+        except AttributeError:
+            if node is None: return self
+            try: return node.__dict__[self.name]
+            except KeyError: raise AttributeError(self.name)
@@ -0,0 +1,128 @@
+"""Solar position for every timestep of a model run, calculated up front
+
+The sun's position depends only on where we are and what time it is, so
+rather than call CalcSolarPosition() once each timestep, SolarEphemeris
+calculates Altitude, Zenith, Daytime and the direction index for every
+timestep from the start of the flush period to the end of the run in one
+pass with NpHeatsource.CalcSolarPosition(). The model then just looks the
+values up by time.
+
+The table can be for a single location (the headwater node, which is what
+the node by node model uses for the whole reach) or for every node. Tables
+are small, so if a cache directory is given, they're saved there with a
+name made from the locations, timezone offset, dt and date range, and a
+later run with the same values loads the table rather than building it.
+
+SpinupReplay repeats the solar positions of the first day of the spin-up
+(flush) period on the days after it, as the forcing data are repeated.
+"""
+from __future__ import division
+from time import gmtime
+from os.path import join, exists
+from numpy import asarray, arange, float64, int8, unique, load, savez, atleast_1d
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1
+
+from ..Dieties.ChronosDiety import Chronos, JulianCentury
+import NpHeatsource as np_HS
+
+class SolarEphemeris(object):
+    """Table of solar positions, one row per timestep"""
+    version = 1 # Change this if the table's contents change, to invalidate caches
+    def __init__(self, lat, lon, offset, start, stop, dt, cachedir=None):
+        """SolarEphemeris(lat, lon, offset, start, stop, dt[, cachedir]) -> Class instance
+
+        lat and lon are either single values, or sequences with one value per
+        node. start and stop are seconds since the epoch, inclusive (as with
+        Chronos), and dt is the timestep in seconds."""
+        self.pernode = hasattr(lat, "__len__")
+        self.lat = atleast_1d(asarray(lat, dtype=float64))
+        self.lon = atleast_1d(asarray(lon, dtype=float64))
+        self.offset, self.start, self.stop, self.dt = offset, start, stop, dt
+        self.filename = join(cachedir, "ephemeris_%s.npz" % self.Key()) if cachedir else None
+        if self.filename and exists(self.filename):
+            self.Load(self.filename)
+        else:
+            self.Build()
+            if self.filename: self.Save(self.filename)
+
+    def __len__(self): return self.Altitude.shape[0]
+    def __repr__(self):
+        return '%s (%i timesteps, %i locations)' % (self.__class__.__name__, self.Altitude.shape[0],
+                                                   self.Altitude.shape[1])
+
+    def Key(self):
+        """Return a string that identifies the table's inputs"""
+        key = repr((self.version, self.lat.tolist(), self.lon.tolist(), self.offset,
+                    self.start, self.stop, self.dt))
+        return sha1(key).hexdigest()
+
+    def Build(self):
+        """Calculate the solar position at every timestep and location"""
+        times = self.start + arange(int((self.stop - self.start) // self.dt) + 1) * self.dt
+        seconds = times % 86400
+        # JDC changes only once a day, so it's calculated for each day
+        days, which = unique(times // 86400, return_inverse=True)
+        JDC = asarray([JulianCentury(day * 86400) for day in days], dtype=float64)[which]
+        col = lambda x: asarray(x)[:,None]
+        Altitude, Zenith, Daytime, dir = np_HS.CalcSolarPosition(self.lat, self.lon, col(seconds // 3600),
+                                                                 col((seconds % 3600) // 60), col(seconds % 60),
+                                                                 self.offset, col(JDC))
+        self.Altitude, self.Zenith = Altitude, Zenith
+        self.Daytime, self.dir = Daytime.astype(int8), dir.astype(int8)
+
+    def Save(self, filename):
+        """Write the table to filename, in NumPy's .npz format"""
+        savez(filename, Altitude=self.Altitude, Zenith=self.Zenith, Daytime=self.Daytime, dir=self.dir)
+
+    def Load(self, filename):
+        """Read a table written by Save()"""
+        data = load(filename)
+        self.Altitude, self.Zenith = data["Altitude"], data["Zenith"]
+        self.Daytime, self.dir = data["Daytime"], data["dir"]
+
+    def __call__(self, time):
+        """Return (Altitude, Zenith, Daytime, dir) at time
+
+        For a single location, these are plain values, as returned by
+        CalcSolarPosition(). Otherwise they are arrays over the nodes."""
+        i = int(round((time - self.start) / self.dt))
+        if not self.pernode:
+            return self.Altitude.item(i, 0), self.Zenith.item(i, 0), self.Daytime.item(i, 0), self.dir.item(i, 0)
+        return self.Altitude[i], self.Zenith[i], self.Daytime[i], self.dir[i]
+
+class SpinupReplay(object):
+    """Solar position that repeats the first day of the spin-up
+
+    During the spin-up, the position at each time of day is found on the
+    first day and replayed from memory on the others. After it, positions
+    are found as usual."""
+    def __init__(self, lat, lon, offset, HS, ephemeris=None):
+        """SpinupReplay(lat, lon, offset, HS[, ephemeris]) -> Class instance
+
+        HS is the module whose CalcSolarPosition() is used, unless there's
+        an ephemeris (a SolarEphemeris) to look positions up in."""
+        self.lat, self.lon, self.offset, self.HS = lat, lon, offset, HS
+        self.ephemeris = ephemeris
+        self.pernode = ephemeris is not None and ephemeris.pernode
+        self.replay = {} # Position by spin-up time of day
+
+    def __repr__(self): return '%s of %r' % (self.__class__.__name__, self.ephemeris)
+
+    def __call__(self, time):
+        """Return (Altitude, Zenith, Daytime, dir) at time, as the ephemeris or CalcSolarPosition() would"""
+        day = Chronos.Periodic(time)
+        if day is None:
+            if self.ephemeris is not None: return self.ephemeris(time)
+            return self.Calculate(time, Chronos.TimeTuple()[-1])
+        if day not in self.replay:
+            time = Chronos.spin_start + day
+            if self.ephemeris is not None: self.replay[day] = self.ephemeris(time)
+            else: self.replay[day] = self.Calculate(time, JulianCentury(time))
+        return self.replay[day]
+
+    def Calculate(self, time, JDC):
+        H, M, S = gmtime(time)[3:6]
+        return self.HS.CalcSolarPosition(self.lat, self.lon, H, M, S, self.offset, JDC)
@@ -11,20 +11,16 @@ from ..Dieties.IniParamsDiety import IniParams
 from ..Utils.Logger import Logger
 from ..Utils.easygui import indexbox, msgbox
 from ..Utils.Dictionaries import Interpolator
-import PyHeatsource as py_HS
-import heatsource.HSmodule as C_HS
+from ReachState import ReachState, StateField, VectorField
+import Backends
 
-_HS = None # Placeholder for heatsource module
-
-from .. import opt
-try:
-    if opt(__name__):
-        import psyco.classes
-        object = psyco.classes.psyobj
-except ImportError: pass
+_HS = None # Placeholder for the kernel module of the backend (see Backends.py)
 
 class StreamNode(object):
     """Definition of an individual stream segment"""
+    # ReachState this node is a view onto (if any) and our row in it
+    _state = None
+    _index = None
     def __init__(self, **kwargs):
         __slots = ["Latitude", "Longitude", "Elevation", # Geographic params
                 "FLIR_Temp", "FLIR_Time", # FLIR data
@@ -76,7 +72,8 @@ class StreamNode(object):
                 "F_LW_Stream", "F_LW_Atm", "F_LW_Veg", # Longwave fluxes
                 "C_args", # tuple of variables that do not change during the model
                 "CalcHeat", "CalcDischarge", # Reference to correct heat calculation method
-                "SolarPos", "UTC_offset" # Solar position variables and UTC_offset for their calculation
+                "SolarPos", "UTC_offset", # Solar position variables and UTC_offset for their calculation
+                "Ephemeris" # Precalculated solar positions (headwater only), or None
                 ]
         # Define members in __slots__ to ensure that later member names cannot be added accidentally
         # Set all the attributes to bare lists, or set from the constructor
@@ -100,6 +97,34 @@ class StreamNode(object):
         self.Log = Logger
         self.ShaderList = ()
         self.UTC_offset = IniParams["offset"]
+    def Attach(self, state, index):
+        """Move our numeric attributes into row index of a ReachState"""
+        values = {}
+        for attr in state.fields:
+            values[attr] = self.__dict__.pop(attr, None)
+        self._state = state
+        self._index = index
+        # Only attached nodes have the descriptors that read the arrays
+        self.__class__ = StreamNodeView
+        for attr, value in values.iteritems():
+            setattr(self, attr, value)
+
+    def Detach(self):
+        """Copy our row of the ReachState back into the instance dictionary"""
+        state = self._state
+        if state is None: return
+        values = {}
+        for attr in state.fields:
+            value = getattr(self, attr)
+            values[attr] = value.tolist() if attr in dict(state.vectors) else float(value)
+        self._state = None
+        self._index = None
+        self.__class__ = StreamNode
+        self.__dict__.update(values)
+
+    index = property(lambda self: self._index)
+    state = property(lambda self: self._state)
+
     def GetNodeData(self):
         data = {}
         for attr in self.__slots:
@@ -129,16 +154,13 @@ class StreamNode(object):
 
     def Initialize(self):
         """Methods necessary to set initial conditions of the node"""
-        global _HS, py_HS, C_HS
+        global _HS
         has_prev = self.prev_km is not None
         if has_prev:
             self.CalcHeat = self.CalcHeat_Opt
         else:
             self.CalcHeat = self.CalcHeat_BoundaryNode
-        if IniParams["run_in_python"]:
-            _HS = py_HS
-        else:
-            _HS = C_HS
+        _HS = Backends.Current().kernels
 
         self.CalcDischarge = self.CalculateDischarge
         self.C_args = (self.W_b, self.Elevation, self.TopoFactor, self.ViewToSky, self.phi, self.VDensity, self.VHeight,
@@ -277,7 +299,9 @@ c_k: %3.4f""" % stderr
         # Reset temperatures
         self.T_prev = self.T
         self.T = None
-        Altitude, Zenith, Daytime, dir = _HS.CalcSolarPosition(self.Latitude, self.Longitude, hour, min, sec, self.UTC_offset, JDC)
+        if self.Ephemeris is None:
+            Altitude, Zenith, Daytime, dir = _HS.CalcSolarPosition(self.Latitude, self.Longitude, hour, min, sec, self.UTC_offset, JDC)
+        else: Altitude, Zenith, Daytime, dir = self.Ephemeris(time)
         self.SolarPos = Altitude, Zenith, Daytime, dir
         try:
             self.F_Solar, \
@@ -385,3 +409,13 @@ c_k: %3.4f""" % stderr
 #            T_mix = ((Q_accr * T_accr) + (T_mix * (Q_up + Q_in))) / (Q_accr + Q_up + Q_in)
         return T_mix - T_up
 
+class StreamNodeView(StreamNode):
+    """A StreamNode attached to a ReachState, whose numeric attributes are its row of the arrays"""
+    pass
+
+# The numeric attributes of an attached node are stored in its ReachState
+for attr in ReachState.scalars:
+    setattr(StreamNodeView, attr, StateField(attr))
+for attr, width in ReachState.vectors:
+    setattr(StreamNodeView, attr, VectorField(attr))
+
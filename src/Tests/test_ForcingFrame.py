@@ -0,0 +1,53 @@
+"""The spin-up forcing of the ForcingFrame against the old hourly flush copies"""
+from __future__ import division
+import unittest
+from math import sin, pi
+
+from ..Dieties.ChronosDiety import Chronos
+from ..Stream.ForcingFrame import ForcingFrame
+from ..Utils.Dictionaries import Interpolator, TimeSeries
+
+start, flushdays, dt = 1214870400, 2, 60 # 2008-07-01, midnight
+spin_start = start - flushdays * 86400
+
+def Forcing(time):
+    """Air temperature with a daily cycle and a warming trend, so it isn't periodic"""
+    return 15 + 5 * sin(2 * pi * (time - start) / 86400) + 3 * (time - start) / 86400
+
+class Node(object):
+    """Just the forcing series of a StreamNode"""
+    def __init__(self, ContData, Q_bc):
+        self.ContData, self.Q_bc = ContData, Q_bc
+        self.Q_tribs = self.T_tribs = self.T_bc = None
+
+class SpinupForcing(unittest.TestCase):
+    def setUp(self):
+        Chronos.Start(start=start, stop=start + 3 * 86400, dt=dt, spin=flushdays)
+        hours = [start + h * 3600 for h in xrange(3 * 24 + 1)]
+        self.data = TimeSeries(hours, [(0.0, 1.0, 50.0, Forcing(t)) for t in hours], start, start + 3 * 86400, dt)
+        self.flow = TimeSeries(hours, [1.0 + (t - start) / 86400 for t in hours], start, start + 3 * 86400, dt)
+        # What ExcelInterface used to build: hourly copies of the first day
+        # over the flush period, with the discharge held at its start value.
+        self.copies, self.held = Interpolator(), Interpolator()
+        for t in hours: self.copies[t], self.held[t] = self.data[t], self.flow[t]
+        for i in xrange(flushdays * 24):
+            self.copies[spin_start + i * 3600] = self.data[start + (i % 24) * 3600]
+            self.held[spin_start + i * 3600] = self.flow[start]
+        self.frame = ForcingFrame([Node(self.data, self.flow)])
+
+    def test_spinup_matches_flush_copies(self):
+        node = self.frame.nodes[0]
+        for t in xrange(spin_start, start + 3600, dt):
+            self.frame.Update(t)
+            for k in xrange(4):
+                self.assertAlmostEqual(node.ContData[t][k], self.copies[t][k], 9)
+            self.assertAlmostEqual(node.Q_bc[t], self.held[t], 9)
+
+    def test_last_hour_wraps_to_first_day(self):
+        node = self.frame.nodes[0]
+        t = start - dt # The last timestep of the spin-up
+        self.assertAlmostEqual(node.ContData[t][3], (Forcing(start + 23 * 3600) + 59 * Forcing(start)) / 60, 9)
+        self.assertNotAlmostEqual(node.ContData[t][3], self.data[start + 86400 - dt][3], 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+"""Kernel traces, whole and cut off"""
+from __future__ import division
+import unittest
+from tempfile import mkdtemp
+from shutil import rmtree
+from os.path import join
+
+from ..Utils.KernelTrace import KernelRecorder, ReadTrace
+
+class Kernels(object):
+    """A stand-in for a kernel module"""
+    __name__ = "Kernels"
+    def CalcFlows(self, *args): return sum(args), None
+    def CalcHeatFluxes(self, *args): return [float(a) for a in args]
+    def CalcMacCormick(self, *args): return args[0], True
+
+class Trace(unittest.TestCase):
+    def setUp(self):
+        self.dir = mkdtemp(prefix="heatsource_test_")
+        self.filename = join(self.dir, "Kernels.trace")
+        self.trace = KernelRecorder(Kernels(), self.filename)
+        for step in xrange(50):
+            self.trace.Step(1000.0 + step * 60, step)
+            self.trace.CalcFlows(1.0, 2.0, step)
+            self.trace.CalcHeatFluxes(step, 0.5)
+            self.trace.CalcMacCormick(3.0, None)
+    def tearDown(self): rmtree(self.dir, True)
+
+    def test_closed(self):
+        self.assertEqual(self.trace.Close(), 150)
+        module, calls = ReadTrace(self.filename)
+        self.assertEqual(module, "Kernels")
+        self.assertEqual(len(calls), 150)
+        self.assertEqual(calls[3], ("CalcFlows", 1060.0, 0, (1.0, 2.0, 1), (4.0, None)))
+
+    def test_cut_off(self):
+        self.trace.Close()
+        data = open(self.filename, "rb").read()
+        f = open(self.filename, "wb")
+        f.write(data[:len(data) * 2 // 3])
+        f.close()
+        module, calls = ReadTrace(self.filename)
+        self.assertTrue(0 < len(calls) < 150)
+        self.assertEqual(calls[0], ("CalcFlows", 1000.0, 0, (1.0, 2.0, 0), (3.0, None)))
+
+if __name__ == "__main__":
+    unittest.main()
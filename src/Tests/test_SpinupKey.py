@@ -0,0 +1,34 @@
+"""The spin-up cache key of ModelControl"""
+from __future__ import division
+import unittest
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import sep
+
+from ..BigRedButton import ModelControl
+from ..Benchmark.Synthetic import SyntheticReach
+from ..Utils.Logger import Logger
+
+class SpinupKey(unittest.TestCase):
+    def setUp(self): self.outputdir = mkdtemp(prefix="heatsource_test_")
+    def tearDown(self): rmtree(self.outputdir, True)
+
+    def Key(self, warmer=1.0):
+        """Return the spin-up key of a small synthetic reach, with air warmer after the first hour of the first day"""
+        reach = SyntheticReach(10, 2, 5, flushdays=2, outputdir=self.outputdir + sep, log=Logger, backend="python")
+        data = reach.Reach[max(reach.Reach)].ContData
+        first = min(data.keys()) + 3600 # The data starts an hour before the model
+        for time in data.keys():
+            if first < time < first + 86400:
+                cloud, wind, humidity, air = data[time]
+                data[time] = cloud, wind, humidity, air * warmer
+        return ModelControl(None, 0, interface=reach).SpinupKey()
+
+    def test_same_inputs(self):
+        self.assertEqual(self.Key(), self.Key())
+
+    def test_first_day_forcing(self):
+        self.assertNotEqual(self.Key(), self.Key(1.3))
+
+if __name__ == "__main__":
+    unittest.main()
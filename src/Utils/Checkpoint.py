@@ -0,0 +1,60 @@
+"""Checkpoint files for stopping and resuming a model run
+
+A checkpoint is a single NumPy .npz file holding everything needed to
+carry on from a point in model time: the ReachState arrays, the Chronos
+clock, the Output buffers and the model's running totals. Each part of
+the model puts its values in under its own prefix (e.g. "Chronos.current")
+and takes them back out when it's restored, so this module only knows how
+to name, write and find the files.
+
+Files are called checkpoint_<seconds>.npz, from the model time they were
+taken at. They're written under a temporary name and renamed, so a crash
+while writing leaves the previous checkpoint in place, and older ones are
+removed once the new one is written. The spin-up cache uses the same
+format, in files named by a hash of the model's inputs (see
+ModelControl.SpinupKey()).
+"""
+from os import rename, unlink, listdir
+from os.path import join, exists
+from numpy import savez, load
+
+prefix, suffix = "checkpoint_", ".npz"
+
+def Checkpoints(directory):
+    """Return a list of (time, filename) of the checkpoints in directory, oldest first"""
+    found = []
+    if not exists(directory): return found
+    for name in listdir(directory):
+        if not (name.startswith(prefix) and name.endswith(suffix)): continue
+        try: time = int(name[len(prefix):-len(suffix)])
+        except ValueError: continue # A temporary file, or someone else's
+        found.append((time, join(directory, name)))
+    found.sort()
+    return found
+
+def Latest(directory):
+    """Return the filename of the newest checkpoint in directory, or None"""
+    found = Checkpoints(directory)
+    return found[-1][1] if found else None
+
+def Write(filename, values):
+    """Write a dictionary of arrays (or numbers) to filename, which ends in .npz"""
+    temporary = filename[:-len(suffix)] + ".tmp" + suffix
+    savez(temporary, **values)
+    if exists(filename): unlink(filename) # Windows won't rename over a file
+    rename(temporary, filename)
+
+def Save(directory, time, values):
+    """Write a dictionary of arrays (or numbers) as the checkpoint at time"""
+    filename = join(directory, "%s%i%s" % (prefix, time, suffix))
+    old = Checkpoints(directory)
+    Write(filename, values)
+    for t, name in old:
+        if name != filename: unlink(name)
+    return filename
+
+def Load(filename):
+    """Return the dictionary of arrays in a checkpoint file"""
+    data = load(filename)
+    try: return dict([(key, data[key]) for key in data.files])
+    finally: data.close()
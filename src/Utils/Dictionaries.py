@@ -2,9 +2,9 @@ from __future__ import division
 from time import ctime, gmtime
 from collections import defaultdict
 from bisect import bisect_right, bisect_left
+from numpy import asarray, arange, searchsorted, where, isnan, float64, nan
 
 from ..Dieties.IniParamsDiety import IniParams
-from .. import opt
 
 class Interpolator(defaultdict):
     def __init__(self, *args, **kwargs):
@@ -84,8 +84,101 @@ class Interpolator(defaultdict):
             d[k] = self[k]
         return d
 
-try:
-    if opt(__name__):
-        import psyco
-        psyco.bind(Interpolator.__missing__)
-except ImportError: pass
+class TimeSeries(object):
+    def __init__(self, times, values, start=None, stop=None, dt=None):
+        """Array backed time series, resampled onto the model timestep
+
+        times is a sorted sequence of seconds since the epoch and values
+        a sequence of the same length, either of numbers or of equal length
+        tuples of numbers (as in an Interpolator), where None is allowed.
+        Between the given times, values are interpolated linearly, as the
+        Interpolator does. Before the first or after the last, the first or
+        last value is used.
+
+        If start, stop and dt are given, the series is resampled once onto
+        every timestep from start to stop (inclusive, as with Chronos), and
+        a lookup at one of those times is just an index into an array.
+        Lookups at other times are interpolated from the original values."""
+        self.times = asarray(times, dtype=float64)
+        values = list(values)
+        self.width = len(values[0]) if isinstance(values[0], tuple) else None
+        if self.width is not None and [v for v in values if len(v) != self.width]:
+            raise ValueError("All values of a TimeSeries must be the same length")
+        # None becomes NaN in the arrays, and back again in lookups
+        if self.width is None: rows = [v if v is not None else nan for v in values]
+        else: rows = [[x if x is not None else nan for x in v] for v in values]
+        self.data = asarray(rows, dtype=float64).reshape((len(values),) + ((self.width,) if self.width is not None else ()))
+        self.none = bool(isnan(self.data).any())
+        self.start = self.grid = None
+        if start is not None: self.Resample(start, stop, dt)
+
+    def __len__(self): return self.times.shape[0]
+    def __repr__(self):
+        return '%s (%i values, %s)' % (self.__class__.__name__, self.times.shape[0],
+                                       "%i on the timestep grid" % self.grid.shape[0] if self.grid is not None else "not resampled")
+
+    def Interpolate(self, times):
+        """Return an array of the values at times, interpolated from the original values"""
+        times = asarray(times, dtype=float64)
+        t, v = self.times, self.data
+        if t.shape[0] == 1: return v[[0] * times.shape[0]]
+        ind = (searchsorted(t, times, side="right") - 1).clip(0, t.shape[0] - 2)
+        x0, x1 = t[ind], t[ind + 1]
+        y0, y1 = v[ind], v[ind + 1]
+        if self.width is not None: x0, x1, times = x0[:,None], x1[:,None], times[:,None]
+        val = y0 + ((y1-y0)*(times-x0))/(x1-x0)
+        # Exact times use the value itself, and ends are held
+        val = where(times == x1, y1, val)
+        val = where(times <= x0, y0, val)
+        return where(times >= x1, y1, val)
+
+    def Resample(self, start, stop, dt):
+        """Interpolate the values at every timestep from start to stop"""
+        self.start, self.dt = start, dt
+        self.grid = self.Interpolate(start + arange(int((stop - start) // dt) + 1) * dt)
+
+    def _Value(self, row):
+        """Return an array row as the Interpolator would have returned it"""
+        if self.width is None:
+            value = float(row)
+            return None if self.none and value != value else value
+        value = tuple(row.tolist())
+        if self.none: value = tuple([None if x != x else x for x in value])
+        return value
+
+    def __getitem__(self, time):
+        if self.grid is not None:
+            i = int((time - self.start) // self.dt)
+            if 0 <= i < self.grid.shape[0] and self.start + i * self.dt == time:
+                return self._Value(self.grid[i])
+        return self._Value(self.Interpolate([time])[0])
+
+    # Read-only parts of the dictionary interface, used during setup
+    def keys(self): return [int(t) for t in self.times]
+    def values(self): return [self._Value(v) for v in self.data]
+    def items(self): return zip(self.keys(), self.values())
+    def iterkeys(self): return iter(self.keys())
+    def itervalues(self): return iter(self.values())
+    def iteritems(self): return iter(self.items())
+    def __iter__(self): return self.iterkeys()
+    def __contains__(self, time): return time in self.keys()
+
+def ResampleSeries(nodes, start, stop, dt, attrs=("ContData", "Q_tribs", "T_tribs", "Q_bc", "T_bc")):
+    """Replace the nodes' Interpolators with TimeSeries on the model timestep
+
+    Nodes often share an Interpolator (e.g. the continuous data of the
+    closest site), so each one is converted only once and the TimeSeries
+    is shared in the same way. Empty Interpolators, and any that can't be
+    held in an array, are left alone."""
+    done = {}
+    for node in nodes:
+        for attr in attrs:
+            series = getattr(node, attr, None)
+            if not isinstance(series, Interpolator) or not len(series): continue
+            if id(series) not in done:
+                keys = sorted(series.keys())
+                try: new = TimeSeries(keys, [series[k] for k in keys], start, stop, dt)
+                except (ValueError, TypeError): new = series
+                # Keep the original, so its id isn't reused while we're working
+                done[id(series)] = series, new
+            setattr(node, attr, done[id(series)][1])
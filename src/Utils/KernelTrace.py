@@ -0,0 +1,185 @@
+"""Recording the kernels' arguments from a model run, to replay them later
+
+Synthetic reaches (see Benchmark/Synthetic.py) don't take the branches
+of the kernels that real ones do: emergent vegetation, topographic and
+partial vegetation shade, Penman or Jobson evaporation and so on. A
+KernelRecorder stands in for the kernel module (PyHeatsource or
+HSmodule) that the StreamNodes call, and passes every call through to
+it, but for a sample of the timesteps and nodes, it also writes the
+arguments and results of CalcFlows, CalcHeatFluxes and CalcMacCormick to
+a trace file. Benchmark/Replay.py feeds a trace through each kernel
+backend, and reports how fast it is and how far its results are from
+the recorded ones, without the workbook the trace came from.
+
+ModelControl records Kernels.trace in the output directory if
+IniParams["kerneltrace"] is set.
+
+A trace file is "HSKT", a version byte and the name of the recorded
+module (as a 2 byte length and the name), then a zlib stream of records.
+Each record is a byte for its kind. A call (1) is followed by the kernel
+(a byte, its index in kernels), the model time (a double), the call's
+index among the calls to that kernel in the timestep (an unsigned int),
+the index of its spec (an unsigned int) and then its values, as doubles.
+A spec is the shape of a call's (arguments, result) tuple, which is
+recorded (0) with a 2 byte length and the spec string the first time it
+appears: "(" and ")" around a tuple, "[" and "]" around a list, and "f",
+"i", "b" or "n" for each float, int, bool or None value.
+"""
+from struct import pack, unpack_from, calcsize
+from zlib import compressobj, decompressobj
+
+magic, version = "HSKT", 1
+# The kernels that are recorded, by their index in trace files
+kernels = ("CalcFlows", "CalcHeatFluxes", "CalcMacCormick")
+_spec, _call = "<BH", "<BBdII"
+
+def Flatten(value, spec, values):
+    """Append value's spec characters to the list spec, and its numbers to the list values"""
+    if hasattr(value, "tolist"): value = value.tolist() # NumPy arrays and numbers
+    if value is None:
+        spec.append("n")
+        values.append(0.0)
+    elif isinstance(value, tuple) or isinstance(value, list):
+        spec.append("(" if isinstance(value, tuple) else "[")
+        for item in value: Flatten(item, spec, values)
+        spec.append(")" if isinstance(value, tuple) else "]")
+    elif isinstance(value, bool):
+        spec.append("b")
+        values.append(float(value))
+    elif isinstance(value, (int, long)):
+        spec.append("i")
+        values.append(float(value))
+    else:
+        spec.append("f")
+        values.append(float(value))
+
+def Build(spec, values):
+    """Return the value that Flatten() turned into spec and values"""
+    stack, i = [[]], 0
+    for c in spec:
+        if c in "([": stack.append([])
+        elif c == ")":
+            item = tuple(stack.pop())
+            stack[-1].append(item)
+        elif c == "]":
+            item = stack.pop()
+            stack[-1].append(item)
+        else:
+            value = values[i]
+            i += 1
+            if c == "n": value = None
+            elif c == "b": value = bool(value)
+            elif c == "i": value = int(value)
+            stack[-1].append(value)
+    return stack[0][0]
+
+class KernelRecorder(object):
+    """A kernel module that records a sample of its calls to a trace file"""
+    def __init__(self, module, filename, steps=1, nodes=1):
+        """KernelRecorder(module, filename[, steps, nodes]) -> Class instance
+
+        module is the kernel module to call (PyHeatsource or HSmodule), and
+        every call to one of its kernels is recorded to filename if it's
+        in a sampled timestep, which is every steps'th timestep, and it's
+        every nodes'th call to that kernel in the timestep. The nodes call
+        the kernels in model order, so that's every nodes'th node, counting
+        from the first one to call the kernel. Anything else is simply
+        taken from the module."""
+        self.module = module
+        self.steps, self.nodes = max(int(steps), 1), max(int(nodes), 1)
+        self.filename = filename
+        name = module.__name__
+        self.file = open(filename, "wb")
+        self.file.write(magic + pack("<BH", version, len(name)) + name)
+        self.zip = compressobj(6)
+        self.specs = {} # Index of each spec in the file
+        self.records = 0
+        self.time = None
+        self.sampled = False
+        self.calls = [0] * len(kernels) # In this timestep
+        for i in xrange(len(kernels)):
+            setattr(self, kernels[i], self.Recorder(i, getattr(module, kernels[i])))
+
+    def __getattr__(self, name):
+        return getattr(self.module, name)
+
+    def Step(self, time, step):
+        """Start a timestep: time is the model time, and step its number from the start of the run"""
+        self.time = time
+        self.sampled = not step % self.steps
+        self.calls = [0] * len(kernels)
+
+    def Recorder(self, kernel, function):
+        """Return a function that calls function, and records the call if it's sampled"""
+        def Record(*args):
+            result = function(*args)
+            if self.sampled:
+                index = self.calls[kernel]
+                self.calls[kernel] += 1
+                if not index % self.nodes: self.Write(kernel, index, args, result)
+            return result
+        return Record
+
+    def Write(self, kernel, index, args, result):
+        """Write a call to the trace, and its spec if it's the first call with it"""
+        spec, values = [], []
+        Flatten((args, result), spec, values)
+        spec = "".join(spec)
+        if spec not in self.specs:
+            self.specs[spec] = len(self.specs)
+            self.Out(pack(_spec, 0, len(spec)) + spec)
+        self.Out(pack(_call, 1, kernel, self.time, index, self.specs[spec]) +
+                 pack("<%id" % len(values), *values))
+        self.records += 1
+
+    def Out(self, data):
+        """Compress data into the trace file"""
+        self.file.write(self.zip.compress(data))
+
+    def Close(self):
+        """Finish the trace file, and return the number of calls recorded"""
+        if self.file is not None:
+            self.file.write(self.zip.flush())
+            self.file.close()
+            self.file = None
+        return self.records
+
+def ReadTrace(filename):
+    """Return the name of the module a trace was recorded from, and its calls
+
+    The calls are a list of (kernel name, time, index, arguments, result),
+    in the order they were made. A trace that wasn't finished (if the
+    process was killed, say) gives the calls up to where it stops."""
+    f = open(filename, "rb")
+    try: data = f.read()
+    finally: f.close()
+    if data[:len(magic)] != magic: raise Exception("%s is not a kernel trace" % filename)
+    pos = len(magic)
+    file_version, length = unpack_from("<BH", data, pos)
+    if file_version != version:
+        raise Exception("%s is a version %i kernel trace, and we read version %i" % (filename, file_version, version))
+    pos += calcsize("<BH")
+    module = data[pos:pos + length]
+    data = decompressobj().decompress(data[pos + length:])
+    specs, calls, pos = [], [], 0
+    spec_size, call_size = calcsize(_spec), calcsize(_call)
+    while pos < len(data):
+        if not ord(data[pos]):
+            if pos + spec_size > len(data): break # Cut off
+            length = unpack_from(_spec, data, pos)[1]
+            pos += spec_size
+            if pos + length > len(data): break
+            spec = data[pos:pos + length]
+            pos += length
+            specs.append((spec, len([c for c in spec if c in "fibn"])))
+        else:
+            if pos + call_size > len(data): break
+            kind, kernel, time, index, spec = unpack_from(_call, data, pos)
+            pos += call_size
+            spec, count = specs[spec]
+            if pos + count * 8 > len(data): break
+            values = unpack_from("<%id" % count, data, pos)
+            pos += count * 8
+            args, result = Build(spec, values)
+            calls.append((kernels[kernel], time, index, args, result))
+    return module, calls
@@ -1,26 +1,110 @@
-from __future__ import division
-from time import ctime, strftime, gmtime
-from os.path import join, exists
+from __future__ import with_statement, division
+from time import strftime, gmtime
+from os.path import exists
 from os import makedirs
-from copy import deepcopy
-from pywintypes import Time as pyTime
+from numpy import asarray, zeros, empty, float64, minimum, maximum, arange, unique
+try:
+    from pywintypes import Time as pyTime
+except ImportError:
+    # No Windows (e.g. the Benchmark package on Linux), so no Excel either.
+    # This is the Excel date of a time, as in the hourly output files.
+    pyTime = lambda seconds: seconds / 86400.0 + 25569
 
 
 from ..Dieties.IniParamsDiety import IniParams
 from ..Dieties.ChronosDiety import Chronos
+from Writers import TextWriter, BinaryWriter, AsyncWriter
+from Timer import Timer
 
-from .. import opt
-try:
-    if opt(__name__):
-        import psyco.classes
-        object = psyco.classes.psyobj
-except ImportError: pass
+class NodeArrays(object):
+    """Arrays of node attributes, for an Output without a ReachState
+
+    Each attribute is gathered from the nodes as it's asked for, so that
+    the Output's variables can be written the same way for a ReachState
+    or a plain list of nodes."""
+    def __init__(self, nodes): self.nodes = nodes
+    def __getattr__(self, name):
+        if name == "nodes": raise AttributeError(name)
+        return asarray([getattr(x, name) for x in self.nodes], dtype=float64)
+
+class NodeColumns(object):
+    """Some of the nodes' columns of a ReachState's arrays"""
+    def __init__(self, state, columns): self.state, self.columns = state, columns
+    def __getattr__(self, name):
+        if name in ("state", "columns"): raise AttributeError(name)
+        return getattr(self.state, name)[self.columns]
+
+class DailySummary(object):
+    """Running daily minimum, mean and maximum of one variable at every node
+
+    The daily maxima of the last seven days are kept as well, for the
+    seven day average of the daily maximum (7DADM)."""
+    def __init__(self, n):
+        self.min, self.max, self.sum = empty(n, dtype=float64), empty(n, dtype=float64), zeros(n, dtype=float64)
+        self.count = 0 # Values added today
+        self.maxima = zeros((7, n), dtype=float64) # Ring of daily maxima
+        self.days = 0 # Days finished
+
+    def Add(self, values):
+        """Add one time's values to today's totals"""
+        if not self.count:
+            self.min[:] = values
+            self.max[:] = values
+            self.sum[:] = values
+        else:
+            minimum(self.min, values, self.min)
+            maximum(self.max, values, self.max)
+            self.sum += values
+        self.count += 1
+
+    def Day(self):
+        """Finish the day, returning its (min, mean, max, 7DADM) arrays
+
+        7DADM is None until there are seven days of maxima."""
+        self.maxima[self.days % 7] = self.max
+        self.days += 1
+        sevenday = self.maxima.mean(axis=0) if self.days >= 7 else None
+        mean = self.sum / self.count
+        self.count = 0
+        return self.min.copy(), mean, self.max.copy(), sevenday
 
 class Output(object):
     """Data and fileobject storage class"""
-    def __init__(self, reach, start_time, run_type):
+    # Every output variable, by the run_types it's written for: name,
+    # description and a function of the reach's arrays giving its values
+    # for every node. Shade and VTS are daily values (see daily()).
+    solar = (("Heat_Cond", "Streambed Conduction Flux (w/sq m)", lambda s: s.F_Conduction),
+             ("Heat_Conv", "Convection Flux (w/sq m)", lambda s: s.F_Convection),
+             ("Heat_Evap", "Evaporation Flux (w/sq m)", lambda s: s.F_Evaporation),
+             ("Heat_SR1", "Potential Solar Radiation Flux (w/sq m)", lambda s: s.F_Solar[:,1]),
+             ("Heat_SR4", "Surface Solar Radiation Flux (w/sq m)", lambda s: s.F_Solar[:,4]),
+             ("Heat_SR6", "Received Solar Radiation Flux (w/sq m)", lambda s: s.F_Solar[:,6]),
+             ("Heat_TR", "Thermal Radiation Flux (w/sq m)", lambda s: s.F_Longwave),
+             ("Shade", "Effective Shade", lambda s: (s.F_DailySum[:,1] - s.F_DailySum[:,4]) / s.F_DailySum[:,1]),
+             ("VTS", "View to Sky", lambda s: s.ViewToSky))
+    hydraulics = (("Hyd_DA", "Ave Depth (m)", lambda s: s.A / s.W_w),
+                  ("Hyd_DM", "Max Depth (m)", lambda s: s.d_w),
+                  ("Hyd_Flow", "Flow Rate (cms)", lambda s: s.Q),
+                  ("Hyd_Hyp", "Hyporheic Exchange (cms)", lambda s: s.Q_hyp),
+                  ("Hyd_Vel", "Flow Velocity (m/s)", lambda s: s.U),
+                  ("Hyd_WT", "Top Width (m)", lambda s: s.W_w))
+    both = (("Rate_Evap", "Evaporation Rate (mm/hr)", lambda s: s.E / s.dx / s.W_w * 3600 * 1000), #TODO: Check
+            ("Temp_H20", "Stream Temperature (*C)", lambda s: s.T),
+            ("Temp_Sed", "Sediment Temperature (*C)", lambda s: s.T_sed),
+            ("Hyd_Disp", "Hydraulic Dispersion (m2/s)", lambda s: s.Disp))
+    daily_vars = ("Shade", "VTS")
+    # File suffixes and description prefixes of the daily summaries
+    summary_desc = (("_Min", "Daily Minimum "),
+                    ("_Mean", "Daily Mean "),
+                    ("_Max", "Daily Maximum "),
+                    ("_7DADM", "Seven Day Average of Daily Maximum "))
+
+    def __init__(self, reach, start_time, run_type, state=None, resume=None):
         # Store a sorted list of StreamNodes. This all could be a bit more abstracted.
         self.nodes = sorted(reach.itervalues(),reverse=True)
+        # The values are read straight from the ReachState's arrays if
+        # we have one, and otherwise gathered from the nodes.
+        self.state = state if state is not None else NodeArrays(self.nodes)
         # A reference to the model's starting time (i.e. when spin-up is over)
         self.start_time = start_time
 
@@ -33,62 +117,113 @@ class Output(object):
         self.first_hour = True
         self.first_day = True
 
-        # Filenames and descriptions for each of the output files
-        desc = {}
-        if run_type < 2:
-            desc["Heat_Cond"] = "Streambed Conduction Flux (w/sq m)"
-            desc["Heat_Conv"] = "Convection Flux (w/sq m)"
-            desc["Heat_Evap"] = "Evaporation Flux (w/sq m)"
-            desc["Heat_SR1"] = "Potential Solar Radiation Flux (w/sq m)"
-            desc["Heat_SR4"] = "Surface Solar Radiation Flux (w/sq m)"
-            desc["Heat_SR6"] = "Received Solar Radiation Flux (w/sq m)"
-            desc["Heat_TR"] = "Thermal Radiation Flux (w/sq m)"
-            desc["Shade"] = "Effective Shade"
-            desc["VTS"] = "View to Sky"
-        if run_type != 1:
-            desc["Hyd_DA"] = "Ave Depth (m)"
-            desc["Hyd_DM"] = "Max Depth (m)"
-            desc["Hyd_Flow"] = "Flow Rate (cms)"
-            desc["Hyd_Hyp"] = "Hyporheic Exchange (cms)"
-            desc["Hyd_Vel"] = "Flow Velocity (m/s)"
-            desc["Hyd_WT"] = "Top Width (m)"
-        if not run_type:
-            desc["Rate_Evap"] = "Evaporation Rate (mm/hr)"
-            desc["Temp_H20"] = "Stream Temperature (*C)"
-            desc["Temp_Sed"] = "Sediment Temperature (*C)"
-            desc["Hyd_Disp"] = "Hydraulic Dispersion (m2/s)"
-
-        # Storage dictionary for the data.
-        self.data = {}
-        for name in desc.keys():
-            self.data[name] = {}
-        # make a deepcopy of the empty variables dictionary for use later
-        self.empty_vars = deepcopy(self.data)
-        # Empty dictionary to store file objects
-        self.files = {}
-
-        # Here we build up the self.files attribute by cycling through the
-        # filenames and descriptions
-        for key in desc.iterkeys():
-            # String concatenation takes up a bit of time, but still a lot less
-            # than writing to a file each time.
-            header = "Heat Source Hourly Output File:  "
-            header += desc[key]
-            header += "     File created on %s\n\n" % ctime()
-            header += "Datetime".ljust(14)
-            # Grab a joined list of left justified strings of all the kilometers
-            header += "".join([("%0.3f" % x.km).ljust(14) for x in self.nodes])
-            header += "\n"
-            # Now create a file object in the dictionary, and write the header
-            self.files[key] = open(join(IniParams["outputdir"], key + ".txt"), 'w')
-            self.files[key].write(header)
+        # Filenames, descriptions and value functions for each of the output files
+        variables = ()
+        if run_type < 2: variables += self.solar
+        if run_type != 1: variables += self.hydraulics
+        if not run_type: variables += self.both
+        # The variables to record (all of them by default) and to
+        # summarize each day. Nothing else is gathered from the model.
+        selected = IniParams["outputvariables"]
+        known = [name for name, d, f in self.solar + self.hydraulics + self.both]
+        for name in tuple(selected) + tuple(IniParams["outputsummary"]):
+            if name not in known: raise Exception("Unknown output variable: %s" % `name`)
+        summary = [name for name, d, f in variables if name in IniParams["outputsummary"] and name not in self.daily_vars]
+        written = [name for name, d, f in variables if (not selected or name in selected) and
+                   (IniParams["outputhourly"] or name in self.daily_vars)]
+        variables = [(name, d, f) for name, d, f in variables if name in written or name in summary]
+        desc = dict([(name, d) for name, d, f in variables if name in written])
+
+        # The nodes to record: the nearest node to each kilometer in
+        # outputsites, or else every outputnodes'th node from the headwater
+        km = asarray([x.km for x in self.nodes], dtype=float64)
+        if IniParams["outputsites"]:
+            self.columns = unique([abs(km - site).argmin() for site in IniParams["outputsites"]])
+        else: self.columns = arange(0, len(self.nodes), IniParams["outputnodes"])
+        if len(self.columns) < len(self.nodes):
+            if state is not None: self.state = NodeColumns(state, self.columns)
+            else: self.state = NodeArrays([self.nodes[i] for i in self.columns])
+        # Record every outputinterval'th hour
+        self.interval = IniParams["outputinterval"]
+
+        # Storage for a day of values: a (24 x nodes) array for each variable
+        # that's written hourly, the Excel time of each row, and the number
+        # of rows filled so far. These are reused every day.
+        n = len(self.columns)
+        self.times = zeros(24, dtype=float64)
+        self.row = 0
+        # Running daily statistics, written as <name>_Min, _Mean, _Max and _7DADM
+        self.summaries = [(name, DailySummary(n)) for name in summary]
+        summaries = dict(self.summaries)
+        daily = []
+        for name, d, f in variables:
+            if name not in summary: continue
+            for suffix, prefix in self.summary_desc:
+                desc[name + suffix] = prefix + d
+                daily.append(name + suffix)
+        # Each hourly variable's name, value function, buffer (None if it
+        # isn't written hourly) and summary (None if it isn't summarized)
+        self.hourly = [(name, f, zeros((24, n), dtype=float64) if name in written else None, summaries.get(name))
+                       for name, d, f in variables if name not in self.daily_vars]
+        self.daily_funcs = [(name, f) for name, d, f in variables if name in self.daily_vars]
+        # Rows handed to the writer so far, by file
+        self.written = dict([(name, 0) for name in desc.iterkeys()])
+        # Carry on from a checkpoint, if we're resuming one, with the files
+        # cut back to the rows that had been written when it was taken
+        if resume is not None: self.Restore(resume)
+        # The writer owns the files, and formats each day's values for them
+        Writer = {"text": TextWriter, "binary": BinaryWriter}[IniParams["outputformat"]]
+        args = IniParams["outputdir"], desc, km[self.columns].tolist(), daily, \
+               dict(self.written) if resume is not None else None
+        # Either write in the background, so the model doesn't wait on it, or right here
+        if IniParams["outputasync"]:
+            self.writer = AsyncWriter(Writer, args, IniParams["outputasync"], IniParams["outputqueue"])
+        else: self.writer = Writer(*args)
+
+    def Checkpoint(self):
+        """Return a dictionary of the buffers and running summaries, for Restore()
+
+        Everything handed to the writer is written out first, so that the
+        files hold at least the rows counted here."""
+        self.writer.flush()
+        values = {"Output.times": self.times.copy(), "Output.row": self.row, "Output.first_hour": self.first_hour}
+        for name, f, data, summary in self.hourly:
+            if data is not None: values["Output.data." + name] = data.copy()
+        for name, summary in self.summaries:
+            for attr in ("min", "max", "sum", "count", "maxima", "days"):
+                values["Output.summary.%s.%s" % (name, attr)] = getattr(summary, attr)
+        for name, rows in self.written.iteritems():
+            values["Output.written." + name] = rows
+        return values
+
+    def Restore(self, values):
+        """Restore the buffers and running summaries from Checkpoint()"""
+        missing = [name for name in self.written if "Output.written." + name not in values]
+        if missing: raise Exception("Output files %s are not in the checkpoint. Output settings must be the same as the checkpointed run's." % ", ".join(missing))
+        self.times[:] = values["Output.times"]
+        self.row = int(values["Output.row"])
+        self.first_hour = bool(values["Output.first_hour"])
+        for name, f, data, summary in self.hourly:
+            if data is not None: data[:] = values["Output.data." + name]
+        for name, summary in self.summaries:
+            for attr in ("min", "max", "sum", "maxima"):
+                getattr(summary, attr)[:] = values["Output.summary.%s.%s" % (name, attr)]
+            summary.count = int(values["Output.summary.%s.count" % name])
+            summary.days = int(values["Output.summary.%s.days" % name])
+        for name in self.written:
+            self.written[name] = int(values["Output.written." + name])
+
+    def send(self, name, times, rows):
+        """Hand rows of a file's values to the writer"""
+        self.written[name] += len(times)
+        self.writer.Write(name, times, rows)
 
     def close(self):
         # Flush the rest of the values from the dataset by flushing the
         # daily values and by calling the write() method
         # self.write(self.run_type < 2)  #commented out this line so shade wouldn't output last day twice - DT
         # Then close all of the file objects cleanly
-        [f.close() for f in self.files.itervalues()]
+        with Timer("run.write"): self.writer.close()
 
     def __call__(self, time, hour):
         """Call the storage method with a time and an hour"""
@@ -98,75 +233,63 @@ class Output(object):
         if self.first_hour:
             self.first_hour = False
             #return
-        # Create an Excel-friendly time string
-        timestamp = ("%0.6f" % float(time/86400 + 25569)).ljust(14)
-        # Localize variables to save a bit of time
-        nodes = self.nodes
-        data = self.data
-        # Cycle through each datatype, creating a list of values
-        # corresponding to the nodes for this timestamp. Thus, each
-        # timestamp conforms to a single line, and each element in the
-        # list comprehension conforms to a column. List comprehensions
-        # are generally fast (more optimized by the underlying C code)
-        # than for loops.
-
-        # Run only with solar
-        if self.run_type < 2:
-            data["Heat_Cond"][timestamp] = [x.F_Conduction for x in nodes]
-            data["Heat_Conv"][timestamp] = [x.F_Convection for x in nodes]
-            data["Heat_Evap"][timestamp] = [x.F_Evaporation for x in nodes]
-            data["Heat_SR1"][timestamp] = [x.F_Solar[1] for x in nodes]
-            data["Heat_SR4"][timestamp] = [x.F_Solar[4] for x in nodes]
-            data["Heat_SR6"][timestamp] = [x.F_Solar[6] for x in nodes]
-            data["Heat_TR"][timestamp] = [x.F_Longwave for x in nodes]
-        # Run only with hydro
-        if self.run_type != 1:
-            data["Hyd_DA"][timestamp] = [(x.A / x.W_w) for x in nodes]
-            data["Hyd_DM"][timestamp] = [x.d_w for x in nodes]
-            data["Hyd_Flow"][timestamp] = [x.Q for x in nodes]
-            data["Hyd_Hyp"][timestamp] = [x.Q_hyp for x in nodes]
-            data["Hyd_Vel"][timestamp] = [x.U for x in nodes]
-            data["Hyd_WT"][timestamp] = [x.W_w for x in nodes]
-        # Run only with both solar and hydro
-        if not self.run_type:
-            data["Rate_Evap"][timestamp] = [(x.E / x.dx / x.W_w * 3600 * 1000) for x in nodes] #TODO: Check
-            data["Temp_H20"][timestamp] = [x.T for x in nodes]
-            data["Temp_Sed"][timestamp] = [x.T_sed for x in nodes]
-            data["Hyd_Disp"][timestamp] = [x.Disp for x in nodes]
+        # A day's buffer is full without reaching hour 23 (which shouldn't
+        # happen) so we write it out rather than lose anything.
+        if self.row == 24: self.flush()
+        # Store the Excel-friendly time and the values of every variable that's
+        # recorded this hour in the next row of the buffers, and add the
+        # summarized variables' values to their daily statistics
+        i = self.row
+        record = not hour % self.interval
+        if record: self.times[i] = time/86400 + 25569
+        state = self.state
+        with Timer("run.gather"):
+            for name, f, data, summary in self.hourly:
+                if record and data is not None:
+                    data[i] = f(state)
+                    values = data[i]
+                elif summary is not None: values = f(state)
+                else: continue
+                if summary is not None: summary.Add(values)
+        if record: self.row += 1
 
         # Zero for an hour means a new day, so we add daily outputs
         # and write to the file. Writing only every day saves us
         # 24xF file accesses where F=len(self.files). Each file access
         # has quite a bit of overhead, so we lump them. It's "A Good Thing."
         if hour == 23:
-            self.write(self.run_type < 2)
+            with Timer("run.write"):
+                self.write(self.run_type < 2)
+                # The day's summaries are dated at midnight
+                self.summarize((time/86400 + 25569) // 1)
 
     def daily(self, timestamp):
-        """Compile and store data that is collected every hour"""
-        nodes = self.nodes
-        self.data["Shade"][timestamp] = [((x.F_DailySum[1] - x.F_DailySum[4]) / x.F_DailySum[1]) for x in nodes]
-        self.data["VTS"][timestamp] = [x.ViewToSky for x in nodes]
-        # If there's no hour, we're at the beginning of a day, so we write the values
-        # to a file.
+        """Write the data that is collected once a day"""
+        for name, f in self.daily_funcs:
+            self.send(name, asarray([timestamp]), f(self.state)[None,:].copy())
+
+    def summarize(self, day):
+        """Write the day's summaries of the summarized variables"""
+        day = asarray([day])
+        for name, summary in self.summaries:
+            if not summary.count: continue
+            low, mean, high, sevenday = summary.Day()
+            self.send(name + "_Min", day, low[None,:])
+            self.send(name + "_Mean", day, mean[None,:])
+            self.send(name + "_Max", day, high[None,:])
+            if sevenday is not None: self.send(name + "_7DADM", day, sevenday[None,:])
 
     def write(self, daily):
         if daily: # don't call for hydraulics
-            self.daily(("%0.6f" % float(pyTime(Chronos()))).ljust(14))
-        # localize the
-        data = self.data
-        # Cycle through the file objects
-        for name, fileobj in self.files.iteritems():
-            # Each time is a single line, so we want to iterate over all the times
-            # stored so far. We can do this because everytime we store data, we
-            # append the time string to self.times
-            line = ""
-            timelist = sorted(data[name].keys())
-            for timestamp in timelist:
-                line += timestamp
-                line += "".join([("%0.4f" % x).ljust(14) for x in data[name][timestamp]])
-                line += "\n"
-            # finally, write all the lines to the file
-            fileobj.write(line)
-        del data
-        # Now empty out the dictionary by simply copying a new one.
-        self.data = deepcopy(self.empty_vars)
\ No newline at end of file
+            self.daily(float(pyTime(Chronos())))
+        self.flush()
+
+    def flush(self):
+        """Write the hourly rows we've filled, and start the buffers over"""
+        # Hand over a copy of the rows (the writer may be working in the
+        # background while we fill them again tomorrow)
+        rows = self.row
+        for name, f, data, summary in self.hourly:
+            if data is not None:
+                self.send(name, self.times[:rows].copy(), data[:rows].copy())
+        self.row = 0
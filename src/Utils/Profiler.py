@@ -0,0 +1,84 @@
+"""Profiling a window of model time
+
+When a run slows down partway through, the whole run's profile hides
+why. A ProfileWindow turns on cProfile, and tracemalloc where this
+Python has it, for the timesteps of a chosen window of model time, and
+writes what it found to the output directory when the window closes:
+
+Profile.prof is the cProfile data, for pstats or any profile viewer.
+Profile.txt is the functions that took the most time, by cumulative
+and internal time.
+Allocations.txt is the lines that allocated the most memory still held
+at the end of the window (only with tracemalloc).
+
+ModelControl makes one if IniParams["profilewindow"] is set, and
+otherwise the run does no profiling at all.
+"""
+from __future__ import division
+from cProfile import Profile
+from pstats import Stats
+from os.path import join
+from time import ctime
+try:
+    import tracemalloc # Python 3.4 and up
+except ImportError:
+    tracemalloc = None
+
+class ProfileWindow(object):
+    """Profile the timesteps from one model time up to another"""
+    def __init__(self, begin, end, outputdir, log=None):
+        """ProfileWindow(begin, end, outputdir[, log]) -> Class instance
+
+        begin and end are model times in seconds since the epoch, and the
+        window is the timesteps from begin up to, but not including, end."""
+        if end <= begin: raise Exception("The profile window must end after it begins")
+        self.begin, self.end = begin, end
+        self.outputdir = outputdir
+        self.log = log
+        self.profile = None # The running profiler
+        self.done = False
+
+    def __call__(self, time):
+        """Start or stop profiling, as time (the timestep about to be run) enters or leaves the window"""
+        if self.done: return
+        if self.profile is None:
+            if self.begin <= time < self.end: self.Start()
+        elif time >= self.end: self.Stop()
+
+    def Start(self):
+        if tracemalloc is not None: tracemalloc.start(1)
+        elif self.log is not None:
+            self.log.write("This Python has no tracemalloc, so the profile window won't trace allocations")
+        self.profile = Profile()
+        self.profile.enable()
+
+    def Stop(self):
+        """Stop profiling, if we are, and write the results"""
+        if self.profile is None: return
+        self.profile.disable()
+        snapshot = None
+        if tracemalloc is not None:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        self.done = True
+        window = "Model time %s to %s" % (ctime(self.begin), ctime(self.end))
+        self.profile.dump_stats(join(self.outputdir, "Profile.prof"))
+        f = open(join(self.outputdir, "Profile.txt"), "w")
+        try:
+            f.write(window + "\n\n")
+            stats = Stats(self.profile, stream=f)
+            stats.sort_stats("cumulative").print_stats(50)
+            stats.sort_stats("time").print_stats(50)
+        finally: f.close()
+        if snapshot is not None:
+            snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                               tracemalloc.Filter(False, __file__),
+                                               tracemalloc.Filter(False, "<frozen importlib._bootstrap>")))
+            f = open(join(self.outputdir, "Allocations.txt"), "w")
+            try:
+                f.write(window + "\n\n")
+                for stat in snapshot.statistics("lineno")[:50]:
+                    f.write("%s\n" % stat)
+            finally: f.close()
+        self.profile = None
+        if self.log is not None: self.log.write("Profile window written: %s" % window)
@@ -0,0 +1,87 @@
+"""Wall time and call counts of the phases of a model run
+
+The model's phases (reading the workbook, hydraulics, heat, output and
+so on) are timed by wrapping them in a with statement:
+
+    with Timer("run.heat"):
+        ...
+
+Each phase is timed by a single reusable object, so timing a block costs
+a dictionary lookup and two clock readings, which is nothing next to a
+timestep of the reach. It's always on, and ModelControl writes the times
+to Timing.csv in the output directory at the end of a run.
+
+Phase names are dotted, with a phase's parent before the last dot, so
+"run.heat.solar" is part of "run.heat", which is part of "run". The
+report gives each phase's share of its parent, and the time in each
+parent that isn't in any of its timed children as "<parent>.other".
+"""
+from __future__ import division
+from timeit import default_timer as clock # The most precise wall clock on each platform
+
+class Phase(object):
+    """Accumulated time of one phase, and a context manager to time it"""
+    __slots__ = ("seconds", "calls", "start")
+    def __init__(self):
+        self.seconds, self.calls, self.start = 0.0, 0, None
+    def __enter__(self):
+        self.start = clock()
+        return self
+    def __exit__(self, *exc_info):
+        self.seconds += clock() - self.start
+        self.calls += 1
+
+class TimerDiety(object):
+    def __init__(self):
+        self.Reset()
+
+    def Reset(self):
+        """Forget every phase's times, to start a new run"""
+        self.phases = {}
+        self.order = [] # Phase names, in the order they were first timed
+
+    def __call__(self, name):
+        """Return the Phase called name, for a with statement"""
+        try: return self.phases[name]
+        except KeyError:
+            self.phases[name] = phase = Phase()
+            self.order.append(name)
+            return phase
+
+    def Add(self, name, seconds, calls=1):
+        """Add seconds to a phase timed some other way than with a with statement"""
+        phase = self(name)
+        phase.seconds += seconds
+        phase.calls += calls
+
+    def Rows(self):
+        """Return a list of (phase, calls, seconds, fraction of parent) of the timed phases
+
+        Each parent is followed by its children, then its untimed remainder."""
+        children = {}
+        for name in self.order:
+            children.setdefault(name.rpartition(".")[0], []).append(name)
+        rows = []
+        def Add(parent):
+            for name in children.get(parent, []):
+                phase = self.phases[name]
+                if not phase.calls: continue # Set up, but never used
+                whole = self.phases[parent].seconds if parent else phase.seconds
+                rows.append((name, phase.calls, phase.seconds, phase.seconds / whole if whole else 0.0))
+                if name in children:
+                    Add(name)
+                    other = phase.seconds - sum([self.phases[x].seconds for x in children[name]])
+                    rows.append((name + ".other", phase.calls, other, other / phase.seconds if phase.seconds else 0.0))
+        Add("")
+        return rows
+
+    def Report(self, filename):
+        """Write the timed phases to a comma separated file"""
+        f = open(filename, "w")
+        try:
+            f.write("phase,calls,seconds,fraction_of_parent,seconds_per_call\n")
+            for name, calls, seconds, fraction in self.Rows():
+                f.write("%s,%i,%0.6f,%0.4f,%0.9f\n" % (name, calls, seconds, fraction, seconds / calls if calls else 0.0))
+        finally: f.close()
+
+Timer = TimerDiety()
@@ -0,0 +1,247 @@
+"""File writers for the Output class
+
+Output gathers the model's values each hour and hands them to a writer
+once a day as a block of rows, one row per time and one column per node.
+The writer decides what the files look like:
+
+TextWriter is the original Heat Source hourly output, a fixed width text
+file per variable with an Excel date in the first column.
+
+BinaryWriter appends the blocks as raw float64 data to a NumPy .npy file
+per variable, so a day's output costs no more than copying it to disk.
+The files' headers are rewritten with the final shape when they're
+closed, so numpy.load() (with mmap_mode="r" to read only a slice) opens
+them directly. Each variable has a matching <name>_time.npy with the
+Excel dates of its rows, and Output_km.npy has the node kilometers.
+
+AsyncWriter runs either of these in a background thread or process, fed
+through a bounded queue, so the model can keep running while a day's
+output is formatted and written.
+"""
+from __future__ import division
+from time import ctime
+from os.path import join, exists, getsize
+from threading import Thread
+from Queue import Queue, Empty
+from traceback import format_exc
+from numpy import asarray, empty, float64, save
+
+class TextWriter(object):
+    """Fixed width text files, one per variable"""
+    def __init__(self, outputdir, desc, km, daily=(), rows=None):
+        """TextWriter(outputdir, desc, km[, daily, rows]) -> Class instance
+
+        desc is a dictionary of file descriptions by variable name, and km
+        is the list of node kilometers, in model order. Files named in daily
+        are headed as daily rather than hourly output. If rows is given, it's
+        a dictionary of the number of rows to keep in each existing file,
+        which is then added to rather than started over (see Checkpoint.py)."""
+        self.files = {}
+        self.templates = {} # Format of a line, by number of columns
+        # Here we build up the self.files attribute by cycling through the
+        # filenames and descriptions
+        for key in desc.iterkeys():
+            if rows is not None:
+                self.files[key] = self.Reopen(join(outputdir, key + ".txt"), rows[key])
+                continue
+            # String concatenation takes up a bit of time, but still a lot less
+            # than writing to a file each time.
+            header = "Heat Source %s Output File:  " % ("Daily" if key in daily else "Hourly")
+            header += desc[key]
+            header += "     File created on %s\n\n" % ctime()
+            header += "Datetime".ljust(14)
+            # Grab a joined list of left justified strings of all the kilometers
+            header += "".join([("%0.3f" % x).ljust(14) for x in km])
+            header += "\n"
+            # Now create a file object in the dictionary, and write the header
+            self.files[key] = open(join(outputdir, key + ".txt"), 'w')
+            self.files[key].write(header)
+
+    def Reopen(self, filename, rows):
+        """Open an existing file, keeping its header and the first rows lines"""
+        if not exists(filename): raise Exception("Can't resume output, %s is missing" % filename)
+        f = open(filename, "r+")
+        for i in xrange(rows + 3): # The header is three lines
+            if not f.readline():
+                raise Exception("Can't resume output, %s has fewer rows than the checkpoint" % filename)
+        f.truncate(f.tell())
+        f.seek(0, 2)
+        return f
+
+    def Write(self, name, times, rows):
+        """Write rows of values, with their Excel dates, to the named file"""
+        rows = asarray(rows, dtype=float64)
+        if not rows.shape[0]: return
+        # A left justified conversion pads just as ljust() does, so one
+        # template line per row, filled from a flat tuple of Python floats
+        # (which format faster than NumPy's), formats the whole block at once.
+        block = empty((rows.shape[0], rows.shape[1] + 1), dtype=float64)
+        block[:,0] = times
+        block[:,1:] = rows
+        if rows.shape[1] not in self.templates:
+            self.templates[rows.shape[1]] = "%-14.6f" + "%-14.4f" * rows.shape[1] + "\n"
+        self.files[name].write((self.templates[rows.shape[1]] * rows.shape[0]) % tuple(block.ravel().tolist()))
+
+    def flush(self):
+        [f.flush() for f in self.files.itervalues()]
+
+    def close(self):
+        [f.close() for f in self.files.itervalues()]
+
+class NpyAppender(object):
+    """A two dimensional .npy file that grows a block of rows at a time"""
+    # Room for the header dictionary with any shape we're likely to see
+    header_length = 128
+    def __init__(self, filename, columns, rows=None):
+        """NpyAppender(filename, columns[, rows]) -> Class instance
+
+        columns is None for a one dimensional file. If rows is given, the
+        file exists and is cut back to that many rows, to be added to."""
+        self.columns = columns
+        if rows is None:
+            self.file = open(filename, "wb")
+            self.rows = 0
+        else:
+            if not exists(filename): raise Exception("Can't resume output, %s is missing" % filename)
+            self.file = open(filename, "r+b")
+            self.rows = rows
+            size = self.header_length + rows * (columns or 1) * 8
+            if getsize(filename) < size:
+                raise Exception("Can't resume output, %s has fewer rows than the checkpoint" % filename)
+            self.file.truncate(size)
+        self.WriteHeader()
+
+    def WriteHeader(self):
+        """Write (or rewrite) the .npy header for the current shape"""
+        if self.columns is None: shape = "(%i,)" % self.rows
+        else: shape = "(%i, %i)" % (self.rows, self.columns)
+        header = "{'descr': '<f8', 'fortran_order': False, 'shape': %s, }" % shape
+        # Magic string, version 1.0, header length, then the padded header
+        pad = self.header_length - 10
+        self.file.seek(0)
+        self.file.write("\x93NUMPY\x01\x00" + chr(pad % 256) + chr(pad // 256) + header.ljust(pad - 1) + "\n")
+
+    def Append(self, block):
+        block = asarray(block, dtype="<f8")
+        self.file.seek(0, 2)
+        self.file.write(block.tostring())
+        self.rows += block.shape[0]
+
+    def flush(self):
+        """Bring the header up to date and write everything out"""
+        self.WriteHeader()
+        self.file.flush()
+
+    def close(self):
+        self.WriteHeader()
+        self.file.close()
+
+class BinaryWriter(object):
+    """Growing .npy files of (time x node) values, one per variable"""
+    def __init__(self, outputdir, desc, km, daily=(), rows=None):
+        """BinaryWriter(outputdir, desc, km[, daily, rows]) -> Class instance
+
+        Arguments are those of TextWriter. Every variable has a time file,
+        so daily is not needed here."""
+        save(join(outputdir, "Output_km.npy"), asarray(km, dtype=float64))
+        self.desc = desc
+        self.files, self.times = {}, {}
+        for key in desc.iterkeys():
+            keep = rows[key] if rows is not None else None
+            self.files[key] = NpyAppender(join(outputdir, key + ".npy"), len(km), keep)
+            self.times[key] = NpyAppender(join(outputdir, key + "_time.npy"), None, keep)
+
+    def Write(self, name, times, rows):
+        """Append rows of values, and their Excel dates, to the named variable"""
+        if not len(times): return
+        self.files[name].Append(rows)
+        self.times[name].Append(times)
+
+    def flush(self):
+        [f.flush() for f in self.files.itervalues()]
+        [f.flush() for f in self.times.itervalues()]
+
+    def close(self):
+        [f.close() for f in self.files.itervalues()]
+        [f.close() for f in self.times.itervalues()]
+
+def WriterLoop(Writer, args, queue, errors, done):
+    """Create a Writer(*args) and pass it everything from queue until we get None
+
+    A "flush" in the queue flushes the writer, and puts True in done once
+    that's finished. If anything goes wrong, the traceback is put in errors,
+    and the rest of the queue is drained (so nobody waits on it) but not
+    written, with False put in done for any flushes."""
+    writer = None
+    try:
+        writer = Writer(*args)
+        while True:
+            item = queue.get()
+            if item is None: break
+            if item == "flush":
+                writer.flush()
+                done.put(True)
+            else: writer.Write(*item)
+    except Exception:
+        errors.put(format_exc())
+        while True:
+            item = queue.get()
+            if item is None: break
+            if item == "flush": done.put(False)
+    if writer is not None:
+        try: writer.close()
+        except Exception: errors.put(format_exc())
+
+class AsyncWriter(object):
+    """Run a writer in a background thread or process"""
+    def __init__(self, Writer, args, mode="thread", maxsize=64):
+        """AsyncWriter(Writer, args[, mode, maxsize]) -> Class instance
+
+        Writer(*args) is created in the background, and called through a
+        queue that holds at most maxsize blocks, so if the writer falls
+        behind, Write() waits for it. mode is "thread" or "process". A
+        process does the formatting on another CPU, which a thread can't
+        do while the model holds the interpreter."""
+        if mode == "process":
+            from multiprocessing import Process, Queue as ProcessQueue
+            self.queue, self.errors, self.done = ProcessQueue(maxsize), ProcessQueue(), ProcessQueue()
+            self.worker = Process(target=WriterLoop, args=(Writer, args, self.queue, self.errors, self.done))
+        elif mode == "thread":
+            self.queue, self.errors, self.done = Queue(maxsize), Queue(), Queue()
+            self.worker = Thread(target=WriterLoop, args=(Writer, args, self.queue, self.errors, self.done))
+        else: raise Exception("Unknown output writer mode: %s" % `mode`)
+        # Don't keep the model from exiting if it dies without closing us
+        if mode == "thread": self.worker.setDaemon(True)
+        else: self.worker.daemon = True
+        self.worker.start()
+        self.closed = False
+
+    def Check(self):
+        """Raise an exception if the background writer has failed"""
+        try: error = self.errors.get_nowait()
+        except Empty: return
+        # We got an error, so there's no point in going on
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.worker.join()
+        raise Exception("The output writer failed, and output is incomplete:\n%s" % error)
+
+    def Write(self, name, times, rows):
+        """Queue rows for writing. They must not be changed after this call."""
+        self.Check()
+        self.queue.put((name, times, rows))
+
+    def flush(self):
+        """Wait for everything queued to be written out"""
+        self.Check()
+        self.queue.put("flush")
+        if not self.done.get(): self.Check()
+
+    def close(self):
+        """Wait for everything queued to be written, and close the files"""
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.worker.join()
+        self.Check()